@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Benchmark `scriptworker.cot.verify.compare_jsone_task_definition` against the old copy-and-diff loop.
+
+Uses the decision and action task definitions under tests/data/cotv4 as the
+runtime definitions.  Each is compared against several rebuilt definitions
+that differ deep inside the payload, followed by one that matches apart from
+empty values, like json-e output.
+
+Usage: benchmark_compare_jsone.py [MISMATCHES] [ITERATIONS]
+
+"""
+from __future__ import print_function
+
+import os
+import pprint
+import sys
+import time
+from copy import deepcopy
+
+import dictdiffer
+
+from scriptworker.cot.verify import compare_jsone_task_definition
+from scriptworker.exceptions import CoTError
+from scriptworker.utils import load_json_or_yaml, remove_empty_keys
+
+COTV4_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data", "cotv4")
+FIXTURES = ("decision_try.json", "decision_github_private.json", "action_github.json", "action_relpro.json", "action_retrigger.json")
+
+
+class FakeLink(object):
+    """The parts of a LinkOfTrust that compare_jsone_task_definition uses."""
+
+    def __init__(self, task):
+        """Initialize FakeLink."""
+        self.name = "decision"
+        self.task_id = "taskId"
+        self.task = task
+
+
+def old_compare_jsone_task_definition(parent_link, rebuilt_definitions):
+    """Compare the definitions the way scriptworker 36.0.2 did."""
+    diffs = []
+    for compare_definition in rebuilt_definitions["tasks"]:
+        if "taskId" in compare_definition:
+            del compare_definition["taskId"]
+        compare_definition = remove_empty_keys(compare_definition)
+        runtime_definition = remove_empty_keys(parent_link.task)
+
+        diff = list(dictdiffer.diff(compare_definition, runtime_definition))
+        if diff:
+            diffs.append(pprint.pformat(diff))
+            continue
+        break
+    else:
+        raise CoTError("{} {}: the runtime task doesn't match any rebuilt definition!\n{}".format(parent_link.name, parent_link.task_id, pprint.pformat(diffs)))
+
+
+def rebuilt_definitions(task, mismatches):
+    """Build ``mismatches`` near misses of ``task``, then a match padded with empty values."""
+    tasks = []
+    for i in range(mismatches):
+        definition = deepcopy(task)
+        definition["payload"].setdefault("env", {})["MISMATCH"] = str(i)
+        tasks.append(definition)
+    definition = deepcopy(task)
+    definition["taskId"] = "taskId"
+    definition["payload"]["emptyDict"] = {}
+    definition["extra"]["emptyList"] = []
+    definition["nullValue"] = None
+    tasks.append(definition)
+    return {"tasks": tasks}
+
+
+def main():
+    """Time each implementation on each fixture."""
+    mismatches = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    for fixture in FIXTURES:
+        link = FakeLink(load_json_or_yaml(os.path.join(COTV4_DIR, fixture), is_path=True))
+        results = []
+        for func in (old_compare_jsone_task_definition, compare_jsone_task_definition):
+            definitions = [rebuilt_definitions(link.task, mismatches) for _ in range(iterations)]
+            start = time.monotonic()
+            for rebuilt in definitions:
+                func(link, rebuilt)
+            results.append((time.monotonic() - start) / iterations)
+        print("{:<32} old {:8.3f}ms  new {:8.3f}ms  {:5.1f}x".format(fixture, results[0] * 1000, results[1] * 1000, results[0] / results[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Benchmark `remove_empty_keys`, `get_frozen_copy` and `get_unfrozen_copy`.
+
+These run on every chain of trust json-e comparison and every config load.
+``remove_empty_keys`` and ``get_frozen_copy`` are compared against their old
+implementations; ``get_unfrozen_copy`` is timed on its own to track it.
+Each is timed on the decision and action task definitions under
+tests/data/cotv4, on DEFAULT_CONFIG, and on a synthetic tree nested DEPTH
+levels deep, which shows how the old per-level deepcopy scales.
+
+Usage: benchmark_copies.py [ITERATIONS] [DEPTH]
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+from copy import deepcopy
+
+from immutabledict import immutabledict
+
+from scriptworker.constants import DEFAULT_CONFIG
+from scriptworker.utils import get_frozen_copy, get_unfrozen_copy, load_json_or_yaml, remove_empty_keys
+
+COTV4_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data", "cotv4")
+FIXTURES = ("decision_try.json", "decision_github_private.json", "action_github.json", "action_relpro.json", "action_retrigger.json")
+
+
+def old_remove_empty_keys(values, remove=({}, None, [], "null")):
+    """Remove empty keys the way scriptworker 36.0.2 did."""
+    if isinstance(values, dict):
+        return {key: old_remove_empty_keys(value, remove=remove) for key, value in deepcopy(values).items() if value not in remove}
+    if isinstance(values, list):
+        return [old_remove_empty_keys(value, remove=remove) for value in deepcopy(values) if value not in remove]
+    return values
+
+
+def old_get_frozen_copy(values):
+    """Freeze ``values`` the way scriptworker 36.0.2 did."""
+    if isinstance(values, (immutabledict, dict)):
+        return immutabledict({key: old_get_frozen_copy(value) for key, value in values.items()})
+    elif isinstance(values, (list, tuple)):
+        return tuple([old_get_frozen_copy(value) for value in values])
+    return values
+
+
+def nested_tree(depth):
+    """Build a tree of dicts and lists ``depth`` levels deep, with some empty values at each level."""
+    tree = {"leaf": "value"}
+    for i in range(depth):
+        tree = {"child": tree, "list": [i, None, {"x": i}], "empty": {}, "null": None, "name": "level{}".format(i)}
+    return tree
+
+
+def inputs(depth):
+    """Yield (name, mutable values, frozen values) to benchmark."""
+    for fixture in FIXTURES:
+        values = load_json_or_yaml(os.path.join(COTV4_DIR, fixture), is_path=True)
+        yield fixture, values, get_frozen_copy(values)
+    yield "DEFAULT_CONFIG", get_unfrozen_copy(DEFAULT_CONFIG), DEFAULT_CONFIG
+    values = nested_tree(depth)
+    yield "nested depth {}".format(depth), values, get_frozen_copy(values)
+
+
+def compare(name, label, old, new, iterations):
+    """Print the mean time of ``new``, and of ``old`` if there is one."""
+    new_time = timeit.timeit(new, number=iterations) / iterations
+    if old is None:
+        print("{:<30} {:<22} {:>18}  new {:9.1f}us".format(name, label, "", new_time * 1e6))
+        return
+    old_time = timeit.timeit(old, number=iterations) / iterations
+    print("{:<30} {:<22} old {:9.1f}us  new {:9.1f}us  {:6.1f}x".format(name, label, old_time * 1e6, new_time * 1e6, old_time / new_time))
+
+
+def main():
+    """Time each implementation on each input."""
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for name, values, frozen in inputs(depth):
+        assert remove_empty_keys(values) == old_remove_empty_keys(values)
+        assert get_frozen_copy(values) == old_get_frozen_copy(values)
+        compare(name, "remove_empty_keys", lambda: old_remove_empty_keys(values), lambda: remove_empty_keys(values), iterations)
+        compare(name, "get_frozen_copy", lambda: old_get_frozen_copy(values), lambda: get_frozen_copy(values), iterations)
+        compare(name, "get_frozen_copy frozen", lambda: old_get_frozen_copy(frozen), lambda: get_frozen_copy(frozen), iterations)
+        compare(name, "get_unfrozen_copy", None, lambda: get_unfrozen_copy(frozen), iterations)
+
+
+if __name__ == "__main__":
+    main()
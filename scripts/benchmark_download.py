@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Benchmark `scriptworker.utils.download_file` against the old 128-byte read loop.
+
+Serves a file of random bytes from a local aiohttp server, downloads it with
+each implementation, and prints the throughput.
+
+Usage: benchmark_download.py [SIZE_IN_MB] [ITERATIONS]
+
+"""
+from __future__ import print_function
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from scriptworker.context import Context
+from scriptworker.utils import download_file
+
+
+async def old_download_file(context, url, abs_filename, session=None, chunk_size=128):
+    """Download a file the way scriptworker 36.0.2 did."""
+    session = session or context.session
+    async with session.get(url) as resp:
+        with open(abs_filename, "wb") as fd:
+            while True:
+                chunk = await resp.content.read(chunk_size)
+                if not chunk:
+                    break
+                fd.write(chunk)
+
+
+async def heartbeat(intervals):
+    """Measure how late the event loop runs a 10ms sleep, like a reclaim would."""
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(0.01)
+        intervals.append(time.monotonic() - start - 0.01)
+
+
+async def run(size, iterations):
+    """Serve ``size`` bytes locally and time each download implementation."""
+    payload = os.urandom(size)
+
+    async def handler(request):
+        return web.Response(body=payload)
+
+    app = web.Application()
+    app.router.add_get("/artifact", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = "http://127.0.0.1:{}/artifact".format(port)
+
+    context = Context()
+    context.config = {"download_chunk_size": 1024 * 1024}
+    async with aiohttp.ClientSession() as session:
+        context.session = session
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "artifact")
+            for name, func in (("old 128-byte loop", old_download_file), ("download_file", download_file)):
+                durations = []
+                lags = []
+                for _ in range(iterations):
+                    lag_task = asyncio.ensure_future(heartbeat(lags))
+                    start = time.monotonic()
+                    await func(context, url, path, session=session)
+                    durations.append(time.monotonic() - start)
+                    lag_task.cancel()
+                    assert os.path.getsize(path) == size
+                best = min(durations)
+                print(
+                    "{:<20} best {:7.3f}s  {:8.1f} MB/s  max loop lag {:7.1f}ms".format(
+                        name, best, size / best / 1024 / 1024, max(lags or [0]) * 1000
+                    )
+                )
+    await runner.cleanup()
+
+
+size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+asyncio.get_event_loop().run_until_complete(run(size_mb * 1024 * 1024, iterations))
@@ -5,25 +5,55 @@ in S3.
 
 """
 import asyncio
+import contextlib
+import functools
 import gzip
+import hashlib
 import logging
 import mimetypes
 import os
+import random
+import shutil
+import time
 from pathlib import Path
 
 import aiohttp
 import arrow
 import async_timeout
+from taskcluster.exceptions import TaskclusterFailure
 
 from scriptworker.client import validate_artifact_url
-from scriptworker.exceptions import DownloadError, ScriptWorkerRetryException, ScriptWorkerTaskException
+from scriptworker.exceptions import DownloadError, ScriptWorkerException, ScriptWorkerRetryException, ScriptWorkerTaskException
 from scriptworker.task import get_decision_task_id, get_run_id, get_task_id
-from scriptworker.utils import add_enumerable_item_to_dict, download_file, get_loggable_url, raise_future_exceptions, retry_async, semaphore_wrapper
+from scriptworker.utils import (
+    add_enumerable_item_to_dict,
+    download_file,
+    filepaths_in_dir,
+    get_hash,
+    get_loggable_url,
+    load_json_or_yaml,
+    raise_future_exceptions,
+    retry_async,
+    rm,
+    run_in_executor,
+    semaphore_wrapper,
+)
 
 log = logging.getLogger(__name__)
 
 
 _GZIP_SUPPORTED_CONTENT_TYPE = ("text/plain", "application/json", "text/html", "application/xml")
+_COMPRESSION_BUFFER_SIZE = 1024 * 1024
+
+# Task scripts can register artifact hashes in this file in ``work_dir``
+TASK_ARTIFACT_MANIFEST = "artifact_manifest.json"
+# The ``artifact_manifest_check`` values that read it; "off" ignores it
+ARTIFACT_MANIFEST_CHECKS = ("stat", "sample")
+
+# The logs in ``task_log_dir`` that checkpoint_logs uploads while the task runs
+_CHECKPOINT_LOG_FILES = ("live_backing.log", "chain_of_trust.log")
+# How many seconds checkpoint_logs waits between checking the logs
+LOG_CHECKPOINT_POLL_INTERVAL = 1
 
 
 _EXTENSION_TO_MIME_TYPE = {
@@ -43,7 +73,12 @@ _EXTENSION_TO_MIME_TYPE = {
 async def upload_artifacts(context, files):
     """Compress and upload the requested files from ``artifact_dir``, preserving relative paths.
 
-    Compression only occurs with files known to be supported.
+    Compression only occurs with files known to be supported.  Files already
+    compressed by ``finalize_artifacts`` are only read again to upload them.
+
+    At most ``max_concurrent_uploads`` files are compressed and uploaded at
+    once, largest first, so the biggest uploads don't start last and
+    thousands of small files don't all hit the queue at the same time.
 
     This function expects the directory structure in ``artifact_dir`` to remain
     the same.  So if we want the files in ``public/...``, create an
@@ -58,46 +93,366 @@ async def upload_artifacts(context, files):
 
     """
 
-    def to_upload_future(target_path):
+    def get_size(target_path):
+        try:
+            return os.path.getsize(os.path.join(context.config["artifact_dir"], target_path))
+        except OSError:
+            return 0
+
+    async def upload(target_path):
         path = os.path.join(context.config["artifact_dir"], target_path)
-        content_type, content_encoding = compress_artifact_if_supported(path)
-        return asyncio.ensure_future(
-            retry_create_artifact(context, path, target_path=target_path, content_type=content_type, content_encoding=content_encoding)
-        )
+        async with context.upload_semaphore:
+            entry = get_artifact_manifest_entry(context, target_path)
+            if entry is not None:
+                # Already compressed by finalize_artifacts
+                content_type, content_encoding = entry["content_type"], entry["content_encoding"]
+            else:
+                # Compress in the default executor, so large logs don't block the event loop
+                content_type, content_encoding = await run_in_executor(
+                    functools.partial(
+                        compress_artifact_if_supported,
+                        path,
+                        compresslevel=context.config["artifact_compression_level"],
+                        min_size=context.config["artifact_compression_min_size"],
+                    ),
+                )
+            await retry_create_artifact(context, path, target_path=target_path, content_type=content_type, content_encoding=content_encoding)
 
-    tasks = list(map(to_upload_future, files))
+    start = time.monotonic()
+    files = sorted(files, key=get_size, reverse=True)
+    total_size = sum(map(get_size, files))
+    tasks = [asyncio.ensure_future(upload(target_path)) for target_path in files]
     await raise_future_exceptions(tasks)
+    log.info("uploaded {} artifacts: {}".format(len(files), _format_throughput(total_size, time.monotonic() - start)))
 
 
-def compress_artifact_if_supported(artifact_path):
+def compress_artifact_if_supported(artifact_path, compresslevel=9, min_size=0):
     """Compress artifacts with GZip if they're known to be supported.
 
-    This replaces the artifact given by a gzip binary.
+    This replaces the artifact given by a gzip binary.  The artifact is
+    compressed a block at a time into a temporary file, which is then
+    renamed over the original, so memory use doesn't grow with the artifact.
 
     Args:
         artifact_path (str): the path to compress
+        compresslevel (int, optional): the gzip compression level. Defaults to 9.
+        min_size (int, optional): don't compress artifacts smaller than this
+            many bytes. Defaults to 0.
 
     Returns:
         content_type, content_encoding (tuple):  Type and encoding of the file. Encoding equals 'gzip' if compressed.
 
     """
+    content_type, encoding, _ = _compress_and_hash(artifact_path, (), compresslevel, min_size)
+    return content_type, encoding
+
+
+def finalize_artifact(artifact_path, hash_algs, compresslevel=9, min_size=0):
+    """Hash an artifact, and compress it with GZip if supported, in a single read.
+
+    The hashes are of the uncompressed contents, as the chain of trust
+    expects.  Compression works as in ``compress_artifact_if_supported``.
+
+    Args:
+        artifact_path (str): the path to finalize.
+        hash_algs (list): the hash algorithms to compute, e.g. ``["sha256"]``.
+        compresslevel (int, optional): the gzip compression level. Defaults to 9.
+        min_size (int, optional): don't compress artifacts smaller than this
+            many bytes. Defaults to 0.
+
+    Returns:
+        dict: the ``content_type``, ``content_encoding`` and ``hashes`` of the
+            artifact, plus the ``stat`` of the finalized file.
+
+    """
+    content_type, encoding, hashes = _compress_and_hash(artifact_path, hash_algs, compresslevel, min_size)
+    stat = os.stat(artifact_path)
+    return {"content_type": content_type, "content_encoding": encoding, "hashes": hashes, "stat": (stat.st_size, stat.st_mtime_ns)}
+
+
+def _compress_and_hash(artifact_path, hash_algs, compresslevel, min_size):
     content_type, encoding = guess_content_type_and_encoding(artifact_path)
     log.debug('"{}" is encoded with "{}" and has mime/type "{}"'.format(artifact_path, encoding, content_type))
+    hashes = {alg: hashlib.new(alg) for alg in hash_algs}
 
-    if encoding is None and content_type in _GZIP_SUPPORTED_CONTENT_TYPE:
+    compress = encoding is None and content_type in _GZIP_SUPPORTED_CONTENT_TYPE and os.path.getsize(artifact_path) >= min_size
+    if compress:
         log.info('"{}" can be gzip\'d. Compressing...'.format(artifact_path))
-        with open(artifact_path, "rb") as f_in:
-            text_content = f_in.read()
-
-        with gzip.open(artifact_path, "wb") as f_out:
-            f_out.write(text_content)
-
-        encoding = "gzip"
-        log.info('"{}" compressed'.format(artifact_path))
     else:
         log.debug('"{}" is not supported for compression.'.format(artifact_path))
+    if compress or hashes:
+        tmp_path = "{}.gz.tmp".format(artifact_path)
+        try:
+            with contextlib.ExitStack() as stack:
+                f_in = stack.enter_context(open(artifact_path, "rb"))
+                f_out = stack.enter_context(gzip.open(tmp_path, "wb", compresslevel=compresslevel)) if compress else None
+                for chunk in iter(functools.partial(f_in.read, _COMPRESSION_BUFFER_SIZE), b""):
+                    for h in hashes.values():
+                        h.update(chunk)
+                    if f_out is not None:
+                        f_out.write(chunk)
+            if compress:
+                os.replace(tmp_path, artifact_path)
+        finally:
+            rm(tmp_path)
+    if compress:
+        encoding = "gzip"
+        log.info('"{}" compressed'.format(artifact_path))
+    return content_type, encoding, {alg: h.hexdigest() for alg, h in hashes.items()}
 
-    return content_type, encoding
+
+def load_task_artifact_manifest(context):
+    """Load the artifact hashes the task script registered in ``work_dir/artifact_manifest.json``.
+
+    The manifest looks like::
+
+        {
+          "public/build/target.zip": {"size": 1234, "mtime_ns": 1600000000000000000, "sha256": "abcd1234"},
+          ...
+        }
+
+    with paths relative to ``artifact_dir``.  Entries whose size and mtime
+    don't match the file on disk, or that lack a
+    ``chain_of_trust_hash_algorithm`` hash, are ignored.
+
+    The signed chain of trust artifact vouches for these hashes, so the
+    manifest is only read if the worker opts in by setting
+    ``artifact_manifest_check`` to ``stat`` or ``sample``.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    Returns:
+        dict: the trusted hashes, keyed by path relative to ``artifact_dir``.
+
+    """
+    if context.config["artifact_manifest_check"] not in ARTIFACT_MANIFEST_CHECKS:
+        return {}
+    path = os.path.join(context.config["work_dir"], TASK_ARTIFACT_MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        manifest = load_json_or_yaml(path, is_path=True, exception=ScriptWorkerTaskException, message="Can't load {}: %(exc)s".format(path))
+        if not isinstance(manifest, dict):
+            raise ScriptWorkerTaskException("{} isn't a dict!".format(path))
+    except ScriptWorkerTaskException as exc:
+        log.warning("Ignoring the task artifact manifest: {}".format(exc))
+        return {}
+    hash_alg = context.config["chain_of_trust_hash_algorithm"]
+    artifact_dir = os.path.abspath(context.config["artifact_dir"])
+    trusted = {}
+    for target_path, entry in manifest.items():
+        full_path = os.path.abspath(os.path.join(artifact_dir, target_path))
+        if os.path.commonpath([artifact_dir, full_path]) != artifact_dir or not isinstance(entry, dict) or not entry.get(hash_alg):
+            continue
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            continue
+        if (stat.st_size, stat.st_mtime_ns) == (entry.get("size"), entry.get("mtime_ns")):
+            trusted[os.path.relpath(full_path, artifact_dir)] = entry[hash_alg]
+    log.info("Using {} of {} hashes from the task artifact manifest".format(len(trusted), len(manifest)))
+    return trusted
+
+
+async def check_task_artifact_manifest(context, trusted):
+    """Spot-check the hashes from ``load_task_artifact_manifest``, per ``artifact_manifest_check``.
+
+    ``stat`` trusts the size and mtime comparison alone.  ``sample`` rehashes
+    ``artifact_manifest_sample_size`` random artifacts, and distrusts the
+    whole manifest if any of them don't match.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        trusted (dict): the hashes from ``load_task_artifact_manifest``.
+
+    Returns:
+        dict: the hashes to use, keyed by path relative to ``artifact_dir``.
+
+    """
+    if context.config["artifact_manifest_check"] != "sample" or not trusted:
+        return trusted
+    to_check = random.sample(sorted(trusted), min(context.config["artifact_manifest_sample_size"], len(trusted)))
+    hash_alg = context.config["chain_of_trust_hash_algorithm"]
+    shas = await raise_future_exceptions(
+        [
+            run_in_executor(functools.partial(get_hash, os.path.join(context.config["artifact_dir"], target_path), hash_alg=hash_alg))
+            for target_path in to_check
+        ]
+    )
+    mismatches = [target_path for target_path, sha in zip(to_check, shas) if sha != trusted[target_path]]
+    if mismatches:
+        log.warning("Task artifact manifest hashes don't match {}! Ignoring the manifest.".format(mismatches))
+        return {}
+    return trusted
+
+
+async def finalize_artifacts(context):
+    """Hash and compress every file in ``artifact_dir``, reading each once.
+
+    Hashes the task script registered in its artifact manifest are used
+    instead of hashing those files; see ``load_task_artifact_manifest``.
+
+    The results go in ``context.artifact_manifest``, keyed by the path
+    relative to ``artifact_dir``.  ``generate_cot`` takes the chain of trust
+    hashes from the manifest, and ``upload_artifacts`` skips compressing
+    files that haven't changed since.
+
+    ``upload_artifacts`` still reads each finalized file once more, rather
+    than uploading from this pass.  The queue's ``putUrl`` needs a
+    ``Content-Length``, which we don't know for a gzip'd artifact until
+    it's compressed.  The chain of trust artifact also has to list every
+    artifact before any of them are uploaded, and uploads are retried and
+    reported on their own, in ``do_upload``.  The second read is of the
+    compressed file, which was just written, so it's usually smaller and
+    still in the page cache.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    """
+    hash_alg = context.config["chain_of_trust_hash_algorithm"]
+    task_hashes = await check_task_artifact_manifest(context, load_task_artifact_manifest(context))
+    files = filepaths_in_dir(context.config["artifact_dir"])
+    tasks = [
+        run_in_executor(
+            functools.partial(
+                finalize_artifact,
+                os.path.join(context.config["artifact_dir"], target_path),
+                [] if target_path in task_hashes else [hash_alg],
+                compresslevel=context.config["artifact_compression_level"],
+                min_size=context.config["artifact_compression_min_size"],
+            ),
+        )
+        for target_path in files
+    ]
+    entries = await raise_future_exceptions(tasks)
+    for target_path, entry in zip(files, entries):
+        if target_path in task_hashes:
+            entry["hashes"][hash_alg] = task_hashes[target_path]
+    if context.artifact_manifest is None:
+        context.artifact_manifest = {}
+    context.artifact_manifest.update(zip(files, entries))
+
+
+def get_artifact_manifest_entry(context, target_path):
+    """Get the ``finalize_artifacts`` manifest entry for an artifact, if it's still current.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        target_path (str): the path of the artifact, relative to ``artifact_dir``.
+
+    Returns:
+        dict: the manifest entry, or None if there is no entry or the file
+            has changed since it was finalized.
+
+    """
+    entry = (context.artifact_manifest or {}).get(target_path)
+    if entry is None or "stat" not in entry:
+        return None
+    try:
+        stat = os.stat(os.path.join(context.config["artifact_dir"], target_path))
+    except OSError:
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != tuple(entry["stat"]):
+        return None
+    return entry
+
+
+# checkpoint_logs {{{1
+async def checkpoint_logs(context):
+    """Upload the task logs as artifacts every so often while the task runs.
+
+    Each log in ``task_log_dir`` is uploaded once ``log_checkpoint_interval``
+    seconds have passed, or it has grown by ``log_checkpoint_size`` bytes,
+    since its last checkpoint.  This way a task that never gets to upload its
+    logs, e.g. because the host went away, still leaves its logs behind.  The
+    final upload in ``upload_artifacts`` replaces the checkpoints.
+
+    Checkpoints are uploaded one at a time, at no more than
+    ``log_checkpoint_max_rate`` bytes a second on average.  This runs until
+    cancelled, and never raises on a failed checkpoint.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    """
+    interval = context.config["log_checkpoint_interval"]
+    size_threshold = context.config["log_checkpoint_size"]
+    max_rate = context.config["log_checkpoint_max_rate"]
+    if not interval and not size_threshold:
+        return
+    target_paths = []
+    for name in _CHECKPOINT_LOG_FILES:
+        target_path = os.path.relpath(os.path.join(context.config["task_log_dir"], name), context.config["artifact_dir"])
+        # Logs outside of artifact_dir aren't uploaded
+        if not target_path.startswith(os.pardir):
+            target_paths.append(target_path)
+    start = time.monotonic()
+    checkpointed = {}
+    while True:
+        await asyncio.sleep(LOG_CHECKPOINT_POLL_INTERVAL)
+        for target_path in target_paths:
+            try:
+                size = os.path.getsize(os.path.join(context.config["artifact_dir"], target_path))
+            except OSError:
+                continue
+            last_size, last_time = checkpointed.get(target_path, (0, start))
+            if size == last_size:
+                continue
+            if (interval and time.monotonic() - last_time >= interval) or (size_threshold and size - last_size >= size_threshold):
+                upload_start = time.monotonic()
+                uploaded = await checkpoint_log(context, target_path)
+                checkpointed[target_path] = (size, time.monotonic())
+                if max_rate:
+                    await asyncio.sleep(max(0, uploaded / max_rate - (time.monotonic() - upload_start)))
+
+
+async def checkpoint_log(context, target_path):
+    """Upload a snapshot of a log in ``artifact_dir`` that's still being written.
+
+    The log is copied, compressed if supported, into ``work_dir`` first, so
+    the upload doesn't change as the log grows.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        target_path (str): the path of the log, relative to ``artifact_dir``.
+
+    Returns:
+        int: the number of bytes uploaded, or 0 if the checkpoint failed.
+
+    """
+    path = os.path.join(context.config["artifact_dir"], target_path)
+    snapshot_path = os.path.join(context.config["work_dir"], "log_checkpoint")
+    content_type, content_encoding = guess_content_type_and_encoding(path)
+    compresslevel = None
+    if content_type in _GZIP_SUPPORTED_CONTENT_TYPE:
+        compresslevel = context.config["artifact_compression_level"]
+        content_encoding = "gzip"
+    try:
+        async with context.upload_semaphore:
+            size = await run_in_executor(functools.partial(_snapshot_file, path, snapshot_path, compresslevel))
+            context.log_checkpoints.add(target_path)
+            await retry_create_artifact(
+                context, snapshot_path, target_path=target_path, content_type=content_type, content_encoding=content_encoding, storage_type="s3"
+            )
+        return size
+    except (ScriptWorkerException, TaskclusterFailure, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        log.warning("Failed to checkpoint {}: {}".format(target_path, e))
+        return 0
+    finally:
+        rm(snapshot_path)
+
+
+def _snapshot_file(path, snapshot_path, compresslevel=None):
+    with open(path, "rb") as src:
+        if compresslevel is None:
+            dest = open(snapshot_path, "wb")
+        else:
+            dest = gzip.open(snapshot_path, "wb", compresslevel=compresslevel)
+        with dest:
+            shutil.copyfileobj(src, dest, _COMPRESSION_BUFFER_SIZE)
+    return os.path.getsize(snapshot_path)
 
 
 def guess_content_type_and_encoding(path):
@@ -164,6 +519,8 @@ async def create_artifact(context, path, target_path, content_type, content_enco
     skip_auto_headers = [aiohttp.hdrs.CONTENT_TYPE]
     loggable_url = get_loggable_url(tc_response["putUrl"])
     log.info("uploading {path} to {url}...".format(path=path, url=loggable_url))
+    size = os.path.getsize(path)
+    start = time.monotonic()
     with open(path, "rb") as fh:
         async with async_timeout.timeout(context.config["artifact_upload_timeout"]):
             async with context.session.put(
@@ -178,6 +535,11 @@ async def create_artifact(context, path, target_path, content_type, content_enco
                 log.info(response_text)
                 if resp.status not in (200, 204):
                     raise ScriptWorkerRetryException("Bad status {}".format(resp.status))
+    log.info("uploaded {}: {}".format(path, _format_throughput(size, time.monotonic() - start)))
+
+
+def _format_throughput(size, duration):
+    return "{} bytes in {:.2f}s, {:.1f} KiB/s".format(size, duration, size / 1024 / max(duration, 0.001))
 
 
 def _craft_artifact_put_headers(content_type, encoding=None):
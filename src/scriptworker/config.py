@@ -13,16 +13,14 @@ import os
 import re
 import sys
 from collections import Mapping
-from copy import deepcopy
 
-from immutabledict import immutabledict
 from yaml import safe_load
 
 from scriptworker.constants import DEFAULT_CONFIG
 from scriptworker.context import Context
 from scriptworker.exceptions import ConfigError
 from scriptworker.log import update_logging_config
-from scriptworker.utils import load_json_or_yaml
+from scriptworker.utils import get_frozen_copy, load_json_or_yaml
 
 log = logging.getLogger(__name__)
 
@@ -34,43 +32,6 @@ _GENERIC_ID_REGEX = re.compile(r"^[a-zA-Z0-9-_]{1,38}$")
 _VALUE_UNDEFINED_MESSAGE = "{path} {key} needs to be defined!"
 
 
-def get_frozen_copy(values):
-    """Convert `values`'s list values into tuples, and dicts into immutabledicts.
-
-    A recursive function(bottom-up conversion)
-
-    Args:
-        values (dict/list): the values/list to be modified in-place.
-
-    """
-    if isinstance(values, (immutabledict, dict)):
-        return immutabledict({key: get_frozen_copy(value) for key, value in values.items()})
-    elif isinstance(values, (list, tuple)):
-        return tuple([get_frozen_copy(value) for value in values])
-
-    # Nothing to freeze.
-    return values
-
-
-def get_unfrozen_copy(values):
-    """Recursively convert `value`'s tuple values into lists, and immutabledicts into dicts.
-
-    Args:
-        values (immutabledict/tuple): the immutabledict/tuple.
-
-    Returns:
-        values (dict/list): the unfrozen copy.
-
-    """
-    if isinstance(values, (immutabledict, dict)):
-        return {key: get_unfrozen_copy(value) for key, value in values.items()}
-    elif isinstance(values, (list, tuple)):
-        return [get_unfrozen_copy(value) for value in values]
-
-    # Nothing to unfreeze.
-    return values
-
-
 # read_worker_creds {{{1
 def read_worker_creds(key="credentials"):
     """Get credentials from CREDS_FILES or the environment.
@@ -138,6 +99,13 @@ def check_config(config, path):
             messages.append(_VALUE_UNDEFINED_MESSAGE.format(path=path, key=key))
         if key in ("provisioner_id", "worker_group", "worker_type", "worker_id") and not _is_id_valid(value):
             messages.append('{} doesn\'t match "{}" (required by Taskcluster)'.format(key, _GENERIC_ID_REGEX.pattern))
+    artifact_manifest_check = config_copy.get("artifact_manifest_check")
+    if isinstance(artifact_manifest_check, str) and artifact_manifest_check not in ("off", "stat", "sample"):
+        messages.append('{} artifact_manifest_check: {} isn\'t one of "off", "stat" or "sample"!'.format(path, artifact_manifest_check))
+    # Concurrent tasks need contextvars to keep their chain_of_trust.log files apart
+    max_concurrent_tasks = config_copy.get("max_concurrent_tasks")
+    if isinstance(max_concurrent_tasks, int) and max_concurrent_tasks > 1 and sys.version_info < (3, 7):
+        messages.append("{} max_concurrent_tasks: running more than 1 task at a time requires python 3.7+!".format(path))
     return messages
 
 
@@ -190,7 +158,8 @@ def create_config(config_path="scriptworker.yaml"):
         sys.exit(1)
     with open(config_path, "r", encoding="utf-8") as fh:
         secrets = safe_load(fh)
-    config = dict(deepcopy(DEFAULT_CONFIG))
+    # DEFAULT_CONFIG is frozen, so a shallow copy is enough to update
+    config = dict(DEFAULT_CONFIG)
     if not secrets.get("credentials"):
         secrets["credentials"] = read_worker_creds()
     config.update(secrets)
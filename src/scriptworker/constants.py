@@ -48,6 +48,9 @@ DEFAULT_CONFIG = immutabledict(
         "task_max_timeout": 60 * 20,
         "reclaim_interval": 300,
         "poll_interval": 10,
+        # If this is greater than poll_interval, back off exponentially (with
+        # jitter) up to this many seconds between polls while idle.
+        "max_poll_interval": 10,
         "sign_key_timeout": 60 * 2,
         "reversed_statuses": immutabledict({-11: STATUSES["intermittent-task"], -15: STATUSES["intermittent-task"]}),
         # Report this status on max_timeout. `intermittent-task` will rerun the
@@ -63,7 +66,62 @@ DEFAULT_CONFIG = immutabledict(
         "artifact_dir": "...",
         "task_log_dir": "...",  # set this to ARTIFACT_DIR/public/logs
         "artifact_upload_timeout": 60 * 20,
+        # gzip level for text artifacts, and the size below which we don't compress
+        "artifact_compression_level": 9,
+        "artifact_compression_min_size": 0,
+        # Serve the running task's log at http://livelog_host:livelog_port/log/<taskId>
+        # (0 disables this), and stream it to livelog_put_url ("" disables this).
+        "livelog_host": "127.0.0.1",
+        "livelog_port": 0,
+        # Let this origin read the served logs from a browser ("" allows none).
+        "livelog_allowed_origin": "",
+        "livelog_put_url": "",
+        # Upload the task logs every log_checkpoint_interval seconds, or when they
+        # grow by log_checkpoint_size bytes, while the task runs, at up to
+        # log_checkpoint_max_rate bytes a second.  0 disables each of these.
+        "log_checkpoint_interval": 0,
+        "log_checkpoint_size": 0,
+        "log_checkpoint_max_rate": 0,
+        # Write the task's resource usage to the task log and task_metrics.json.
+        # Sample it from /proc every task_metrics_interval seconds (0 disables
+        # sampling), and POST it as json to task_metrics_url ("" disables
+        # this), giving up after task_metrics_timeout seconds.
+        "report_task_metrics": False,
+        "task_metrics_interval": 0,
+        "task_metrics_url": "",
+        "task_metrics_timeout": 10,
         "max_concurrent_downloads": 5,
+        "max_concurrent_uploads": 10,
+        "download_chunk_size": 1024 * 1024,
+        # Download files of at least download_segment_threshold bytes over
+        # download_segments parallel connections, if the server accepts ranges.
+        "download_segments": 1,
+        "download_segment_threshold": 256 * 1024 * 1024,
+        # Keep upstream task definitions and chain of trust artifacts in this
+        # directory across tasks, up to artifact_cache_max_size bytes.  An
+        # empty string disables the cache.
+        "artifact_cache_dir": "",
+        "artifact_cache_max_size": 2 * 1024 * 1024 * 1024,
+        # Remember which decision, action and cron tasks have passed json-e
+        # verification, in memory, and skip re-verifying them.
+        "cache_verified_links": False,
+        # Verify them again after this many seconds.
+        "cache_verified_links_ttl": 24 * 60 * 60,
+        # Connection pool settings for the worker's long-lived aiohttp session.
+        "aiohttp_connection_limit": 100,
+        "aiohttp_dns_cache_ttl": 10 * 60,
+        "aiohttp_keepalive_timeout": 60,
+        # Claim and run up to this many tasks at once, each in its own
+        # ``slot{N}`` subdirectory of ``work_dir`` and ``artifact_dir``.
+        # Idle slots claim more work as soon as they free up.  Needs python 3.7+.
+        "max_concurrent_tasks": 1,
+        # Start the next claimWork as soon as the claimed tasks finish running,
+        # while their artifacts are still uploading.  Prefetched tasks are
+        # reclaimed every reclaim_interval until they start.  Only used when
+        # ``max_concurrent_tasks`` is 1.
+        "prefetch_claim_work": False,
+        # While idle, only call claimWork if the queue has pending tasks.
+        "check_pending_tasks": False,
         # chain of trust settings
         "sign_chain_of_trust": True,
         "verify_chain_of_trust": False,  # TODO True
@@ -73,6 +131,9 @@ DEFAULT_CONFIG = immutabledict(
         "cot_version": 3,
         "min_cot_version": 2,
         "max_chain_length": 20,
+        # Verify the task types and worker_impls of up to this many links at
+        # once.  Each link's log is held back and written in link order.
+        "max_concurrent_link_verifications": 1,
         # Calls to Github API are limited to 60 an hour. Using an API token allows to raise the limit to
         # 5000 per hour. https://developer.github.com/v3/#rate-limiting
         "github_oauth_token": "",
@@ -88,6 +149,10 @@ DEFAULT_CONFIG = immutabledict(
         "project_configuration_url": "https://hg.mozilla.org/ci/ci-configuration/raw-file/default/projects.yml",
         "pushlog_url": "{repo}/json-pushes?changeset={revision}&tipsonly=1&version=2&full=1",
         "chain_of_trust_hash_algorithm": "sha256",
+        # How to check the hashes task scripts register in
+        # work_dir/artifact_manifest.json: "off" (ignore it), "stat" or "sample"
+        "artifact_manifest_check": "off",
+        "artifact_manifest_sample_size": 5,
         "cot_schema_path": os.path.join(os.path.dirname(__file__), "data", "cot_v1_schema.json"),
         # for download url validation.  The regexes need to define a 'filepath'.
         "valid_artifact_rules": (
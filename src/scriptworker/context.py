@@ -8,6 +8,7 @@ object, let's point to them from a single context object.
 Attributes:
     log (logging.Logger): the log object for the module.
     DEFAULT_MAX_CONCURRENT_DOWNLOADS (int): default max concurrent downloads
+    DEFAULT_MAX_CONCURRENT_UPLOADS (int): default max concurrent uploads
 
 """
 import asyncio
@@ -15,19 +16,21 @@ import json
 import logging
 import os
 import tempfile
-from copy import deepcopy
+from collections.abc import Mapping
 
 import aiohttp
 import arrow
+from immutabledict import immutabledict
 from taskcluster.aio import Queue
 
 from scriptworker.exceptions import CoTError
-from scriptworker.utils import load_json_or_yaml_from_url, makedirs
+from scriptworker.utils import get_frozen_copy, load_json_or_yaml_from_url, makedirs
 
 log = logging.getLogger(__name__)
 
 
 DEFAULT_MAX_CONCURRENT_DOWNLOADS = 5
+DEFAULT_MAX_CONCURRENT_UPLOADS = 10
 
 
 class Context(object):
@@ -37,10 +40,20 @@ class Context(object):
     passing around config and easier overriding in tests.
 
     Attributes:
+        artifact_manifest (dict): the content type, encoding and hashes of
+            the artifacts finalized by ``scriptworker.artifacts.finalize_artifacts``,
+            keyed by path relative to ``artifact_dir``.
         config (dict): the running config.  In production this will be an
             immutabledict.
         credentials_timestamp (int): the unix timestamp when we last updated
             our credentials.
+        idle_poll_count (int): the number of polls in a row that found no
+            tasks to run.
+        livelog_server (scriptworker.livelog.LiveLogServer): serves the
+            running tasks' logs, if ``livelog_port`` is set.
+        log_checkpoints (set): the paths, relative to ``artifact_dir``, of the
+            logs ``scriptworker.artifacts.checkpoint_logs`` has uploaded for
+            the current task.
         proc (task_process.TaskProcess): when launching the script, this is
             the process object.
         queue (taskcluster.aio.Queue): the taskcluster Queue object
@@ -52,8 +65,12 @@ class Context(object):
 
     """
 
+    artifact_manifest = None
     config = None
     credentials_timestamp = None
+    idle_poll_count = 0
+    livelog_server = None
+    log_checkpoints = None
     proc = None
     queue = None
     session = None
@@ -61,12 +78,15 @@ class Context(object):
     temp_queue = None
     running_tasks = None
     _download_semaphore = None
+    _upload_semaphore = None
     _credentials = None
-    _claim_task = None  # This assumes a single task per worker.
+    _claim_task = None  # Concurrent tasks each get their own slot context.
     _event_loop = None
-    _temp_credentials = None  # This assumes a single task per worker.
+    _temp_credentials = None  # Concurrent tasks each get their own slot context.
     _reclaim_task = None
     _projects = None
+    _projects_by_repo = None
+    _verified_links = None
 
     @property
     def claim_task(self):
@@ -76,8 +96,9 @@ class Context(object):
         info.
 
         When setting ``claim_task``, we also set ``self.task`` and
-        ``self.temp_credentials``, zero out ``self.reclaim_task`` and ``self.proc``,
-        then write a task.json to disk.
+        ``self.temp_credentials``, zero out ``self.reclaim_task``, ``self.proc``,
+        ``self.artifact_manifest`` and ``self.log_checkpoints``, then write a
+        task.json to disk.
 
         """
         return self._claim_task
@@ -87,6 +108,8 @@ class Context(object):
         self._claim_task = claim_task
         self.reclaim_task = None
         self.proc = None
+        self.artifact_manifest = {}
+        self.log_checkpoints = set()
         if claim_task:
             self.task = claim_task["task"]
             self.verify_task()
@@ -107,23 +130,69 @@ class Context(object):
 
     @property
     def credentials(self):
-        """dict: The current scriptworker credentials.
+        """immutabledict: The current scriptworker credentials.
 
-        These come from the config or CREDS_FILES or environment.
+        These come from the config or CREDS_FILES or environment.  They're
+        frozen when set, so reading them doesn't copy them.
 
         When setting credentials, also create a new ``self.queue`` and
         update self.credentials_timestamp.
 
         """
         if self._credentials:
-            return dict(deepcopy(self._credentials))
+            return self._credentials
 
     @credentials.setter
     def credentials(self, creds):
-        self._credentials = creds
+        self._credentials = get_frozen_copy(creds)
         self.queue = self.create_queue(self.credentials)
         self.credentials_timestamp = arrow.utcnow().timestamp
 
+    def create_slot_context(self, slot):
+        """Create a ``Context`` to run a task in its own slot.
+
+        This is used when ``max_concurrent_tasks`` is greater than 1. The slot
+        context shares the config, session, worker credentials and queue,
+        projects, download and upload semaphores, verified links, and live log
+        server with this context, but has its own ``work_dir``, ``artifact_dir``,
+        and ``task_log_dir``, and tracks its own ``claim_task``, temp
+        credentials, reclaims, and task process.
+
+        Args:
+            slot (int): the slot number.
+
+        Returns:
+            Context: the slot context.
+
+        """
+        slot_name = "slot{}".format(slot)
+        config = dict(self.config)
+        config["work_dir"] = os.path.join(self.config["work_dir"], slot_name)
+        config["artifact_dir"] = os.path.join(self.config["artifact_dir"], slot_name)
+        # Keep the task logs at the same relative path inside the artifact_dir,
+        # so they're uploaded under the same artifact names.
+        task_log_relpath = os.path.relpath(self.config["task_log_dir"], self.config["artifact_dir"])
+        if task_log_relpath.startswith(os.pardir):
+            config["task_log_dir"] = os.path.join(self.config["task_log_dir"], slot_name)
+        else:
+            config["task_log_dir"] = os.path.join(config["artifact_dir"], task_log_relpath)
+
+        context = Context()
+        context.config = immutabledict(config) if isinstance(self.config, immutabledict) else config
+        context.event_loop = self.event_loop
+        context.session = self.session
+        context._credentials = self._credentials
+        context.queue = self.queue
+        context.credentials_timestamp = self.credentials_timestamp
+        context._projects = self._projects
+        context._projects_by_repo = self._projects_by_repo
+        context._download_semaphore = self.download_semaphore
+        context._upload_semaphore = self.upload_semaphore
+        context._verified_links = self.verified_links
+        context.running_tasks = self.running_tasks
+        context.livelog_server = self.livelog_server
+        return context
+
     @property
     def task_id(self):
         """string: The running task's taskId."""
@@ -139,7 +208,8 @@ class Context(object):
         """
         if credentials:
             session = self.session or aiohttp.ClientSession(loop=self.event_loop)
-            return Queue(options={"credentials": credentials, "rootUrl": self.config["taskcluster_root_url"]}, session=session)
+            # The taskcluster client encodes the credentials in place
+            return Queue(options={"credentials": dict(credentials), "rootUrl": self.config["taskcluster_root_url"]}, session=session)
 
     @property
     def reclaim_task(self):
@@ -164,17 +234,18 @@ class Context(object):
 
     @property
     def temp_credentials(self):
-        """dict: The latest temp credentials, or None if we haven't claimed a task yet.
+        """immutabledict: The latest temp credentials, or None if we haven't claimed a task yet.
 
-        When setting, create ``self.temp_queue`` from the temp taskcluster creds.
+        When setting, freeze them and create ``self.temp_queue`` from the temp
+        taskcluster creds.
 
         """
         if self._temp_credentials:
-            return dict(deepcopy(self._temp_credentials))
+            return self._temp_credentials
 
     @temp_credentials.setter
     def temp_credentials(self, credentials):
-        self._temp_credentials = credentials
+        self._temp_credentials = get_frozen_copy(credentials)
         self.temp_queue = self.create_queue(self.temp_credentials)
 
     def write_json(self, path, contents, message):
@@ -193,18 +264,31 @@ class Context(object):
 
     @property
     def projects(self):
-        """dict: The current contents of ``projects.yml``, which defines CI configuration.
+        """immutabledict: The current contents of ``projects.yml``, which defines CI configuration.
 
         I'd love to auto-populate this; currently we need to set this from
         the config's ``project_configuration_url``.
 
+        When setting, freeze the projects and index them by repo.
+
         """
         if self._projects:
-            return dict(deepcopy(self._projects))
+            return self._projects
 
     @projects.setter
     def projects(self, projects):
-        self._projects = projects
+        self._projects = get_frozen_copy(projects)
+        projects_by_repo = {}
+        for project, config in (self._projects or {}).items():
+            if isinstance(config, Mapping) and "repo" in config:
+                # If several projects share a repo, the first one wins
+                projects_by_repo.setdefault(config["repo"], project)
+        self._projects_by_repo = immutabledict(projects_by_repo)
+
+    @property
+    def projects_by_repo(self):
+        """immutabledict: The names of the projects in ``self.projects``, keyed by their repo url."""
+        return self._projects_by_repo
 
     @property
     def event_loop(self):
@@ -237,6 +321,13 @@ class Context(object):
 
     @property
     def download_semaphore(self):
+        """asyncio.BoundedSemaphore: Limits the number of concurrent artifact downloads.
+
+        This allows up to ``max_concurrent_downloads`` downloads at a time,
+        and is shared with the slot contexts, so the limit applies to the
+        whole worker rather than to each task.
+
+        """
         if self._download_semaphore is None:
             try:
                 max_concurrent_downloads = self.config.get("max_concurrent_downloads", DEFAULT_MAX_CONCURRENT_DOWNLOADS)
@@ -244,3 +335,33 @@ class Context(object):
                 max_concurrent_downloads = DEFAULT_MAX_CONCURRENT_DOWNLOADS
             self._download_semaphore = asyncio.BoundedSemaphore(max_concurrent_downloads)
         return self._download_semaphore
+
+    @property
+    def upload_semaphore(self):
+        """asyncio.BoundedSemaphore: Limits the number of concurrent artifact uploads.
+
+        This allows up to ``max_concurrent_uploads`` uploads at a time, and
+        is shared with the slot contexts, so the limit applies to the whole
+        worker rather than to each task.
+
+        """
+        if self._upload_semaphore is None:
+            try:
+                max_concurrent_uploads = self.config.get("max_concurrent_uploads", DEFAULT_MAX_CONCURRENT_UPLOADS)
+            except (TypeError, KeyError, AttributeError):
+                max_concurrent_uploads = DEFAULT_MAX_CONCURRENT_UPLOADS
+            self._upload_semaphore = asyncio.BoundedSemaphore(max_concurrent_uploads)
+        return self._upload_semaphore
+
+    @property
+    def verified_links(self):
+        """dict: The parent task links that have passed verification.
+
+        This maps ``scriptworker.cot.cache.get_verified_link_key`` keys to the
+        time they were verified.  It's only kept in memory, so nothing outside
+        of this worker process can mark a link as verified.
+
+        """
+        if self._verified_links is None:
+            self._verified_links = {}
+        return self._verified_links
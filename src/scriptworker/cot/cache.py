@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""Chain of Trust on-disk cache.
+
+Upstream task definitions and chain of trust artifacts are immutable once the
+upstream task has resolved, so we can keep them across tasks in
+``artifact_cache_dir``.  Cached artifacts are only used if they match the
+shas in the upstream chain of trust artifact, and cached task definitions
+are checked against the task definition in the signed chain of trust
+artifact, or fetched again if that doesn't contain one.  Signed chain of trust artifacts are only cached once their
+signatures verify, and are verified again each time they're used.
+Artifacts are copied in and out of the cache, rather than linked, so a task
+modifying its copy can't change the cached one.  The cache is pruned, least
+recently used first, to stay under ``artifact_cache_max_size`` bytes, once
+per chain of trust verification.
+
+If ``cache_verified_links`` is set, we also remember which parent task links
+have passed json-e verification, so later tasks depending on the same parent
+task can skip rebuilding its task definition.  These are kept in
+``context.verified_links``, in memory rather than in ``artifact_cache_dir``,
+so other processes can't mark a link as verified.  They expire after
+``cache_verified_links_ttl`` seconds.
+
+Attributes:
+    log (logging.Logger): the log object for this module.
+    VERIFIED_LINK_CONFIG_KEYS (tuple): the config keys that affect parent
+        task verification.  A change in any of them invalidates the verified
+        link cache.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections.abc import Mapping
+
+from scriptworker.exceptions import CoTError
+from scriptworker.utils import get_hash, makedirs, rm, run_in_executor
+from scriptworker.version import __version_string__
+
+log = logging.getLogger(__name__)
+
+VERIFIED_LINK_CONFIG_KEYS = (
+    "cot_product",
+    "cot_product_type",
+    "cot_restricted_scopes",
+    "cot_restricted_trees",
+    "ed25519_public_keys",
+    "min_cot_version",
+    "project_configuration_url",
+    "pushlog_url",
+    "source_env_prefix",
+    "taskcluster_root_url",
+    "trusted_vcs_rules",
+    "valid_decision_worker_pools",
+    "valid_tasks_for",
+    "verify_cot_signature",
+)
+
+
+# get_cache_path {{{1
+def get_cache_path(context, task_id, path=None):
+    """Get the path to a task definition or artifact in the cache.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        task_id (str): the taskId of the upstream task.
+        path (str, optional): the relative path of the artifact.  If None,
+            get the path to the task definition.  Defaults to None.
+
+    Returns:
+        str: the path in the cache, or None if the cache is disabled or
+            ``path`` is outside of the cache.
+
+    """
+    cache_dir = context.config["artifact_cache_dir"]
+    if not cache_dir:
+        return None
+    if path is None:
+        return os.path.join(cache_dir, "tasks", "{}.json".format(task_id))
+    task_dir = os.path.abspath(os.path.join(cache_dir, "artifacts", task_id))
+    cache_path = os.path.abspath(os.path.join(task_dir, path))
+    if os.path.commonpath([task_dir, cache_path]) != task_dir:
+        return None
+    return cache_path
+
+
+# get_cached_task_definition {{{1
+def get_cached_task_definition(context, task_id):
+    """Get a task definition from the cache.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        task_id (str): the taskId of the task.
+
+    Returns:
+        dict: the task definition, or None if it isn't cached.
+
+    """
+    cache_path = get_cache_path(context, task_id)
+    if cache_path is None:
+        return None
+    try:
+        with open(cache_path, "r") as fh:
+            task_defn = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    _touch(cache_path)
+    log.debug("Using cached task definition for {}".format(task_id))
+    return task_defn
+
+
+# cache_task_definition {{{1
+def cache_task_definition(context, task_id, task_defn):
+    """Add a task definition to the cache.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        task_id (str): the taskId of the task.
+        task_defn (dict): the task definition.
+
+    """
+    cache_path = get_cache_path(context, task_id)
+    if cache_path is None:
+        return
+    _write_atomically(cache_path, lambda fh: fh.write(json.dumps(task_defn).encode("utf-8")))
+
+
+# verify_cached_task_definition {{{1
+def verify_cached_task_definition(context, link):
+    """Verify a link's cached task definition against its signed chain of trust artifact.
+
+    The chain of trust artifact contains the task definition, so once its
+    signature is verified we can make sure the cache hasn't been tampered
+    with.  A cached definition that doesn't match is removed from the cache.
+    Older chain of trust artifacts don't contain the task definition, so the
+    cached one can't be verified; the caller has to fetch it again.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        link (LinkOfTrust): a link whose task definition came from the cache,
+            with ``link.cot`` populated.
+
+    Returns:
+        bool: True if the cached task definition matches the signed one, False
+            if the chain of trust artifact doesn't contain the task definition.
+
+    Raises:
+        CoTError: if the cached task definition doesn't match.
+
+    """
+    signed_task = (link.cot or {}).get("task")
+    if signed_task is None:
+        return False
+    if signed_task == link.task:
+        return True
+    cache_path = get_cache_path(context, link.task_id)
+    if cache_path is not None:
+        rm(cache_path)
+    raise CoTError("{} {}: cached task definition doesn't match its chain of trust artifact! Removed it from the cache.".format(link.name, link.task_id))
+
+
+# restore_cached_artifact {{{1
+async def restore_cached_artifact(context, task_id, path, abs_filename, expected_shas):
+    """Copy an artifact from the cache to ``abs_filename``, if it matches ``expected_shas``.
+
+    A cached artifact that doesn't match is removed from the cache.  The
+    hashing and copying run in the default executor.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        task_id (str): the taskId of the upstream task.
+        path (str): the relative path of the artifact.
+        abs_filename (str): the path to restore the artifact to.
+        expected_shas (dict): the expected shas, keyed by hash algorithm.  If
+            empty, the caller has to verify the restored artifact, e.g. by
+            its signature.
+
+    Returns:
+        bool: True if the artifact was restored from the cache.
+
+    """
+    cache_path = get_cache_path(context, task_id, path)
+    if cache_path is None or not os.path.isfile(cache_path):
+        return False
+    return await run_in_executor(_restore_cached_artifact, task_id, path, cache_path, abs_filename, expected_shas)
+
+
+def _restore_cached_artifact(task_id, path, cache_path, abs_filename, expected_shas):
+    try:
+        for alg, expected_sha in expected_shas.items():
+            if get_hash(cache_path, hash_alg=alg) != expected_sha:
+                log.warning("Cached {} {} doesn't match its chain of trust {}; removing".format(task_id, path, alg))
+                rm(cache_path)
+                return False
+        makedirs(os.path.dirname(abs_filename))
+        rm(abs_filename)
+        shutil.copyfile(cache_path, abs_filename)
+    except OSError as exc:
+        # Another task may have pruned it from under us.
+        log.debug("Can't use cached {} {}: {}".format(task_id, path, exc))
+        return False
+    _touch(cache_path)
+    log.info("Using cached {} {}".format(task_id, path))
+    return True
+
+
+# cache_artifact {{{1
+async def cache_artifact(context, task_id, path, abs_filename):
+    """Add a downloaded and verified artifact to the cache.
+
+    The artifact is copied into the cache in the default executor.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        task_id (str): the taskId of the upstream task.
+        path (str): the relative path of the artifact.
+        abs_filename (str): the path of the downloaded artifact.
+
+    """
+    cache_path = get_cache_path(context, task_id, path)
+    if cache_path is None:
+        return
+    if os.path.getsize(abs_filename) > context.config["artifact_cache_max_size"]:
+        log.debug("{} {} is too large to cache".format(task_id, path))
+        return
+    await run_in_executor(_cache_artifact, abs_filename, cache_path)
+
+
+def _cache_artifact(abs_filename, cache_path):
+    makedirs(os.path.dirname(cache_path))
+    tmp_path = os.path.join(os.path.dirname(cache_path), ".tmp{}".format(uuid.uuid4().hex))
+    try:
+        shutil.copyfile(abs_filename, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as exc:
+        log.warning("Can't add {} to the cache: {}".format(cache_path, exc))
+        rm(tmp_path)
+
+
+# remove_cached_artifact {{{1
+def remove_cached_artifact(context, task_id, path):
+    """Remove an artifact from the cache, e.g. if it failed verification.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        task_id (str): the taskId of the upstream task.
+        path (str): the relative path of the artifact.
+
+    """
+    cache_path = get_cache_path(context, task_id, path)
+    if cache_path is not None:
+        rm(cache_path)
+
+
+# get_verified_link_key {{{1
+def get_verified_link_key(context, parent_link, decision_link, level=None):
+    """Get the verified link cache key for a parent task link.
+
+    The key covers the parent and decision taskIds, task definitions and
+    chain of trust artifacts, the scriptworker version, the values of
+    ``VERIFIED_LINK_CONFIG_KEYS``, the ``projects.yml`` contents, and the scm
+    level the parent task is rebuilt with.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        parent_link (LinkOfTrust): the decision, action or cron link.
+        decision_link (LinkOfTrust): the decision link of ``parent_link``.
+        level (str, optional): the scm level of the project, if any.
+            Defaults to None.
+
+    Returns:
+        str: the cache key, or None if verified links aren't cached.
+
+    """
+    if not context.config["cache_verified_links"]:
+        return None
+    contents = {
+        "scriptworker": __version_string__,
+        "config": {key: context.config.get(key) for key in VERIFIED_LINK_CONFIG_KEYS},
+        "projects": context.projects,
+        "level": level,
+        "links": [],
+    }
+    for link in (parent_link, decision_link):
+        cot_path = link.get_artifact_full_path("public/chain-of-trust.json")
+        if not os.path.isfile(cot_path):
+            return None
+        contents["links"].append({"taskId": link.task_id, "task": link.task, "cot": get_hash(cot_path)})
+    dumped = json.dumps(contents, sort_keys=True, default=_jsonify)
+    return hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+
+
+# is_link_verified {{{1
+def is_link_verified(context, key):
+    """Determine whether the parent task link with this key has already been verified.
+
+    Verified links older than ``cache_verified_links_ttl`` seconds are
+    forgotten, and have to be verified again.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        key (str): the key from ``get_verified_link_key``.
+
+    Returns:
+        bool: True if the link has already been verified.
+
+    """
+    if key is None or key not in context.verified_links:
+        return False
+    if _is_expired(context, context.verified_links[key]):
+        del context.verified_links[key]
+        return False
+    return True
+
+
+# cache_verified_link {{{1
+def cache_verified_link(context, key):
+    """Remember that the parent task link with this key has been verified.
+
+    Expired verified links are forgotten at the same time.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        key (str): the key from ``get_verified_link_key``.
+
+    """
+    if key is None:
+        return
+    for expired_key in [k for k, verified_time in context.verified_links.items() if _is_expired(context, verified_time)]:
+        del context.verified_links[expired_key]
+    context.verified_links[key] = time.time()
+
+
+# prune_cache {{{1
+def prune_cache(context):
+    """Remove the least recently used files until the cache fits in ``artifact_cache_max_size``.
+
+    This walks the whole cache, so it's called once per chain of trust
+    verification rather than on every insert.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    """
+    cache_dir = context.config["artifact_cache_dir"]
+    if not cache_dir:
+        return
+    entries = []
+    total_size = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            cache_path = os.path.join(root, name)
+            try:
+                stat = os.stat(cache_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, cache_path))
+            total_size += stat.st_size
+    for _, size, cache_path in sorted(entries):
+        if total_size <= context.config["artifact_cache_max_size"]:
+            break
+        log.debug("Pruning {} from the cache".format(cache_path))
+        try:
+            os.remove(cache_path)
+        except OSError:
+            continue
+        total_size -= size
+
+
+def _is_expired(context, verified_time):
+    return time.time() - verified_time > context.config["cache_verified_links_ttl"]
+
+
+def _jsonify(obj):
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return list(obj)
+
+
+def _touch(cache_path):
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+
+def _write_atomically(cache_path, write_func):
+    makedirs(os.path.dirname(cache_path))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write_func(fh)
+        os.replace(tmp_path, cache_path)
+    except OSError as exc:
+        log.warning("Can't add {} to the cache: {}".format(cache_path, exc))
+        rm(tmp_path)
@@ -8,6 +8,7 @@ Attributes:
 import logging
 import os
 
+from scriptworker.artifacts import get_artifact_manifest_entry
 from scriptworker.client import validate_json_schema
 from scriptworker.ed25519 import ed25519_private_key_from_file
 from scriptworker.exceptions import ScriptWorkerException
@@ -20,6 +21,12 @@ log = logging.getLogger(__name__)
 def get_cot_artifacts(context):
     """Generate the artifact relative paths and shas for the chain of trust.
 
+    Shas already computed by ``scriptworker.artifacts.finalize_artifacts``
+    are reused, rather than reading the artifacts again.  That's where the
+    artifacts are hashed in parallel, each in its own job in the default
+    executor with large reads, while they're compressed.  Only artifacts
+    that changed or appeared since are hashed here, one after another.
+
     Args:
         context (scriptworker.context.Context): the scriptworker context.
 
@@ -28,11 +35,10 @@ def get_cot_artifacts(context):
 
     """
     artifacts = {}
-    filepaths = filepaths_in_dir(context.config["artifact_dir"])
     hash_alg = context.config["chain_of_trust_hash_algorithm"]
-    for filepath in sorted(filepaths):
-        path = os.path.join(context.config["artifact_dir"], filepath)
-        sha = get_hash(path, hash_alg=hash_alg)
+    for filepath in sorted(filepaths_in_dir(context.config["artifact_dir"])):
+        entry = get_artifact_manifest_entry(context, filepath) or {}
+        sha = entry.get("hashes", {}).get(hash_alg) or get_hash(os.path.join(context.config["artifact_dir"], filepath), hash_alg=hash_alg)
         artifacts[filepath] = {hash_alg: sha}
     return artifacts
 
@@ -91,6 +97,9 @@ def generate_cot_body(context):
 def generate_cot(context, parent_path=None):
     """Format and sign the cot body, and write to disk.
 
+    This reads, hashes and writes files, so the worker runs it in the
+    default executor, off the event loop.
+
     Args:
         context (scriptworker.context.Context): the scriptworker context.
         parent_path (str, optional): The directory to write the chain of trust
@@ -8,6 +8,7 @@ Attributes:
 """
 import argparse
 import asyncio
+import functools
 import logging
 import os
 import pprint
@@ -26,7 +27,19 @@ from scriptworker.artifacts import download_artifacts, get_artifact_url, get_opt
 from scriptworker.config import apply_product_config, read_worker_creds
 from scriptworker.constants import DEFAULT_CONFIG
 from scriptworker.context import Context
-from scriptworker.ed25519 import ed25519_public_key_from_string, verify_ed25519_signature
+from scriptworker.cot.cache import (
+    cache_artifact,
+    cache_task_definition,
+    cache_verified_link,
+    get_cached_task_definition,
+    get_verified_link_key,
+    is_link_verified,
+    prune_cache,
+    remove_cached_artifact,
+    restore_cached_artifact,
+    verify_cached_task_definition,
+)
+from scriptworker.ed25519 import get_ed25519_public_key, get_ed25519_verify_seeds, set_ed25519_verified_seed, verify_ed25519_signature
 from scriptworker.exceptions import BaseDownloadError, CoTError, ScriptWorkerEd25519Error
 from scriptworker.github import GitHubRepository, extract_github_repo_full_name, extract_github_repo_owner_and_name, extract_github_repo_ssh_url
 from scriptworker.log import contextual_log_handler
@@ -53,6 +66,7 @@ from scriptworker.task import (
 )
 from scriptworker.utils import (
     add_enumerable_item_to_dict,
+    download_file,
     format_json,
     get_hash,
     get_loggable_url,
@@ -66,6 +80,7 @@ from scriptworker.utils import (
     read_from_file,
     remove_empty_keys,
     rm,
+    run_in_executor,
     write_to_file,
 )
 from scriptworker.version import __version_string__
@@ -86,6 +101,10 @@ class ChainOfTrust(object):
         decision_task_id (str): the task_id of self.task's decision task
         parent_task_id (str): the task_id of self.task's parent task
         links (list): the list of ``LinkOfTrust``s
+        cached_task_ids (set): the taskIds whose task definitions came from
+            the ``artifact_cache_dir`` cache
+        cached_cot_task_ids (set): the taskIds whose signed chain of trust
+            artifacts came from the ``artifact_cache_dir`` cache
         name (str): the name of the task (e.g., signing)
         task_id (str): the taskId of the task
         task_type (str): the task type of the task (e.g., decision, build)
@@ -112,6 +131,8 @@ class ChainOfTrust(object):
         self.decision_task_id = get_decision_task_id(self.task)
         self.parent_task_id = get_parent_task_id(self.task)
         self.links = []
+        self.cached_task_ids = set()
+        self.cached_cot_task_ids = set()
 
     def dependent_task_ids(self):
         """Get all ``task_id``s for all ``LinkOfTrust`` tasks.
@@ -549,7 +570,12 @@ def find_sorted_task_dependencies(task, task_name, task_id):
 
     """
     log.info("find_sorted_task_dependencies {} {}".format(task_name, task_id))
+    dependencies = _find_sorted_task_dependencies(task, task_name, task_id)
+    log.info("found dependencies: {}".format(dependencies))
+    return dependencies
 
+
+def _find_sorted_task_dependencies(task, task_name, task_id):
     cot_input_dependencies = [
         _craft_dependency_tuple(task_name, task_type, task_id) for task_type, task_id in task["extra"].get("chainOfTrust", {}).get("inputs", {}).items()
     ]
@@ -568,8 +594,6 @@ def find_sorted_task_dependencies(task, task_name, task_id):
     # signing:build0:decision before signing:decision
     parent_tuple = _craft_dependency_tuple(task_name, parent_task_type, parent_task_id)
     dependencies.insert(0, parent_tuple)
-
-    log.info("found dependencies: {}".format(dependencies))
     return dependencies
 
 
@@ -581,39 +605,110 @@ def _sort_dependencies_by_name_then_task_id(dependencies):
     return sorted(dependencies, key=lambda dep: "{}_{}".format(dep[0], dep[1]))
 
 
+# fetch_task_definitions {{{1
+async def fetch_task_definitions(chain, task_name, task_id, task=None):
+    """Fetch the task definitions of a task's chain of trust dependencies.
+
+    This walks the dependency graph breadth-first, fetching each level of
+    the graph concurrently, bounded by ``context.download_semaphore``.  Each
+    taskId is only fetched once, and tasks already in ``chain.links`` are
+    skipped.  We stop descending past ``max_chain_length``;
+    ``build_task_dependencies`` raises on that.
+
+    Args:
+        chain (ChainOfTrust): the chain of trust we're building.
+        task_name (str): the name of the task to start from.
+        task_id (str): the taskId of the task to start from.
+        task (dict, optional): the task definition of the task to start
+            from.  If None, fetch it too.  Defaults to None.
+
+    Raises:
+        CoTError: on failure.
+
+    Returns:
+        dict: the fetched task definitions, keyed by taskId.
+
+    """
+    task_defns = {}
+    seen = set(chain.dependent_task_ids())
+    max_chain_length = chain.context.config["max_chain_length"]
+
+    async def _fetch(task_id):
+        task_defn = get_cached_task_definition(chain.context, task_id)
+        if task_defn is not None:
+            chain.cached_task_ids.add(task_id)
+        else:
+            async with chain.context.download_semaphore:
+                task_defn = await retry_get_task_definition(chain.context.queue, task_id, exception=CoTError)
+            cache_task_definition(chain.context, task_id, task_defn)
+        task_defns[task_id] = task_defn
+
+    if task is None:
+        seen.add(task_id)
+        await _fetch(task_id)
+        task = task_defns[task_id]
+    level = [(task_name, task_id, task)]
+    while level:
+        next_level = []
+        for name, level_task_id, level_task in level:
+            if name.count(":") > max_chain_length:
+                continue
+            for dep_name, dep_task_id in _find_sorted_task_dependencies(level_task, name, level_task_id):
+                if dep_task_id not in seen:
+                    seen.add(dep_task_id)
+                    next_level.append((dep_name, dep_task_id))
+        await raise_future_exceptions([asyncio.ensure_future(_fetch(dep_task_id)) for _, dep_task_id in next_level])
+        level = [(dep_name, dep_task_id, task_defns[dep_task_id]) for dep_name, dep_task_id in next_level]
+    return task_defns
+
+
 # build_task_dependencies {{{1
-async def build_link(chain, task_name, task_id):
+async def build_link(chain, task_name, task_id, task_defns=None):
     """Build a LinkOfTrust and add it to the chain.
 
     Args:
         chain (ChainOfTrust): the chain of trust to add to.
         task_name (str): the name of the task to operate on.
         task_id (str): the taskId of the task to operate on.
+        task_defns (dict, optional): task definitions already fetched by
+            ``fetch_task_definitions``, keyed by taskId.  If None, fetch them.
+            Defaults to None.
 
     Raises:
         CoTError: on failure.
 
     """
+    if task_defns is None:
+        task_defns = await fetch_task_definitions(chain, task_name, task_id)
     link = LinkOfTrust(chain.context, task_name, task_id)
     json_path = link.get_artifact_full_path("task.json")
-    task_defn = await retry_get_task_definition(chain.context.queue, task_id, exception=CoTError)
+    task_defn = task_defns.get(task_id)
+    if task_defn is None:
+        task_defn = await retry_get_task_definition(chain.context.queue, task_id, exception=CoTError)
     link.task = task_defn
     chain.links.append(link)
     # write task json to disk
     makedirs(os.path.dirname(json_path))
     with open(json_path, "w") as fh:
         fh.write(format_json(task_defn))
-    await build_task_dependencies(chain, task_defn, task_name, task_id)
+    await build_task_dependencies(chain, task_defn, task_name, task_id, task_defns=task_defns)
 
 
-async def build_task_dependencies(chain, task, name, my_task_id):
+async def build_task_dependencies(chain, task, name, my_task_id, task_defns=None):
     """Recursively build the task dependencies of a task.
 
+    The task definitions are fetched concurrently up front, so the links are
+    built depth-first from the fetched definitions.  This keeps the link
+    names and the order of ``chain.links`` deterministic.
+
     Args:
         chain (ChainOfTrust): the chain of trust to add to.
         task (dict): the task definition to operate on.
         name (str): the name of the task to operate on.
         my_task_id (str): the taskId of the task to operate on.
+        task_defns (dict, optional): task definitions already fetched by
+            ``fetch_task_definitions``, keyed by taskId.  If None, fetch them.
+            Defaults to None.
 
     Raises:
         CoTError: on failure.
@@ -622,17 +717,24 @@ async def build_task_dependencies(chain, task, name, my_task_id):
     log.info("build_task_dependencies {} {}".format(name, my_task_id))
     if name.count(":") > chain.context.config["max_chain_length"]:
         raise CoTError("Too deep recursion!\n{}".format(name))
+    if task_defns is None:
+        task_defns = await fetch_task_definitions(chain, name, my_task_id, task=task)
     sorted_dependencies = find_sorted_task_dependencies(task, name, my_task_id)
 
     for task_name, task_id in sorted_dependencies:
         if task_id not in chain.dependent_task_ids():
-            await build_link(chain, task_name, task_id)
+            await build_link(chain, task_name, task_id, task_defns=task_defns)
 
 
 # download_cot {{{1
 async def download_cot(chain):
     """Download the signed chain of trust artifacts.
 
+    If ``verify_cot_signature`` is set, artifacts in the
+    ``artifact_cache_dir`` cache are used instead of downloading them.  Their
+    signatures are verified in ``verify_cot_signatures``, like downloaded
+    ones.
+
     Args:
         chain (ChainOfTrust): the chain of trust to add to.
 
@@ -645,22 +747,28 @@ async def download_cot(chain):
     # signed chain of trust artifacts.  ``chain.task`` is the current running
     # task, and will not have a signed chain of trust artifact yet.
     for link in chain.links:
-        task_id = link.task_id
-        parent_dir = link.cot_dir
-        urls = []
+        artifact_tasks.append(asyncio.ensure_future(_download_link_cot(chain, link)))
+    await raise_future_exceptions(artifact_tasks)
 
-        unsigned_url = get_artifact_url(chain.context, task_id, "public/chain-of-trust.json")
-        urls.append(unsigned_url)
-        if chain.context.config["verify_cot_signature"]:
-            urls.append(get_artifact_url(chain.context, task_id, "public/chain-of-trust.json.sig"))
 
-        artifact_tasks.append(asyncio.ensure_future(download_artifacts(chain.context, urls, parent_dir=parent_dir, valid_artifact_task_ids=[task_id])))
+def _get_cot_paths(context):
+    paths = ["public/chain-of-trust.json"]
+    if context.config["verify_cot_signature"]:
+        paths.append("public/chain-of-trust.json.sig")
+    return paths
 
-    artifacts_paths = await raise_future_exceptions(artifact_tasks)
 
-    for path in artifacts_paths:
-        sha = get_hash(path[0])
-        log.debug("{} downloaded; hash is {}".format(path[0], sha))
+async def _download_link_cot(chain, link, use_cache=True):
+    paths = _get_cot_paths(chain.context)
+    # Unsigned chain of trust artifacts can't be verified, so they aren't cached
+    if use_cache and chain.context.config["verify_cot_signature"]:
+        restored = [await restore_cached_artifact(chain.context, link.task_id, path, link.get_artifact_full_path(path), {}) for path in paths]
+        if all(restored):
+            chain.cached_cot_task_ids.add(link.task_id)
+            return
+    urls = [get_artifact_url(chain.context, link.task_id, path) for path in paths]
+    artifacts_paths = await download_artifacts(chain.context, urls, parent_dir=link.cot_dir, valid_artifact_task_ids=[link.task_id])
+    log.debug("{} downloaded; hash is {}".format(artifacts_paths[0], get_hash(artifacts_paths[0])))
 
 
 # download_cot_artifact {{{1
@@ -692,18 +800,29 @@ Skipping download of this artifact'.format(
 
     if path not in link.cot["artifacts"]:
         raise CoTError("path {} not in {} {} chain of trust artifacts!".format(path, link.name, link.task_id))
-    url = get_artifact_url(chain.context, task_id, path)
-    loggable_url = get_loggable_url(url)
-    log.info("Downloading Chain of Trust artifact:\n{}".format(loggable_url))
-    await download_artifacts(chain.context, [url], parent_dir=link.cot_dir, valid_artifact_task_ids=[task_id])
     full_path = link.get_artifact_full_path(path)
-    for alg, expected_sha in link.cot["artifacts"][path].items():
+    expected_shas = link.cot["artifacts"][path]
+    for alg in expected_shas:
         if alg not in chain.context.config["valid_hash_algorithms"]:
             raise CoTError("BAD HASH ALGORITHM: {}: {} {}!".format(link.name, alg, full_path))
-        real_sha = get_hash(full_path, hash_alg=alg)
+    if await restore_cached_artifact(chain.context, task_id, path, full_path, expected_shas):
+        return full_path
+    url = get_artifact_url(chain.context, task_id, path)
+    loggable_url = get_loggable_url(url)
+    log.info("Downloading Chain of Trust artifact:\n{}".format(loggable_url))
+    digests = {}
+
+    async def _download(context, url, abs_filename, session=None):
+        # Hash while downloading, rather than reading the file back afterwards
+        digests.update(await download_file(context, url, abs_filename, session=session, hash_algs=list(expected_shas)))
+
+    await download_artifacts(chain.context, [url], parent_dir=link.cot_dir, valid_artifact_task_ids=[task_id], download_func=_download)
+    for alg, expected_sha in expected_shas.items():
+        real_sha = digests.get(alg) or get_hash(full_path, hash_alg=alg)
         if expected_sha != real_sha:
             raise CoTError("BAD HASH on file {}: {}: Expected {} {}; got {}!".format(full_path, link.name, alg, expected_sha, real_sha))
         log.debug("{} matches the expected {} {}".format(full_path, alg, expected_sha))
+    await cache_artifact(chain.context, task_id, path, full_path)
     return full_path
 
 
@@ -798,12 +917,16 @@ def get_all_artifacts_per_task_id(chain, upstream_artifacts):
 
 # verify_cot_signatures {{{1
 def verify_link_ed25519_cot_signature(chain, link, unsigned_path, signature_path):
-    """Verify the ed25519 signatures of the chain of trust artifacts populated in ``download_cot``.
+    """Verify the ed25519 signature of a link's chain of trust artifact populated in ``download_cot``.
 
-    Populate each link.cot with the chain of trust json body.
+    Populate link.cot with the chain of trust json body.  The seed that last
+    verified a signature for ``link.worker_impl`` is tried first.
 
     Args:
         chain (ChainOfTrust): the chain of trust to add to.
+        link (LinkOfTrust): the link to verify.
+        unsigned_path (str): the path to the chain of trust json body.
+        signature_path (str): the path to its ed25519 signature.
 
     Raises:
         (CoTError, ScriptWorkerEd25519Error): on signature verification failure.
@@ -815,15 +938,16 @@ def verify_link_ed25519_cot_signature(chain, link, unsigned_path, signature_path
         binary_contents = read_from_file(unsigned_path, file_type="binary", exception=CoTError)
         errors = []
         verify_key_seeds = chain.context.config["ed25519_public_keys"].get(link.worker_impl, [])
-        for seed in verify_key_seeds:
+        for seed in get_ed25519_verify_seeds(link.worker_impl, verify_key_seeds):
             try:
-                verify_key = ed25519_public_key_from_string(seed)
+                verify_key = get_ed25519_public_key(link.worker_impl, seed)
                 verify_ed25519_signature(
                     verify_key,
                     binary_contents,
                     signature,
                     "{} {}: {} ed25519 cot signature doesn't verify against {}: %(exc)s".format(link.name, link.task_id, link.worker_impl, seed),
                 )
+                set_ed25519_verified_seed(link.worker_impl, seed)
                 log.debug("{} {}: ed25519 cot signature verified.".format(link.name, link.task_id))
                 break
             except ScriptWorkerEd25519Error as exc:
@@ -841,10 +965,16 @@ def verify_link_ed25519_cot_signature(chain, link, unsigned_path, signature_path
     )
 
 
-def verify_cot_signatures(chain):
+async def verify_cot_signatures(chain):
     """Verify the signatures of the chain of trust artifacts populated in ``download_cot``.
 
-    Populate each link.cot with the chain of trust json body.
+    Populate each link.cot with the chain of trust json body.  The links are
+    read and verified concurrently in the default executor, off the event
+    loop.  Cached chain of trust artifacts that don't verify are removed from
+    the cache and downloaded again; downloaded ones that verify are added to
+    the cache.  Task definitions that came from the cache are then checked
+    against their signed chain of trust artifacts, or fetched again if those
+    don't contain the task definition.
 
     Args:
         chain (ChainOfTrust): the chain of trust to add to.
@@ -853,10 +983,46 @@ def verify_cot_signatures(chain):
         CoTError: on failure.
 
     """
+    tasks = []
+    for link in chain.links:
+        tasks.append(asyncio.ensure_future(_verify_link_cot_signature(chain, link)))
+    await raise_future_exceptions(tasks)
+    tasks = []
     for link in chain.links:
-        unsigned_path = link.get_artifact_full_path("public/chain-of-trust.json")
-        ed25519_signature_path = link.get_artifact_full_path("public/chain-of-trust.json.sig")
-        verify_link_ed25519_cot_signature(chain, link, unsigned_path, ed25519_signature_path)
+        if link.task_id in chain.cached_task_ids and not verify_cached_task_definition(chain.context, link):
+            tasks.append(asyncio.ensure_future(_refetch_cached_task_definition(chain, link)))
+    await raise_future_exceptions(tasks)
+
+
+async def _refetch_cached_task_definition(chain, link):
+    log.debug("{} {}: chain of trust artifact doesn't contain the task definition; fetching it again".format(link.name, link.task_id))
+    async with chain.context.download_semaphore:
+        task_defn = await retry_get_task_definition(chain.context.queue, link.task_id, exception=CoTError)
+    chain.cached_task_ids.discard(link.task_id)
+    if task_defn != link.task:
+        # The chain was built from the cached definition, so we can't use it.
+        cache_task_definition(chain.context, link.task_id, task_defn)
+        raise CoTError("{} {}: cached task definition doesn't match the queue's! Replaced it in the cache.".format(link.name, link.task_id))
+
+
+async def _verify_link_cot_signature(chain, link):
+    context = chain.context
+    unsigned_path = link.get_artifact_full_path("public/chain-of-trust.json")
+    ed25519_signature_path = link.get_artifact_full_path("public/chain-of-trust.json.sig")
+    try:
+        await run_in_executor(verify_link_ed25519_cot_signature, chain, link, unsigned_path, ed25519_signature_path)
+    except (CoTError, ScriptWorkerEd25519Error) as exc:
+        if link.task_id not in chain.cached_cot_task_ids:
+            raise
+        log.warning("{} {}: cached chain of trust artifact doesn't verify; downloading it again: {}".format(link.name, link.task_id, exc))
+        chain.cached_cot_task_ids.discard(link.task_id)
+        for path in _get_cot_paths(context):
+            remove_cached_artifact(context, link.task_id, path)
+        await _download_link_cot(chain, link, use_cache=False)
+        await run_in_executor(verify_link_ed25519_cot_signature, chain, link, unsigned_path, ed25519_signature_path)
+    if context.config["verify_cot_signature"] and link.task_id not in chain.cached_cot_task_ids:
+        for path in _get_cot_paths(context):
+            await cache_artifact(context, link.task_id, path, link.get_artifact_full_path(path))
 
 
 # verify_task_in_task_graph {{{1
@@ -1579,6 +1745,11 @@ def check_and_update_action_task_group_id(parent_link, decision_link, rebuilt_de
 def compare_jsone_task_definition(parent_link, rebuilt_definitions):
     """Compare the json-e rebuilt task definition vs the runtime definition.
 
+    Key/value pairs with empty values are ignored, since json-e drops them
+    instead of keeping them with a None/{}/[] value.  Each rebuilt definition
+    is compared in place, stopping at the first difference; we only build the
+    full diffs if none of them match, for the error message.
+
     Args:
         parent_link (LinkOfTrust): the parent link to test.
         rebuilt_definitions (dict): the rebuilt task definitions.
@@ -1587,26 +1758,62 @@ def compare_jsone_task_definition(parent_link, rebuilt_definitions):
         CoTError: on failure.
 
     """
-    diffs = []
     for compare_definition in rebuilt_definitions["tasks"]:
         # Rebuilt decision tasks have an extra `taskId`; remove
         if "taskId" in compare_definition:
             del compare_definition["taskId"]
-        # remove key/value pairs where the value is empty, since json-e drops
-        # them instead of keeping them with a None/{}/[] value.
-        compare_definition = remove_empty_keys(compare_definition)
-        runtime_definition = remove_empty_keys(parent_link.task)
-
-        diff = list(dictdiffer.diff(compare_definition, runtime_definition))
-        if diff:
-            diffs.append(pprint.pformat(diff))
-            continue
-        log.info("{}: Good.".format(parent_link.name))
-        break
-    else:
-        error_msg = "{} {}: the runtime task doesn't match any rebuilt definition!\n{}".format(parent_link.name, parent_link.task_id, pprint.pformat(diffs))
-        log.critical(error_msg)
-        raise CoTError(error_msg)
+    for compare_definition in rebuilt_definitions["tasks"]:
+        if _definitions_match(compare_definition, parent_link.task):
+            log.info("{}: Good.".format(parent_link.name))
+            return
+
+    diffs = []
+    runtime_definition = remove_empty_keys(parent_link.task)
+    for compare_definition in rebuilt_definitions["tasks"]:
+        diff = list(dictdiffer.diff(remove_empty_keys(compare_definition), runtime_definition))
+        if not diff:
+            # e.g. floats within dictdiffer's tolerance
+            log.info("{}: Good.".format(parent_link.name))
+            return
+        diffs.append(pprint.pformat(diff))
+    error_msg = "{} {}: the runtime task doesn't match any rebuilt definition!\n{}".format(parent_link.name, parent_link.task_id, pprint.pformat(diffs))
+    log.critical(error_msg)
+    raise CoTError(error_msg)
+
+
+def _definitions_match(first, second, remove=({}, None, [], "null")):
+    """Check ``remove_empty_keys(first) == remove_empty_keys(second)`` without building either.
+
+    Args:
+        first (object): the first task definition, or a value in it.
+        second (object): the second task definition, or a value in it.
+        remove (tuple, optional): the values that count as empty.  Matches
+            ``remove_empty_keys``.
+
+    Returns:
+        bool: True if they match; False as soon as we find a difference.
+
+    """
+    if isinstance(first, dict):
+        if not isinstance(second, dict):
+            return False
+        count = 0
+        for key, value in first.items():
+            if value in remove:
+                continue
+            count += 1
+            if key not in second or second[key] in remove or not _definitions_match(value, second[key], remove):
+                return False
+        return count == sum(1 for value in second.values() if value not in remove)
+    if isinstance(first, list):
+        if not isinstance(second, list):
+            return False
+        first_values = [value for value in first if value not in remove]
+        second_values = [value for value in second if value not in remove]
+        return len(first_values) == len(second_values) and all(_definitions_match(a, b, remove) for a, b in zip(first_values, second_values))
+    if isinstance(second, (dict, list)):
+        return False
+    return first == second
 
 
 # verify_parent_task {{{1
@@ -1648,10 +1855,33 @@ async def verify_parent_task(chain, link):
             # https://github.com/mozilla-releng/scriptworker/issues/77
             if target_link.parent_task_id == link.task_id and target_link.task_id != link.task_id and target_link.task_type not in PARENT_TASK_TYPES:
                 verify_link_in_task_graph(chain, link, target_link)
+    cache_key = None
+    if chain is not link and chain.context.config["cache_verified_links"]:
+        decision_link = chain.get_link(link.decision_task_id)
+        try:
+            level = await _get_verified_link_level(chain, decision_link)
+        except (CoTError, KeyError, ValueError) as exc:
+            # Let the task definition rebuild raise a useful error
+            log.debug("{} {}: not using the verified link cache: {}".format(link.name, link.task_id, exc))
+        else:
+            cache_key = get_verified_link_key(chain.context, link, decision_link, level=level)
+    if is_link_verified(chain.context, cache_key):
+        log.info("{} {}: already verified; skipping the task definition rebuild (verified link cache hit).".format(link.name, link.task_id))
+        return
     try:
         await verify_parent_task_definition(chain, link)
     except (BaseDownloadError, KeyError) as e:
         raise CoTError(e)
+    cache_verified_link(chain.context, cache_key)
+
+
+async def _get_verified_link_level(chain, decision_link):
+    # The scm level the parent task is rebuilt with.  Looking it up also
+    # populates ``context.projects``, which goes into the cache key.
+    if chain.context.config["cot_product_type"] != "hg":
+        return None
+    project = await get_project(chain.context, get_source_url(decision_link))
+    return await get_scm_level(chain.context, project)
 
 
 # verify_build_task {{{1
@@ -1705,6 +1935,108 @@ async def verify_partials_task(chain, obj):
     pass
 
 
+# verify_links {{{1
+async def verify_links(chain, verify_link):
+    """Run ``verify_link`` against each link in the chain.
+
+    By default the links are verified one at a time, in order, so the log is
+    simple to follow.  If ``max_concurrent_link_verifications`` is greater
+    than 1, up to that many links are verified at once.  Each link's log
+    records are then held back and emitted in link order once all the links
+    are done, so ``chain_of_trust.log`` reads the same as it would
+    sequentially.  Records logged by other tasks or threads that a link check
+    starts aren't held back.
+
+    Args:
+        chain (ChainOfTrust): the chain we're operating on
+        verify_link (typing.Callable): the coroutine function to call with
+            each link.
+
+    Raises:
+        Exception: the first link's exception, in link order.
+
+    """
+    links = chain.get_all_links_in_chain()
+    max_concurrent = chain.context.config["max_concurrent_link_verifications"]
+    if max_concurrent <= 1:
+        for link in links:
+            await verify_link(link)
+        return
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+    with _LinkLogBuffers() as log_buffers:
+
+        async def run(link):
+            log_buffers.start()
+            async with semaphore:
+                await verify_link(link)
+
+        futures = [asyncio.ensure_future(run(link)) for link in links]
+        try:
+            await asyncio.wait(futures)
+        finally:
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                log_buffers.flush(future)
+    for future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+
+
+def _current_task():
+    try:
+        if hasattr(asyncio, "current_task"):
+            return asyncio.current_task()
+        return asyncio.Task.current_task()
+    except RuntimeError:
+        # Logging from a thread without an event loop
+        return None
+
+
+class _LinkLogBuffers(object):
+    """Hold back the ``scriptworker`` log records of each link's task, to emit them in order."""
+
+    def __init__(self):
+        self.buffers = {}
+        self.filters = []
+
+    def __enter__(self):
+        logger = logging.getLogger("scriptworker")
+        while logger is not None:
+            for handler in logger.handlers:
+                handler_filter = functools.partial(self._filter, handler)
+                handler.addFilter(handler_filter)
+                self.filters.append((handler, handler_filter))
+            logger = logger.parent if logger.propagate else None
+        return self
+
+    def __exit__(self, *args):
+        for handler, handler_filter in self.filters:
+            handler.removeFilter(handler_filter)
+
+    def start(self):
+        """Hold back the records logged by the current task."""
+        self.buffers[_current_task()] = []
+
+    def flush(self, task):
+        """Emit the records held back for ``task``.
+
+        Args:
+            task (asyncio.Task): the task to flush the records of.
+
+        """
+        for handler, record in self.buffers.pop(task, []):
+            handler.handle(record)
+
+    def _filter(self, handler, record):
+        buffer = self.buffers.get(_current_task())
+        if buffer is None:
+            return True
+        buffer.append((handler, record))
+        return False
+
+
 # verify_task_types {{{1
 async def verify_task_types(chain):
     """Verify the task type (e.g. decision, build) of each link in the chain.
@@ -1719,13 +2051,14 @@ async def verify_task_types(chain):
     valid_task_types = get_valid_task_types()
     task_count = {}
     for obj in chain.get_all_links_in_chain():
-        task_type = obj.task_type
-        log.info("Verifying {} {} as a {} task...".format(obj.name, obj.task_id, task_type))
-        task_count.setdefault(task_type, 0)
-        task_count[task_type] += 1
-        # Run tests synchronously for now.  We can parallelize if efficiency
-        # is more important than a single simple logfile.
-        await valid_task_types[task_type](chain, obj)
+        task_count.setdefault(obj.task_type, 0)
+        task_count[obj.task_type] += 1
+
+    async def verify_task_type(obj):
+        log.info("Verifying {} {} as a {} task...".format(obj.name, obj.task_id, obj.task_type))
+        await valid_task_types[obj.task_type](chain, obj)
+
+    await verify_links(chain, verify_task_type)
     return task_count
 
 
@@ -1795,12 +2128,12 @@ async def verify_worker_impls(chain):
 
     """
     valid_worker_impls = get_valid_worker_impls()
-    for obj in chain.get_all_links_in_chain():
-        worker_impl = obj.worker_impl
-        log.info("Verifying {} {} as a {} task...".format(obj.name, obj.task_id, worker_impl))
-        # Run tests synchronously for now.  We can parallelize if efficiency
-        # is more important than a single simple logfile.
-        await valid_worker_impls[worker_impl](chain, obj)
+
+    async def verify_worker_impl(obj):
+        log.info("Verifying {} {} as a {} task...".format(obj.name, obj.task_id, obj.worker_impl))
+        await valid_worker_impls[obj.worker_impl](chain, obj)
+
+    await verify_links(chain, verify_worker_impl)
 
 
 # get_source_url {{{1
@@ -1962,7 +2295,7 @@ async def verify_chain_of_trust(chain, *, check_task=False):
             # download the signed chain of trust artifacts
             await download_cot(chain)
             # verify the signatures and populate the ``link.cot``s
-            verify_cot_signatures(chain)
+            await verify_cot_signatures(chain)
             # download all other artifacts needed to verify chain of trust
             await download_cot_artifacts(chain)
             # verify the task types, e.g. decision
@@ -1976,6 +2309,10 @@ async def verify_chain_of_trust(chain, *, check_task=False):
                 raise
             else:
                 raise CoTError(str(exc))
+        finally:
+            if chain.context.config["artifact_cache_dir"]:
+                # This walks the whole cache, so only do it once per verification
+                await run_in_executor(prune_cache, chain.context)
         log.info("Good.")
 
 
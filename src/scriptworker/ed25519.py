@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """ed25519 support for scriptworker.
 
+The public keys in ``ed25519_public_keys`` are parsed once per process, and
+kept by worker_impl along with the seed that last verified a signature.
+
 Attributes:
     log (logging.Logger): the log object for the module
 
@@ -22,6 +25,11 @@ from scriptworker.utils import read_from_file
 
 log = logging.getLogger(__name__)
 
+# worker_impl -> {seed: Ed25519PublicKey}
+_PUBLIC_KEYS = {}
+# worker_impl -> the seed that last verified a signature
+_LAST_VERIFIED_SEEDS = {}
+
 
 def ed25519_private_key_from_string(string):
     """Create an ed25519 private key from ``string``, which is a seed.
@@ -55,6 +63,73 @@ def ed25519_public_key_from_string(string):
         raise ScriptWorkerEd25519Error("Can't create Ed25519PublicKey: {}!".format(str(exc)))
 
 
+def load_ed25519_public_keys(public_keys):
+    """Parse each of the ``ed25519_public_keys`` seeds, e.g. at startup.
+
+    Args:
+        public_keys (dict): the ``ed25519_public_keys`` config: a list of
+            seeds per worker_impl.
+
+    Raises:
+        ScriptWorkerEd25519Error: on a bad seed.
+
+    """
+    for worker_impl, seeds in public_keys.items():
+        for seed in seeds:
+            get_ed25519_public_key(worker_impl, seed)
+
+
+def get_ed25519_public_key(worker_impl, seed):
+    """Get the ed25519 public key for ``seed``, parsing it only the first time.
+
+    Args:
+        worker_impl (str): the worker_impl the key is for.
+        seed (str): the base64-encoded public key seed.
+
+    Returns:
+        Ed25519PublicKey: the public key
+
+    Raises:
+        ScriptWorkerEd25519Error: on a bad seed.
+
+    """
+    keys = _PUBLIC_KEYS.setdefault(worker_impl, {})
+    key = keys.get(seed)
+    if key is None:
+        key = keys[seed] = ed25519_public_key_from_string(seed)
+    return key
+
+
+def get_ed25519_verify_seeds(worker_impl, seeds):
+    """Order ``seeds`` to try the one that last verified a ``worker_impl`` signature first.
+
+    Args:
+        worker_impl (str): the worker_impl of the signature to verify.
+        seeds (list): the ``ed25519_public_keys`` seeds for ``worker_impl``.
+
+    Returns:
+        list: the seeds to try, in order.
+
+    """
+    seeds = list(seeds)
+    last_seed = _LAST_VERIFIED_SEEDS.get(worker_impl)
+    if last_seed in seeds:
+        seeds.remove(last_seed)
+        seeds.insert(0, last_seed)
+    return seeds
+
+
+def set_ed25519_verified_seed(worker_impl, seed):
+    """Remember that ``seed`` verified a ``worker_impl`` signature.
+
+    Args:
+        worker_impl (str): the worker_impl of the verified signature.
+        seed (str): the seed that verified it.
+
+    """
+    _LAST_VERIFIED_SEEDS[worker_impl] = seed
+
+
 def _ed25519_key_from_file(fn, path):
     """Create an ed25519 key from the contents of ``path``.
 
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""Live task logs.
+
+The task log is only uploaded as ``public/logs/live_backing.log`` once the
+task finishes.  To watch a running task, scriptworker can follow the log file
+as it grows and stream it out with chunked transfer encoding:
+
+* if ``livelog_port`` is set, a small http server on ``livelog_host`` serves
+  the running task's log at ``/log/<taskId>``, and
+* if ``livelog_put_url`` is set, scriptworker opens a streaming PUT to that
+  url for each task, like docker-worker does with its livelog process.
+
+Each stream reads the log ``LIVELOG_CHUNK_SIZE`` bytes at a time, in the
+default executor, and waits for the reader before reading more, so memory
+use doesn't depend on the size of the log.
+
+Attributes:
+    log (logging.Logger): the log object for this module.
+    LIVELOG_CHUNK_SIZE (int): the most bytes to read from the log at a time.
+    LIVELOG_POLL_INTERVAL (float): how many seconds to wait for the log to
+        grow once we've reached the end of it.
+    LIVELOG_STOP_TIMEOUT (int): how many seconds to wait for the streaming
+        PUT to finish once the task is done.
+
+"""
+import asyncio
+import logging
+
+import aiohttp
+from aiohttp import web
+
+from scriptworker.utils import get_loggable_url, run_in_executor
+
+log = logging.getLogger(__name__)
+
+LIVELOG_CHUNK_SIZE = 64 * 1024
+LIVELOG_POLL_INTERVAL = 0.5
+LIVELOG_STOP_TIMEOUT = 60
+
+
+# follow_file {{{1
+async def follow_file(path, is_done, chunk_size=LIVELOG_CHUNK_SIZE, poll_interval=LIVELOG_POLL_INTERVAL):
+    """Yield the contents of ``path`` as it grows, like ``tail -f``.
+
+    The file is opened and read in the default executor, so a slow disk
+    doesn't block the event loop.
+
+    Args:
+        path (str): the path of the file to follow.
+        is_done (typing.Callable): returns True once nothing else will be
+            written to ``path``.  We stop once it's done and we've read
+            everything.
+        chunk_size (int, optional): the most bytes to yield at a time.
+            Defaults to ``LIVELOG_CHUNK_SIZE``.
+        poll_interval (float, optional): how many seconds to wait at the end
+            of the file before checking for more.  Defaults to
+            ``LIVELOG_POLL_INTERVAL``.
+
+    Yields:
+        bytes: the next chunk of the file.
+
+    """
+    fh = await run_in_executor(open, path, "rb")
+    try:
+        while True:
+            # Check before reading, so we read anything written before it was done
+            done = is_done()
+            chunk = await run_in_executor(fh.read, chunk_size)
+            if chunk:
+                yield chunk
+            elif done:
+                return
+            else:
+                await asyncio.sleep(poll_interval)
+    finally:
+        fh.close()
+
+
+# TaskLiveLog {{{1
+class TaskLiveLog(object):
+    """The live log of a running task.
+
+    Attributes:
+        context (scriptworker.context.Context): the scriptworker context.
+        done (bool): whether the task has finished writing its log.
+        path (str): the path to the task log.
+        put_future (asyncio.Future): the streaming PUT to ``livelog_put_url``,
+            if any.
+
+    """
+
+    def __init__(self, context, path):
+        """Initialize TaskLiveLog.
+
+        Args:
+            context (scriptworker.context.Context): the scriptworker context.
+            path (str): the path to the task log.
+
+        """
+        self.context = context
+        self.path = path
+        self.done = False
+        self.put_future = None
+
+    def follow(self):
+        """Follow the task log until the task is done.
+
+        Returns:
+            typing.AsyncIterator[bytes]: the chunks of the task log.
+
+        """
+        return follow_file(self.path, lambda: self.done)
+
+    def start(self):
+        """Serve the log from ``context.livelog_server``, and start the PUT to ``livelog_put_url``."""
+        if self.context.livelog_server is not None:
+            self.context.livelog_server.add(self.context.task_id, self)
+        put_url = self.context.config["livelog_put_url"]
+        if put_url:
+            url = put_url.format(task_id=self.context.task_id, run_id=self.context.claim_task["runId"])
+            self.put_future = asyncio.ensure_future(self._put(url))
+
+    async def stop(self):
+        """Finish the live log once the task log is complete.
+
+        Open streams send the rest of the log, then end.  We wait up to
+        ``LIVELOG_STOP_TIMEOUT`` seconds for the streaming PUT to finish.
+
+        """
+        self.done = True
+        if self.context.livelog_server is not None:
+            self.context.livelog_server.remove(self.context.task_id, self)
+        if self.put_future is not None:
+            _, pending = await asyncio.wait([self.put_future], timeout=LIVELOG_STOP_TIMEOUT)
+            if pending:
+                log.warning("Timed out streaming the live log; cancelling")
+                self.put_future.cancel()
+
+    async def _put(self, url):
+        loggable_url = get_loggable_url(url)
+        log.info("Streaming the live log to {}".format(loggable_url))
+        try:
+            # No timeout: the request lasts as long as the task
+            headers = {"Content-Type": "text/plain; charset=utf-8"}
+            async with self.context.session.put(url, data=self.follow(), headers=headers, timeout=None) as resp:
+                if resp.status >= 300:
+                    log.warning("Bad status {} streaming the live log to {}".format(resp.status, loggable_url))
+        except (aiohttp.ClientError, OSError) as e:
+            log.warning("Couldn't stream the live log to {}: {}".format(loggable_url, e))
+
+
+# LiveLogServer {{{1
+class LiveLogServer(object):
+    """Serve the logs of the running tasks at ``/log/<taskId>``.
+
+    Attributes:
+        host (str): the host to listen on.
+        port (int): the port to listen on.
+        allowed_origin (str): the origin allowed to read the logs from a
+            browser, if any.
+        livelogs (dict): the ``TaskLiveLog`` of each running task, by taskId.
+        runner (aiohttp.web.AppRunner): the runner, once started.
+
+    """
+
+    def __init__(self, host, port, allowed_origin=""):
+        """Initialize LiveLogServer.
+
+        Args:
+            host (str): the host to listen on.
+            port (int): the port to listen on.
+            allowed_origin (str, optional): the origin to send in the
+                ``Access-Control-Allow-Origin`` header.  Defaults to "", which
+                doesn't send it, so browsers only let the same origin read the
+                logs.
+
+        """
+        self.host = host
+        self.port = port
+        self.allowed_origin = allowed_origin
+        self.livelogs = {}
+        self.runner = None
+
+    def add(self, task_id, livelog):
+        """Serve ``livelog`` at ``/log/<task_id>``.
+
+        Args:
+            task_id (str): the taskId of the running task.
+            livelog (TaskLiveLog): its live log.
+
+        """
+        self.livelogs[task_id] = livelog
+
+    def remove(self, task_id, livelog):
+        """Stop serving ``livelog`` to new readers.
+
+        Args:
+            task_id (str): the taskId of the finished task.
+            livelog (TaskLiveLog): its live log.
+
+        """
+        if self.livelogs.get(task_id) is livelog:
+            del self.livelogs[task_id]
+
+    async def start(self):
+        """Start listening."""
+        app = web.Application()
+        app.router.add_get("/log/{task_id}", self.handle_log)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        log.info("Serving live task logs at http://{}:{}/log/<taskId>".format(self.host, self.port))
+
+    async def stop(self):
+        """Stop listening."""
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_log(self, request):
+        """Stream the log of a running task, until the task is done.
+
+        Args:
+            request (aiohttp.web.Request): the request.
+
+        Raises:
+            aiohttp.web.HTTPNotFound: if the task isn't running.
+
+        Returns:
+            aiohttp.web.StreamResponse: the response.
+
+        """
+        livelog = self.livelogs.get(request.match_info["task_id"])
+        if livelog is None:
+            raise web.HTTPNotFound(text="Task {} isn't running here".format(request.match_info["task_id"]))
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.allowed_origin:
+            headers["Access-Control-Allow-Origin"] = self.allowed_origin
+        response = web.StreamResponse(headers=headers)
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        chunks = livelog.follow()
+        try:
+            async for chunk in chunks:
+                await response.write(chunk)
+        finally:
+            await chunks.aclose()
+        await response.write_eof()
+        return response
+
+
+# start_livelog_server {{{1
+async def start_livelog_server(context):
+    """Start ``context.livelog_server`` if ``livelog_port`` is set and it isn't running.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    """
+    if context.config["livelog_port"] and context.livelog_server is None:
+        server = LiveLogServer(context.config["livelog_host"], context.config["livelog_port"], allowed_origin=context.config["livelog_allowed_origin"])
+        await server.start()
+        context.livelog_server = server
+
+
+# stop_livelog_server {{{1
+async def stop_livelog_server(context):
+    """Stop ``context.livelog_server``, if any.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    """
+    if context.livelog_server is not None:
+        await context.livelog_server.stop()
+        context.livelog_server = None
@@ -5,17 +5,48 @@ Attributes:
     log (logging.Logger): the log object for this module.
 
 """
+import codecs
 import logging
 import logging.handlers
 import os
+import time
 from asyncio.streams import StreamReader
 from contextlib import contextmanager
-from typing import IO, Any, Generator, Iterator, Optional, Sequence, Union
+from typing import IO, Any, Generator, Iterator, Optional, Sequence
 
-from scriptworker.utils import makedirs, to_unicode
+from scriptworker.utils import makedirs
+
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    # python 3.6
+    contextvars = None  # type: ignore
 
 log = logging.getLogger(__name__)
 
+# The context of the task the current asyncio task is running, if any.
+# New asyncio tasks inherit it, so it follows a task's coroutines.
+_log_context = contextvars.ContextVar("scriptworker_log_context", default=None) if contextvars else None
+
+
+def set_log_context(context: Any) -> None:
+    """Mark log records from the current asyncio task, and any it starts, as coming from ``context``.
+
+    When ``max_concurrent_tasks`` is greater than 1, ``contextual_log_handler``
+    only logs records from its own context, so concurrent tasks don't write
+    into each other's logs.
+
+    Args:
+        context (scriptworker.context.Context): the context of the task being run.
+
+    """
+    if _log_context is not None:
+        _log_context.set(context)
+
+
+def _in_log_context(context: Any) -> bool:
+    return _log_context is not None and _log_context.get() is context
+
 
 def update_logging_config(context: Any, log_name: Optional[str] = None, file_name: str = "worker.log") -> None:
     """Update python logging settings from config.
@@ -65,25 +96,94 @@ def update_logging_config(context: Any, log_name: Optional[str] = None, file_nam
     top_level_logger.addHandler(logging.NullHandler())
 
 
-async def pipe_to_log(pipe: StreamReader, filehandles: Sequence[IO[str]] = (), level: int = logging.INFO) -> None:
+async def pipe_to_log(
+    pipe: StreamReader,
+    filehandles: Sequence[IO[str]] = (),
+    level: int = logging.INFO,
+    chunk_size: int = 64 * 1024,
+    max_line_length: int = 64 * 1024,
+    max_log_lines_per_second: int = 100,
+) -> None:
     """Log from a subprocess PIPE.
 
+    The pipe is read a chunk at a time rather than a line at a time, so a
+    very long line can't overflow the ``StreamReader`` limit.  All the complete
+    lines in a chunk are written to each filehandle at once; lines longer than
+    ``max_line_length`` are split.  At most ``max_log_lines_per_second`` lines a
+    second are also sent to ``log``; the rest only go to the filehandles.
+
     Args:
         pipe (filehandle): subprocess process STDOUT or STDERR
         filehandles (list of filehandles, optional): the filehandle(s) to write
             to.  If empty, don't write to a separate file.  Defaults to ().
         level (int, optional): the level to log to.  Defaults to ``logging.INFO``.
+        chunk_size (int, optional): the most bytes to read from ``pipe`` at a
+            time.  Defaults to 64 KiB.
+        max_line_length (int, optional): split lines longer than this many
+            characters.  Defaults to 64 KiB.
+        max_log_lines_per_second (int, optional): the most lines a second to
+            send to ``log``.  Defaults to 100.
 
     """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    rate_limiter = _LogRateLimiter(level, max_log_lines_per_second)
+    partial = ""
     while True:
-        line = await pipe.readline()  # type: Union[str, bytes]
-        if line:
-            line = to_unicode(line)
-            log.log(level, line.rstrip())
+        chunk = await pipe.read(chunk_size)
+        text = partial + decoder.decode(chunk, final=not chunk)
+        # Hold back an incomplete last line until we read the rest of it
+        end = text.rfind("\n") + 1 if chunk else len(text)
+        text, partial = text[:end], text[end:]
+        while len(partial) > max_line_length:
+            text += partial[:max_line_length] + "\n"
+            partial = partial[max_line_length:]
+        pieces = text.split("\n")
+        lines = [_split_line(piece, max_line_length) + "\n" for piece in pieces[:-1]]
+        if pieces[-1]:
+            lines.append(_split_line(pieces[-1], max_line_length))
+        if lines:
+            rate_limiter.log_lines(lines)
+            output = "".join(lines)
             for filehandle in filehandles:
-                print(line, file=filehandle, end="")
-        else:
+                filehandle.write(output)
+                # Flush so the live log sees it
+                filehandle.flush()
+        if not chunk:
             break
+    rate_limiter.flush()
+
+
+def _split_line(line: str, max_line_length: int) -> str:
+    return "\n".join(line[i : i + max_line_length] for i in range(0, len(line), max_line_length)) or line
+
+
+class _LogRateLimiter(object):
+    """Send at most ``max_lines_per_second`` lines a second to ``log``."""
+
+    def __init__(self, level: int, max_lines_per_second: int) -> None:
+        self.level = level
+        self.max_lines_per_second = max_lines_per_second
+        self.window_start = time.monotonic()
+        self.count = 0
+        self.suppressed = 0
+
+    def log_lines(self, lines: Sequence[str]) -> None:
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            self.flush()
+            self.window_start = now
+            self.count = 0
+        for line in lines:
+            if self.count < self.max_lines_per_second:
+                self.count += 1
+                log.log(self.level, line.rstrip())
+            else:
+                self.suppressed += 1
+
+    def flush(self) -> None:
+        if self.suppressed:
+            log.log(self.level, "(skipped logging {} lines; see the task log)".format(self.suppressed))
+            self.suppressed = 0
 
 
 def get_log_filename(context: Any) -> str:
@@ -96,7 +196,8 @@ def get_log_filename(context: Any) -> str:
         string: log file path
 
     """
-    # XXX Even though our logs aren't live, Treeherder looks for live_backing.log to show errors in failures summary
+    # Treeherder looks for live_backing.log to show errors in failures summary.
+    # scriptworker.livelog serves this file while the task runs, if enabled.
     return os.path.join(context.config["task_log_dir"], "live_backing.log")
 
 
@@ -123,6 +224,9 @@ def contextual_log_handler(
 ) -> Generator[None, None, None]:
     """Add a short-lived log with a contextmanager for cleanup.
 
+    If ``max_concurrent_tasks`` is greater than 1, only records logged under
+    ``context``, as set by ``set_log_context``, are written to ``path``.
+
     Args:
         context (scriptworker.context.Context): the scriptworker context
         path (str): the path to the log file to create
@@ -143,6 +247,8 @@ def contextual_log_handler(
     contextual_handler = logging.FileHandler(path, encoding="utf-8")
     contextual_handler.setLevel(level)
     contextual_handler.setFormatter(formatter)
+    if context.config["max_concurrent_tasks"] > 1:
+        contextual_handler.addFilter(lambda record: _in_log_context(context))
     log_obj.addHandler(contextual_handler)
     yield
     contextual_handler.close()
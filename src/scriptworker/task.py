@@ -12,6 +12,7 @@ import logging
 import os
 import pprint
 import re
+import resource
 from asyncio.subprocess import PIPE
 from copy import deepcopy
 
@@ -21,7 +22,7 @@ import taskcluster.exceptions
 from taskcluster.exceptions import TaskclusterFailure
 
 from scriptworker.constants import get_reversed_statuses
-from scriptworker.exceptions import ScriptWorkerTaskException, WorkerShutdownDuringTask
+from scriptworker.exceptions import ScriptWorkerException, ScriptWorkerTaskException, WorkerShutdownDuringTask
 from scriptworker.github import (
     GitHubRepository,
     extract_github_repo_and_revision_from_source_url,
@@ -29,9 +30,10 @@ from scriptworker.github import (
     is_github_repo_owner_the_official_one,
     is_github_url,
 )
-from scriptworker.log import get_log_filehandle, pipe_to_log
+from scriptworker.livelog import TaskLiveLog
+from scriptworker.log import get_log_filehandle, get_log_filename, pipe_to_log
 from scriptworker.task_process import TaskProcess
-from scriptworker.utils import get_parts_of_url_path, retry_async
+from scriptworker.utils import get_parts_of_url_path, request, retry_async
 
 log = logging.getLogger(__name__)
 
@@ -341,6 +343,8 @@ async def get_project(context, source_url):
     The project is in the path, but is the repo name.
     `releases/mozilla-beta` is the path; `mozilla-beta` is the project.
 
+    The repo may be the source_url itself, or any of its parent paths.
+
     Args:
         source_url (str): the source url to find the project for.
 
@@ -352,9 +356,11 @@ async def get_project(context, source_url):
 
     """
     await context.populate_projects()
-    for project, config in context.projects.items():
-        if source_url == config["repo"] or source_url.startswith(config["repo"] + "/"):
-            return project
+    url = source_url
+    while url:
+        if url in context.projects_by_repo:
+            return context.projects_by_repo[url]
+        url = url.rpartition("/")[0]
     raise ValueError("Unknown repo for source url {}!".format(source_url))
 
 
@@ -597,6 +603,10 @@ def prepare_to_run_task(context, claim_task):
 async def run_task(context, to_cancellable_process):
     """Run the task, sending stdout+stderr to files.
 
+    If ``report_task_metrics`` is set, the resource usage of the task's
+    process group is written to the task log, and reported by
+    ``report_task_metrics``.
+
     https://github.com/python/asyncio/blob/master/examples/subprocess_shell.py
 
     Args:
@@ -611,35 +621,58 @@ async def run_task(context, to_cancellable_process):
     env["TASK_ID"] = context.task_id or "None"
     kwargs = {"stdout": PIPE, "stderr": PIPE, "stdin": None, "close_fds": True, "preexec_fn": lambda: os.setsid(), "env": env}  # pragma: no branch
 
+    metrics_enabled = context.config["report_task_metrics"]
+    # RUSAGE_CHILDREN only gives us this task's usage if it's our only child
+    children_rusage = None
+    if metrics_enabled and context.config["max_concurrent_tasks"] == 1:
+        children_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
     subprocess = await asyncio.create_subprocess_exec(*context.config["task_script"], **kwargs)
-    context.proc = await to_cancellable_process(TaskProcess(subprocess))
+    context.proc = await to_cancellable_process(TaskProcess(subprocess, children_rusage=children_rusage))
     timeout = context.config["task_max_timeout"]
+    monitor_future = None
 
-    with get_log_filehandle(context) as log_filehandle:
-        stderr_future = asyncio.ensure_future(pipe_to_log(context.proc.process.stderr, filehandles=[log_filehandle]))
-        stdout_future = asyncio.ensure_future(pipe_to_log(context.proc.process.stdout, filehandles=[log_filehandle]))
-        try:
-            _, pending = await asyncio.wait([stderr_future, stdout_future], timeout=timeout)
-            if pending:
-                message = "Exceeded task_max_timeout of {} seconds".format(timeout)
-                log.warning(message)
-                await context.proc.stop()
-                raise ScriptWorkerTaskException(message, exit_code=context.config["task_max_timeout_status"])
-        finally:
-            # in the case of a timeout, this will be -15.
-            # this code is in the finally: block so we still get the final
-            # log lines.
-            exitcode = await context.proc.process.wait()
-            # make sure we haven't lost any of the logs
-            await asyncio.wait([stdout_future, stderr_future])
-            # add an exit code line at the end of the log
-            status_line = "exit code: {}".format(exitcode)
-            if exitcode < 0:
-                status_line = "Automation Error: python exited with signal {}".format(exitcode)
-            log.info(status_line)
-            print(status_line, file=log_filehandle)
-            stopped_due_to_worker_shutdown = context.proc.stopped_due_to_worker_shutdown
-            context.proc = None
+    livelog = TaskLiveLog(context, get_log_filename(context))
+    try:
+        if metrics_enabled and context.config["task_metrics_interval"]:
+            monitor_future = asyncio.ensure_future(context.proc.monitor_resource_usage(context.config["task_metrics_interval"]))
+        with get_log_filehandle(context) as log_filehandle:
+            livelog.start()
+            stderr_future = asyncio.ensure_future(pipe_to_log(context.proc.process.stderr, filehandles=[log_filehandle]))
+            stdout_future = asyncio.ensure_future(pipe_to_log(context.proc.process.stdout, filehandles=[log_filehandle]))
+            try:
+                _, pending = await asyncio.wait([stderr_future, stdout_future], timeout=timeout)
+                if pending:
+                    message = "Exceeded task_max_timeout of {} seconds".format(timeout)
+                    log.warning(message)
+                    await context.proc.stop()
+                    raise ScriptWorkerTaskException(message, exit_code=context.config["task_max_timeout_status"])
+            finally:
+                # in the case of a timeout, this will be -15.
+                # this code is in the finally: block so we still get the final
+                # log lines.
+                exitcode = await context.proc.process.wait()
+                if monitor_future is not None:
+                    monitor_future.cancel()
+                # make sure we haven't lost any of the logs
+                await asyncio.wait([stdout_future, stderr_future])
+                # add an exit code line at the end of the log
+                status_line = "exit code: {}".format(exitcode)
+                if exitcode < 0:
+                    status_line = "Automation Error: python exited with signal {}".format(exitcode)
+                log.info(status_line)
+                print(status_line, file=log_filehandle)
+                if metrics_enabled:
+                    resource_usage = context.proc.get_resource_usage()
+                    usage_line = format_resource_usage(resource_usage)
+                    log.info(usage_line)
+                    print(usage_line, file=log_filehandle)
+                    await report_task_metrics(context, exitcode, resource_usage)
+                stopped_due_to_worker_shutdown = context.proc.stopped_due_to_worker_shutdown
+                context.proc = None
+    finally:
+        if monitor_future is not None:
+            monitor_future.cancel()
+        await livelog.stop()
 
     if stopped_due_to_worker_shutdown:
         raise WorkerShutdownDuringTask
@@ -647,6 +680,69 @@ async def run_task(context, to_cancellable_process):
     return 1 if exitcode != 0 else 0
 
 
+# format_resource_usage {{{1
+def format_resource_usage(resource_usage):
+    """Describe the resource usage of a task in a log line.
+
+    Values that weren't measured are shown as ``n/a``.
+
+    Args:
+        resource_usage (dict): the usage from ``TaskProcess.get_resource_usage``.
+
+    Returns:
+        str: the log line.
+
+    """
+    mib = 1024 * 1024
+
+    def format_value(key, template, scale=1):
+        value = resource_usage[key]
+        return "n/a" if value is None else template.format(value / scale)
+
+    return "resource usage: wall {}, cpu user {} sys {}, peak rss {}, read {}, written {}".format(
+        format_value("wall_time", "{:.1f}s"),
+        format_value("cpu_user", "{:.1f}s"),
+        format_value("cpu_system", "{:.1f}s"),
+        format_value("peak_rss", "{:.1f} MiB", mib),
+        format_value("read_bytes", "{:.1f} MiB", mib),
+        format_value("write_bytes", "{:.1f} MiB", mib),
+    )
+
+
+# report_task_metrics {{{1
+async def report_task_metrics(context, exitcode, resource_usage):
+    """Write the task's resource usage to ``task_metrics.json``, and POST it to ``task_metrics_url``.
+
+    ``task_metrics.json`` is written to ``task_log_dir``, so it's uploaded
+    with the task logs.  The POST gives up after ``task_metrics_timeout``
+    seconds and isn't retried; failing to POST the metrics is logged, but
+    doesn't fail the task.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        exitcode (int): the exit code of the task process.
+        resource_usage (dict): the usage from ``TaskProcess.get_resource_usage``.
+
+    """
+    metrics = {
+        "taskId": context.task_id,
+        "runId": context.claim_task.get("runId") if context.claim_task else None,
+        "provisionerId": context.config["provisioner_id"],
+        "workerType": context.config["worker_type"],
+        "workerGroup": context.config["worker_group"],
+        "workerId": context.config["worker_id"],
+        "exitCode": exitcode,
+        "resourceUsage": resource_usage,
+    }
+    context.write_json(os.path.join(context.config["task_log_dir"], "task_metrics.json"), metrics, "Writing task metrics to {path}...")
+    url = context.config["task_metrics_url"]
+    if url:
+        try:
+            await request(context, url, timeout=context.config["task_metrics_timeout"], method="post", json=metrics, good=(200, 201, 202, 204), retry=())
+        except (ScriptWorkerException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Couldn't send task metrics: {}".format(e))
+
+
 # reclaim_task {{{1
 async def reclaim_task(context, task):
     """Try to reclaim a task from the queue.
@@ -688,6 +784,40 @@ async def reclaim_task(context, task):
                 raise
 
 
+# reclaim_claimed_task {{{1
+async def reclaim_claimed_task(context, claim_task):
+    """Reclaim a claimed task that isn't running yet, so its claim doesn't expire.
+
+    This is for a task that was claimed ahead of time, e.g. by
+    ``prefetch_claim_work``, while it waits to run.  ``claim_task``'s
+    ``credentials`` and ``takenUntil`` are updated in place after each
+    reclaim, so the task runs with fresh credentials.  This runs until
+    cancelled, or the queue returns a 409 status.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+        claim_task (dict): the claim_task dict of the waiting task.
+
+    Raises:
+        taskcluster.exceptions.TaskclusterRestFailure: on non-409 status_code
+            from taskcluster.aio.Queue.reclaimTask()
+
+    """
+    task_id = get_task_id(claim_task)
+    while True:
+        await asyncio.sleep(context.config["reclaim_interval"])
+        log.debug("Reclaiming waiting task {}...".format(task_id))
+        try:
+            response = await context.create_queue(claim_task["credentials"]).reclaimTask(task_id, get_run_id(claim_task))
+        except taskcluster.exceptions.TaskclusterRestFailure as exc:
+            if exc.status_code == 409:
+                log.warning("409: not reclaiming waiting task {}.".format(task_id))
+                return
+            raise
+        claim_task["credentials"] = response["credentials"]
+        claim_task["takenUntil"] = response["takenUntil"]
+
+
 # complete_task {{{1
 async def complete_task(context, result):
     """Mark the task as completed in the queue.
@@ -726,12 +856,32 @@ async def complete_task(context, result):
             raise
 
 
+# get_pending_task_count {{{1
+async def get_pending_task_count(context):
+    """Get the number of pending tasks for our ``provisioner_id`` and ``worker_type``.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    Returns:
+        int: the number of pending tasks, or None if we couldn't find out.
+
+    """
+    try:
+        response = await context.queue.pendingTasks(context.config["provisioner_id"], context.config["worker_type"])
+        return response["pendingTasks"]
+    except (taskcluster.exceptions.TaskclusterFailure, aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError) as exc:
+        log.warning("{} {}".format(exc.__class__, exc))
+
+
 # claim_work {{{1
-async def claim_work(context):
+async def claim_work(context, num_tasks=None):
     """Find and claim the next pending task in the queue, if any.
 
     Args:
         context (scriptworker.context.Context): the scriptworker context.
+        num_tasks (int, optional): the most tasks to claim.  If None, use
+            ``max_concurrent_tasks``.  Defaults to None.
 
     Returns:
         dict: a dict containing a list of the task definitions of the tasks claimed.
@@ -741,9 +891,9 @@ async def claim_work(context):
     payload = {
         "workerGroup": context.config["worker_group"],
         "workerId": context.config["worker_id"],
-        # Hardcode one task at a time.  Make this a pref if we allow for
-        # parallel tasks in multiple `work_dir`s.
-        "tasks": 1,
+        # If this is greater than 1, each task runs in its own slot; see
+        # ``Context.create_slot_context``.
+        "tasks": num_tasks or context.config["max_concurrent_tasks"],
     }
     try:
         return await context.queue.claimWork(context.config["provisioner_id"], context.config["worker_type"], payload)
@@ -3,29 +3,153 @@
 
 Attributes:
     log (logging.Logger): the log object for this module
+    PROC_DIR (str): where to read process information from, on Linux.
 
 """
 
 import asyncio
 import logging
 import os
+import resource
 import signal
+import sys
+import time
 from asyncio.subprocess import Process
+from typing import Any, Dict, Optional
+
+from scriptworker.utils import run_in_executor
 
 log = logging.getLogger(__name__)
 
+PROC_DIR = "/proc"
+_PAGE_SIZE = resource.getpagesize()
+# ``ru_maxrss`` is in bytes on macOS, KiB elsewhere
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+# ``ru_inblock`` and ``ru_oublock`` count 512 byte blocks
+_BLOCK_SIZE = 512
+
+
+def read_process_group_usage(pgid: int, proc_dir: str = PROC_DIR) -> Optional[Dict[str, Any]]:
+    """Add up the resource usage of the live processes in a process group.
+
+    Each process's cpu time and I/O include those of the children it has
+    waited for, so the sum covers every process the group has run, other than
+    any that were orphaned.
+
+    Args:
+        pgid (int): the process group id.
+        proc_dir (str, optional): the proc filesystem to read.  Defaults to
+            ``PROC_DIR``.
+
+    Returns:
+        dict: the user and system cpu seconds, rss, read and written bytes,
+            and number of processes.  None if ``proc_dir`` doesn't exist.
+
+    """
+    if not os.path.isdir(proc_dir):
+        return None
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    usage = {"cpu_user": 0.0, "cpu_system": 0.0, "rss": 0, "read_bytes": 0, "write_bytes": 0, "processes": 0}
+    for pid in os.listdir(proc_dir):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc_dir, pid, "stat")) as fh:
+                stat = fh.read()
+            # The command name may contain spaces, so start after it.  This
+            # leaves field 3 (state) at index 0.
+            fields = stat[stat.rindex(")") + 2 :].split()
+            if int(fields[2]) != pgid:
+                continue
+            usage["cpu_user"] += (int(fields[11]) + int(fields[13])) / clock_ticks
+            usage["cpu_system"] += (int(fields[12]) + int(fields[14])) / clock_ticks
+            usage["rss"] += int(fields[21]) * _PAGE_SIZE
+            usage["processes"] += 1
+        except (OSError, ValueError, IndexError):
+            # The process exited while we read it
+            continue
+        try:
+            with open(os.path.join(proc_dir, pid, "io")) as fh:
+                for line in fh:
+                    key, _, value = line.partition(":")
+                    if key in ("read_bytes", "write_bytes"):
+                        usage[key] += int(value)
+        except (OSError, ValueError):
+            pass
+    return usage
+
 
 class TaskProcess:
     """Wraps worker task's process."""
 
-    def __init__(self, process: Process):
+    def __init__(self, process: Process, children_rusage: Optional[resource.struct_rusage] = None):
         """Constructor.
 
         Args:
             process (Process): task process
+            children_rusage (resource.struct_rusage, optional): the
+                ``RUSAGE_CHILDREN`` usage from just before the process started.
+                Only pass this if no other child processes will be waited for
+                while this one runs; we'll use it for exact cpu and I/O usage.
         """
         self.process = process
         self.stopped_due_to_worker_shutdown = False
+        self.children_rusage = children_rusage
+        self.start_time = time.monotonic()
+        self.peak_usage: Dict[str, Any] = {}
+
+    def _update_peak_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        for key, value in (usage or {}).items():
+            self.peak_usage[key] = max(self.peak_usage.get(key, 0), value)
+
+    async def monitor_resource_usage(self, interval: float) -> None:
+        """Sample the process group's resource usage every ``interval`` seconds, until cancelled.
+
+        /proc is scanned in the default executor, so a big process table
+        doesn't block the event loop.
+
+        Args:
+            interval (float): the number of seconds between samples.
+        """
+        while True:
+            usage = await run_in_executor(read_process_group_usage, self.process.pid)
+            self._update_peak_usage(usage)
+            await asyncio.sleep(interval)
+
+    def get_resource_usage(self) -> Dict[str, Any]:
+        """Get the resource usage of the task, once the process has been waited for.
+
+        Values we couldn't measure are None, rather than 0: without
+        ``children_rusage`` or samples from ``monitor_resource_usage`` there's
+        no cpu time or I/O, and the peak rss and process count need samples,
+        unless ``ru_maxrss`` grew.
+
+        Returns:
+            dict: the wall time and user and system cpu time in seconds, the
+                peak rss in bytes, the bytes read and written, and the most
+                processes running at once.
+        """
+        usage = {
+            "wall_time": time.monotonic() - self.start_time,
+            "cpu_user": self.peak_usage.get("cpu_user"),
+            "cpu_system": self.peak_usage.get("cpu_system"),
+            "peak_rss": self.peak_usage.get("rss"),
+            "read_bytes": self.peak_usage.get("read_bytes"),
+            "write_bytes": self.peak_usage.get("write_bytes"),
+            "max_processes": self.peak_usage.get("processes"),
+        }
+        if self.children_rusage is not None:
+            start = self.children_rusage
+            end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            usage["cpu_user"] = end.ru_utime - start.ru_utime
+            usage["cpu_system"] = end.ru_stime - start.ru_stime
+            usage["read_bytes"] = (end.ru_inblock - start.ru_inblock) * _BLOCK_SIZE
+            usage["write_bytes"] = (end.ru_oublock - start.ru_oublock) * _BLOCK_SIZE
+            # ru_maxrss is the biggest child we've ever waited for, so we only
+            # learn something if it grew.
+            if end.ru_maxrss > start.ru_maxrss:
+                usage["peak_rss"] = max(usage["peak_rss"] or 0, end.ru_maxrss * _MAXRSS_UNIT)
+        return usage
 
     async def worker_shutdown_stop(self) -> None:
         """Invoke on worker shutdown to stop task process."""
@@ -3,6 +3,7 @@
 
 Attributes:
     log (logging.Logger): the log object for the module
+    HASH_BUFFER_SIZE (int): the number of bytes ``get_hash`` reads at a time
 
 """
 import asyncio
@@ -15,7 +16,6 @@ import random
 import re
 import shutil
 import time
-from copy import deepcopy
 from typing import IO, Any, Awaitable, Callable, Dict, Match, Optional, Sequence, Tuple, Type, Union, cast, overload
 from urllib.parse import unquote, urlparse
 
@@ -23,12 +23,24 @@ import aiohttp
 import arrow
 import async_timeout
 import yaml
+from immutabledict import immutabledict
 from taskcluster.client import createTemporaryCredentials
 
 from scriptworker.exceptions import Download404, DownloadError, ScriptWorkerException, ScriptWorkerRetryException, ScriptWorkerTaskException
 
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    # python 3.6
+    contextvars = None  # type: ignore
+
 log = logging.getLogger(__name__)
 
+HASH_BUFFER_SIZE = 1024 * 1024
+# The ETags of partial downloads in this process, keyed by path, so a retry
+# can resume them with If-Range.
+_PARTIAL_DOWNLOAD_ETAGS = {}  # type: Dict[str, str]
+
 
 # request {{{1
 async def request(context, url, timeout=60, method="get", good=(200,), retry=tuple(range(500, 512)), return_type="text", **kwargs):
@@ -403,6 +415,27 @@ async def raise_future_exceptions(tasks):
     return succeeded_results
 
 
+# run_in_executor {{{1
+def run_in_executor(func: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+    """Run ``func(*args)`` in the default executor, in a copy of the current context.
+
+    Copying the context keeps log records from ``func`` in the task log of the
+    task that called it, e.g. when running concurrent tasks.
+
+    Args:
+        func (typing.Callable): the function to run.
+        *args: the args to pass to ``func``.
+
+    Returns:
+        asyncio.Future: the future of ``func``'s result.
+
+    """
+    loop = asyncio.get_event_loop()
+    if contextvars is None:
+        return loop.run_in_executor(None, func, *args)
+    return loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+
 # get_results_and_future_exceptions {{{1
 async def get_results_and_future_exceptions(tasks):
     """Given a list of futures, await them, then return results and exceptions.
@@ -480,7 +513,7 @@ def get_hash(path, hash_alg="sha256"):
     """
     h = hashlib.new(hash_alg)
     with open(path, "rb") as f:
-        for chunk in iter(functools.partial(f.read, 4096), b""):
+        for chunk in iter(functools.partial(f.read, HASH_BUFFER_SIZE), b""):
             h.update(chunk)
     return h.hexdigest()
 
@@ -636,9 +669,185 @@ async def _log_download_error(resp, msg):
         log.debug("Redirect history %s: %s; body=%s", get_loggable_url(str(h.url)), h.status, (await h.text())[:1000])
 
 
-async def download_file(context, url, abs_filename, session=None, chunk_size=128, auth=None):
+def _preallocate_file(fd, size):
+    """Preallocate ``fd`` to ``size`` bytes, if the platform supports it.
+
+    Returns:
+        bool: whether the file was preallocated.
+
+    """
+    if not size or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fd.fileno(), 0, size)
+    except OSError:
+        return False
+    return True
+
+
+def _get_known_length(resp):
+    # aiohttp decompresses encoded responses, so Content-Length won't match
+    if resp.headers.get("Content-Encoding"):
+        return None
+    return resp.content_length
+
+
+def _write_chunk(fd, chunk, hashes, offset=None):
+    if offset is None:
+        fd.write(chunk)
+    else:
+        os.pwrite(fd.fileno(), chunk, offset)
+    for h in hashes.values():
+        h.update(chunk)
+    return len(chunk)
+
+
+def _hash_file(path, hashes, size=None):
+    with open(path, "rb") as fh:
+        remaining = size
+        while remaining is None or remaining > 0:
+            chunk = fh.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+            if not chunk:
+                break
+            for h in hashes.values():
+                h.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+
+async def _write_response(resp, fd, chunk_size, hashes, offset=None):
+    """Write the body of ``resp`` to ``fd``, one chunk behind the network.
+
+    Args:
+        resp (aiohttp.ClientResponse): the response to read.
+        fd (file): the open file to write to.
+        chunk_size (int): the number of bytes to read at a time.
+        hashes (dict): hash objects to update with each chunk.
+        offset (int, optional): if set, ``pwrite`` from this offset rather than
+            writing at the file position.  Defaults to None.
+
+    Returns:
+        int: the number of bytes written.
+
+    """
+    written = 0
+    pending_write = None
+    try:
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            if pending_write is not None:
+                written += await pending_write
+            pending_write = run_in_executor(_write_chunk, fd, chunk, hashes, None if offset is None else offset + written)
+    finally:
+        if pending_write is not None:
+            written += await pending_write
+    return written
+
+
+async def _check_download_status(resp, expected_statuses):
+    loggable_url = get_loggable_url(str(resp.url))
+    if resp.status == 404:
+        await _log_download_error(resp, "404 downloading %(url)s: %(status)s; body=%(body)s")
+        raise Download404("{} status {}!".format(loggable_url, resp.status))
+    elif resp.status not in expected_statuses:
+        await _log_download_error(resp, "Failed to download %(url)s: %(status)s; body=%(body)s")
+        raise DownloadError("{} status {} is not in {}!".format(loggable_url, resp.status, expected_statuses))
+
+
+def _get_content_range(resp):
+    """Get the start, end and total size from the ``Content-Range`` of ``resp``.
+
+    Returns:
+        tuple: (start, end, size), or (None, None, None) if there's no valid
+            ``Content-Range``.  ``size`` is None if the server doesn't know it.
+
+    """
+    m = re.match(r"^bytes (\d+)-(\d+)/(\d+|\*)$", resp.headers.get("Content-Range", ""))
+    if not m:
+        return None, None, None
+    return int(m.group(1)), int(m.group(2)), None if m.group(3) == "*" else int(m.group(3))
+
+
+def _get_etag(resp):
+    # Only a strong ETag can be used in If-Range
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+
+
+async def _download_segment(session, url, fd, start, end, auth, chunk_size, etag):
+    """Download bytes ``start`` to ``end`` inclusive of ``url`` into ``fd``.
+
+    If ``url`` no longer matches ``etag``, the server sends the whole file
+    rather than the segment, and we raise ``DownloadError``.
+
+    """
+    async with session.get(url, auth=auth, headers={"Range": "bytes={}-{}".format(start, end), "If-Range": etag}) as resp:
+        await _check_download_status(resp, (206,))
+        if _get_content_range(resp)[0] != start:
+            raise DownloadError("{} returned Content-Range {} for bytes {}-{}!".format(get_loggable_url(url), resp.headers.get("Content-Range"), start, end))
+        written = await _write_response(resp, fd, chunk_size, {}, offset=start)
+    if written != end - start + 1:
+        raise DownloadError("{} returned {} bytes for bytes {}-{}!".format(get_loggable_url(url), written, start, end))
+
+
+async def _download_segments(context, url, fd, resp, size, session, auth, chunk_size):
+    """Download the rest of ``url`` into ``fd`` over several connections, one per segment.
+
+    ``resp`` is the response to the first request, for the first range of
+    the file.  We keep reading it while the rest of the file is split
+    between ``download_segments - 1`` more connections.  Each segment is
+    retried on its own, so a dropped connection only costs that segment.
+
+    """
+    _, first_end, _ = _get_content_range(resp)
+    etag = _get_etag(resp)
+    segment_size = -(-(size - first_end - 1) // (context.config["download_segments"] - 1))
+    log.info("Downloading %s in %d byte segments", get_loggable_url(url), segment_size)
+    if not _preallocate_file(fd, size):
+        fd.truncate(size)
+
+    async def _download_first_segment():
+        try:
+            written = await _write_response(resp, fd, chunk_size, {}, offset=0)
+            if written != first_end + 1:
+                raise DownloadError("{} returned {} bytes for bytes 0-{}!".format(get_loggable_url(url), written, first_end))
+        except (DownloadError, aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            log.warning("Retrying bytes 0-%d of %s: %s", first_end, get_loggable_url(url), exc)
+            await _retry_segment(0, first_end)
+
+    def _retry_segment(start, end):
+        return retry_async(
+            _download_segment,
+            args=(session, url, fd, start, end, auth, chunk_size, etag),
+            retry_exceptions=(DownloadError, aiohttp.ClientError, asyncio.TimeoutError),
+            sleeptime_kwargs={"max_delay": 15},
+        )
+
+    tasks = [asyncio.ensure_future(_download_first_segment())]
+    tasks.extend(asyncio.ensure_future(_retry_segment(start, min(start + segment_size, size) - 1)) for start in range(first_end + 1, size, segment_size))
+    await raise_future_exceptions(tasks)
+
+
+async def download_file(context, url, abs_filename, session=None, chunk_size=None, auth=None, hash_algs=None):
     """Download a file, async.
 
+    The file is downloaded to ``abs_filename.part`` and renamed into place
+    when complete.  If an earlier attempt in this process left a partial
+    file, we ask the server for the rest of it with an HTTP Range request,
+    so a retry doesn't start from byte zero.  The request is conditional on
+    the ETag of the earlier response, via If-Range, so if the file changed
+    the server sends all of it.  A partial file without a known ETag is
+    downloaded again from the start.
+
+    If ``download_segments`` is greater than 1, the first request only asks
+    for the first ``download_segment_threshold`` bytes.  If the file is
+    larger, the rest of it is downloaded over ``download_segments - 1`` more
+    connections in parallel, while we read the first response.
+
+    Disk writes and any ``hash_algs`` run in the default executor, so large
+    downloads don't block the event loop; each chunk is written while the
+    next one is being read.
+
     Args:
         context (scriptworker.context.Context): the scriptworker context.
         url (str): the url to download
@@ -646,31 +855,101 @@ async def download_file(context, url, abs_filename, session=None, chunk_size=128
         session (aiohttp.ClientSession, optional): the session to use.  If
             None, use context.session.  Defaults to None.
         chunk_size (int, optional): the chunk size to read from the response
-            at a time.  Default is 128.
+            at a time.  If None, use ``context.config["download_chunk_size"]``.
+            Defaults to None.
+        hash_algs (list, optional): the hash algorithms to compute, e.g.
+            ``["sha256"]``.  Defaults to None.
+
+    Returns:
+        dict: the hexdigests of the downloaded file, keyed by hash algorithm.
 
     """
     session = session or context.session
+    chunk_size = chunk_size or context.config["download_chunk_size"]
+    hashes = {alg: hashlib.new(alg) for alg in hash_algs or []}
     loggable_url = get_loggable_url(url)
     if auth:
         log.info("Downloading with Authentication %s", loggable_url)
     else:
         log.info("Downloading %s", loggable_url)
     parent_dir = os.path.dirname(abs_filename)
-    async with session.get(url, auth=auth) as resp:
-        if resp.status == 404:
-            await _log_download_error(resp, "404 downloading %(url)s: %(status)s; body=%(body)s")
-            raise Download404("{} status {}!".format(loggable_url, resp.status))
-        elif resp.status != 200:
-            await _log_download_error(resp, "Failed to download %(url)s: %(status)s; body=%(body)s")
-            raise DownloadError("{} status {} is not 200!".format(loggable_url, resp.status))
-        makedirs(parent_dir)
-        with open(abs_filename, "wb") as fd:
-            while True:
-                chunk = await resp.content.read(chunk_size)
-                if not chunk:
-                    break
-                fd.write(chunk)
+    part_filename = "{}.part".format(abs_filename)
+    offset = os.path.getsize(part_filename) if os.path.isfile(part_filename) else 0
+    etag = _PARTIAL_DOWNLOAD_ETAGS.pop(part_filename, None)
+    if offset and not etag:
+        log.info("Can't tell if partial download %s is current; starting over", part_filename)
+        offset = 0
+    segmented = not offset and context.config["download_segments"] > 1
+    while True:
+        if offset:
+            headers = {"Range": "bytes={}-".format(offset), "If-Range": etag}
+        elif segmented:
+            # The Content-Range tells us the size, without starting a full
+            # download we'd have to abort
+            headers = {"Range": "bytes=0-{}".format(context.config["download_segment_threshold"] - 1)}
+        else:
+            headers = None
+        async with session.get(url, auth=auth, headers=headers) as resp:
+            if resp.status == 416:
+                if not offset:
+                    # An empty file has no bytes to ask for
+                    segmented = False
+                    continue
+                # The partial file is bad; start over on the next attempt
+                rm(part_filename)
+                raise DownloadError("{} status {}; removed partial download!".format(loggable_url, resp.status))
+            await _check_download_status(resp, (200, 206) if headers else (200,))
+            length = _get_known_length(resp)
+            segmented_size = None
+            if resp.status == 206:
+                start, end, size = _get_content_range(resp)
+                if start != offset:
+                    rm(part_filename)
+                    raise DownloadError("{} returned Content-Range {} for bytes {}-!".format(loggable_url, resp.headers.get("Content-Range"), offset))
+                if offset:
+                    log.info("Resuming %s at byte %d", loggable_url, offset)
+                    await run_in_executor(_hash_file, part_filename, hashes, offset)
+                elif size is None or end + 1 < size:
+                    if resp.headers.get("Content-Encoding") or not _get_etag(resp) or size is None:
+                        # We can't put encoded or unidentifiable ranges back together
+                        segmented = False
+                        continue
+                    segmented_size = size
+                else:
+                    # The first range is the whole file
+                    length = end + 1 if not resp.headers.get("Content-Encoding") else None
+            else:
+                offset = 0
+            makedirs(parent_dir)
+            with open(part_filename, "ab" if offset else "wb") as fd:
+                if segmented_size is not None:
+                    try:
+                        await _download_segments(context, url, fd, resp, segmented_size, session, auth, chunk_size)
+                    except Exception:
+                        # A segmented partial file has holes, so it can't be resumed
+                        fd.close()
+                        rm(part_filename)
+                        raise
+                else:
+                    preallocated = not offset and _preallocate_file(fd, length)
+                    try:
+                        await _write_response(resp, fd, chunk_size, hashes)
+                    except Exception:
+                        resume_etag = etag if offset else _get_etag(resp)
+                        if resume_etag and not resp.headers.get("Content-Encoding"):
+                            # Let the next attempt resume, if this is still the same file
+                            _PARTIAL_DOWNLOAD_ETAGS[part_filename] = resume_etag
+                        raise
+                    finally:
+                        if preallocated:
+                            # Drop the preallocated tail, so a partial file stays resumable
+                            fd.truncate()
+        break
+    if segmented_size is not None and hashes:
+        await run_in_executor(_hash_file, part_filename, hashes)
+    os.replace(part_filename, abs_filename)
     log.info("Done")
+    return {alg: h.hexdigest() for alg, h in hashes.items()}
 
 
 # get_loggable_url {{{1
@@ -825,6 +1104,52 @@ def add_enumerable_item_to_dict(dict_, key, item):
         dict_[key].append(item)
 
 
+# get_frozen_copy {{{1
+def get_frozen_copy(values):
+    """Convert `values`'s list values into tuples, and dicts into immutabledicts.
+
+    A recursive function(bottom-up conversion).  Parts of `values` that are
+    already frozen all the way down are reused rather than rebuilt.
+
+    Args:
+        values (dict/list): the values/list to be modified in-place.
+
+    """
+    if isinstance(values, (immutabledict, dict)):
+        frozen = {key: get_frozen_copy(value) for key, value in values.items()}
+        if isinstance(values, immutabledict) and all(frozen[key] is value for key, value in values.items()):
+            return values
+        return immutabledict(frozen)
+    elif isinstance(values, (list, tuple)):
+        frozen = tuple([get_frozen_copy(value) for value in values])
+        if isinstance(values, tuple) and all(new is old for new, old in zip(frozen, values)):
+            return values
+        return frozen
+
+    # Nothing to freeze.
+    return values
+
+
+# get_unfrozen_copy {{{1
+def get_unfrozen_copy(values):
+    """Recursively convert `value`'s tuple values into lists, and immutabledicts into dicts.
+
+    Args:
+        values (immutabledict/tuple): the immutabledict/tuple.
+
+    Returns:
+        values (dict/list): the unfrozen copy.
+
+    """
+    if isinstance(values, (immutabledict, dict)):
+        return {key: get_unfrozen_copy(value) for key, value in values.items()}
+    elif isinstance(values, (list, tuple)):
+        return [get_unfrozen_copy(value) for value in values]
+
+    # Nothing to unfreeze.
+    return values
+
+
 # remove_empty_keys {{{1
 def remove_empty_keys(values, remove=({}, None, [], "null")):
     """Recursively remove key/value pairs where the value is in ``remove``.
@@ -837,12 +1162,13 @@ def remove_empty_keys(values, remove=({}, None, [], "null")):
 
     Returns:
         values (dict/list): a dict or list copy, with empty keys removed.
+            Other values are shared with ``values``, not copied.
 
     """
     if isinstance(values, dict):
-        return {key: remove_empty_keys(value, remove=remove) for key, value in deepcopy(values).items() if value not in remove}
+        return {key: remove_empty_keys(value, remove=remove) for key, value in values.items() if value not in remove}
     if isinstance(values, list):
-        return [remove_empty_keys(value, remove=remove) for value in deepcopy(values) if value not in remove]
+        return [remove_empty_keys(value, remove=remove) for value in values if value not in remove]
 
     return values
 
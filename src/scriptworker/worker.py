@@ -7,7 +7,9 @@ Attributes:
 """
 import asyncio
 import logging
+import math
 import os
+import random
 import signal
 import socket
 import sys
@@ -17,21 +19,35 @@ from typing import Any
 import aiohttp
 import arrow
 
-from scriptworker.artifacts import upload_artifacts
+from scriptworker.artifacts import checkpoint_logs, finalize_artifacts, upload_artifacts
 from scriptworker.config import get_context_from_cmdln
 from scriptworker.constants import STATUSES
 from scriptworker.cot.generate import generate_cot
 from scriptworker.cot.verify import ChainOfTrust, verify_chain_of_trust
+from scriptworker.ed25519 import load_ed25519_public_keys
 from scriptworker.exceptions import ScriptWorkerException, WorkerShutdownDuringTask
-from scriptworker.task import claim_work, complete_task, prepare_to_run_task, reclaim_task, run_task, worst_level
+from scriptworker.livelog import start_livelog_server, stop_livelog_server
+from scriptworker.log import set_log_context
+from scriptworker.task import (
+    claim_work,
+    complete_task,
+    get_pending_task_count,
+    prepare_to_run_task,
+    reclaim_claimed_task,
+    reclaim_task,
+    run_task,
+    worst_level,
+)
 from scriptworker.task_process import TaskProcess
-from scriptworker.utils import cleanup, filepaths_in_dir
+from scriptworker.utils import cleanup, filepaths_in_dir, run_in_executor
 
 log = logging.getLogger(__name__)
 
+_POLL_RANDOMIZATION_FACTOR = 0.5
+
 
 # do_run_task {{{1
-async def do_run_task(context, run_cancellable, to_cancellable_process):
+async def do_run_task(context, run_cancellable, to_cancellable_process, stop_checkpoint=None):
     """Run the task logic.
 
     Returns the integer status of the task.
@@ -41,6 +57,9 @@ async def do_run_task(context, run_cancellable, to_cancellable_process):
         run_cancellable (typing.Callable): wraps future such that it'll cancel upon worker shutdown
         to_cancellable_process (typing.Callable): wraps ``TaskProcess`` such that it will stop if the worker is shutting
             down
+        stop_checkpoint (typing.Callable, optional): coroutine function that stops the log checkpoints.
+            It's awaited once the task exits, before ``finalize_artifacts`` compresses the logs.
+            Defaults to None.
 
     Raises:
         Exception: on unexpected exception.
@@ -55,7 +74,11 @@ async def do_run_task(context, run_cancellable, to_cancellable_process):
             chain = ChainOfTrust(context, context.config["cot_job_type"])
             await run_cancellable(verify_chain_of_trust(chain))
         status = await run_task(context, to_cancellable_process)
-        generate_cot(context)
+        if stop_checkpoint is not None:
+            await stop_checkpoint()
+        # Hash and compress the artifacts in one read, before generating the cot
+        await finalize_artifacts(context)
+        await run_in_executor(generate_cot, context)
     except asyncio.CancelledError:
         log.info("CoT cancelled asynchronously")
         raise WorkerShutdownDuringTask
@@ -100,18 +123,63 @@ async def do_upload(context, files):
     return status
 
 
+# get_poll_sleep_time {{{1
+def get_poll_sleep_time(context):
+    """Get the number of seconds to sleep before polling the queue again.
+
+    While idle, we back off exponentially from ``poll_interval`` up to
+    ``max_poll_interval``, with jitter so idle workers don't poll in lockstep.
+    The jitter is applied under ``max_poll_interval``, so it still applies
+    once we've backed off all the way.  If ``max_poll_interval`` isn't larger
+    than ``poll_interval``, we always sleep ``poll_interval``.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    Returns:
+        float: the number of seconds to sleep.
+
+    """
+    poll_interval = context.config["poll_interval"]
+    max_poll_interval = context.config["max_poll_interval"]
+    if max_poll_interval <= poll_interval or poll_interval <= 0:
+        return poll_interval
+    # Stop doubling once we've reached max_poll_interval; idle_poll_count
+    # grows without limit, and a big enough exponent overflows a float
+    attempt = min(max(context.idle_poll_count, 1), math.ceil(math.log2(max_poll_interval / poll_interval)) + 1)
+    delay = poll_interval * 2 ** (attempt - 1)
+    # Leave room under max_poll_interval for the jitter
+    delay = max(poll_interval, min(delay, max_poll_interval / (1 + _POLL_RANDOMIZATION_FACTOR)))
+    return min(delay * (1 + _POLL_RANDOMIZATION_FACTOR * random.random()), max_poll_interval)
+
+
+# RunTasks {{{1
 class RunTasks:
     """Manages processing of Taskcluster tasks."""
 
     def __init__(self):
         """Constructor."""
-        self.future = None
-        self.task_process = None
+        self.futures = set()
+        self.task_processes = []
         self.is_cancelled = False
+        self.is_stopped_claiming = False
+        self.prefetched_claim = None
+        # (task_defn, reclaim future) for each prefetched task that hasn't started running
+        self.prefetched_reclaims = []
 
     async def invoke(self, context):
         """Claims and processes Taskcluster work.
 
+        If ``max_concurrent_tasks`` is greater than 1, each claimed task runs
+        concurrently in its own slot context, and we claim more tasks whenever
+        a slot is idle; otherwise any tasks claimed run sequentially.
+
+        If ``prefetch_claim_work`` is set and tasks run sequentially, the next
+        ``claimWork`` call starts as soon as the claimed tasks have finished
+        running, overlapping with their upload and ``complete_task`` calls.
+        Any tasks it claims are reclaimed until they start running, and are
+        run in this same call, until a claim comes back empty.
+
         Args:
             context (scriptworker.context.Context): context of worker
 
@@ -121,45 +189,256 @@ class RunTasks:
         try:
             # Note: claim_work(...) might not be safely interruptible! See
             # https://bugzilla.mozilla.org/show_bug.cgi?id=1524069
+            if context.config["check_pending_tasks"] and context.idle_poll_count:
+                if await self._run_cancellable(get_pending_task_count(context)) == 0:
+                    await self._sleep_while_idle(context)
+                    return None
             tasks = await self._run_cancellable(claim_work(context))
             if not tasks or not tasks.get("tasks", []):
-                await self._run_cancellable(asyncio.sleep(context.config["poll_interval"]))
+                await self._sleep_while_idle(context)
                 return None
 
-            # Assume only a single task, but should more than one fall through,
-            # run them sequentially.  A side effect is our return status will
-            # be the status of the final task run.
             status = None
-            for task_defn in tasks.get("tasks", []):
-                prepare_to_run_task(context, task_defn)
-                reclaim_fut = context.event_loop.create_task(reclaim_task(context, context.task))
+            while tasks and tasks.get("tasks", []):
+                context.idle_poll_count = 0
+                status = await self._run_claimed_tasks(context, tasks["tasks"])
+                if self.prefetched_claim is None:
+                    break
+                # Any tasks the prefetched claim returns are ours, so we run
+                # them even if we've since stopped claiming.
                 try:
-                    status = await do_run_task(context, self._run_cancellable, self._to_cancellable_process)
-                    artifacts_paths = filepaths_in_dir(context.config["artifact_dir"])
-                except WorkerShutdownDuringTask:
-                    shutdown_artifact_paths = [os.path.join("public", "logs", log_file) for log_file in ["chain_of_trust.log", "live_backing.log"]]
-                    artifacts_paths = [path for path in shutdown_artifact_paths if os.path.isfile(os.path.join(context.config["artifact_dir"], path))]
-                    status = STATUSES["worker-shutdown"]
-                status = worst_level(status, await do_upload(context, artifacts_paths))
-                await complete_task(context, status)
-                reclaim_fut.cancel()
-                cleanup(context)
+                    tasks = await self.prefetched_claim
+                finally:
+                    self.prefetched_claim = None
+                if (not tasks or not tasks.get("tasks", [])) and not self.is_stopped_claiming:
+                    await self._sleep_while_idle(context)
 
             return status
 
         except asyncio.CancelledError:
             return None
+        finally:
+            if self.prefetched_claim is not None:
+                await self._resolve_prefetched_claim(context)
+            for task_defn, _ in list(self.prefetched_reclaims):
+                self._stop_prefetched_reclaim(task_defn)
+
+    async def _resolve_prefetched_claim(self, context):
+        """Report any tasks the prefetched claim returned, that we won't run, as ``worker-shutdown``.
+
+        This happens if a task hit an unexpected exception, or we were
+        cancelled after the prefetched claim returned.
+
+        """
+        prefetched_claim, self.prefetched_claim = self.prefetched_claim, None
+        try:
+            tasks = await prefetched_claim
+        except (asyncio.CancelledError, Exception):
+            return
+        for task_defn in (tasks or {}).get("tasks", []):
+            try:
+                context.claim_task = task_defn
+                log.warning("Not running prefetched task {}; reporting worker-shutdown".format(context.task_id))
+                await complete_task(context, STATUSES["worker-shutdown"])
+            except Exception:
+                log.exception("Failed to resolve prefetched task")
+            finally:
+                cleanup(context)
+
+    async def _sleep_while_idle(self, context):
+        context.idle_poll_count += 1
+        await self._poll_sleep(context)
+
+    async def _poll_sleep(self, context):
+        sleep_time = get_poll_sleep_time(context)
+        log.debug("No tasks claimed; sleeping {} seconds".format(sleep_time))
+        await self._run_cancellable(asyncio.sleep(sleep_time))
+
+    async def _run_claimed_tasks(self, context, task_defns):
+        if context.config["max_concurrent_tasks"] > 1:
+            return await self._run_concurrent_tasks(context, task_defns)
+
+        # Should more than one task fall through, run them sequentially.
+        # A side effect is our return status will be the status of the
+        # final task run.
+        status = None
+        for i, task_defn in enumerate(task_defns):
+            status = await self._run_task(context, task_defn, prefetch=i == len(task_defns) - 1)
+        return status
+
+    async def _run_concurrent_tasks(self, context, task_defns):
+        """Run each task in its own slot, claiming more work as slots free up.
+
+        We keep going until all the slots are idle and a claim comes back
+        empty.  While the queue stays empty, we poll less often, like an idle
+        worker does.  If a slot or a claim hits an unexpected exception, we
+        stop claiming, let the other slots finish their tasks, then re-raise
+        it.
+
+        Returns:
+            int: the worst status of the tasks run.
+
+        """
+        free_slots = list(range(context.config["max_concurrent_tasks"]))
+        running = {}
+        pending = list(task_defns)
+        status = None
+        exception = None
+        try:
+            while True:
+                # claimWork shouldn't return more tasks than we asked for, but
+                # if it does, the extra tasks wait for a free slot
+                while pending and free_slots:
+                    slot = free_slots.pop(0)
+                    running[asyncio.ensure_future(self._run_task(context.create_slot_context(slot), pending.pop(0)))] = slot
+                can_claim = exception is None and not self.is_cancelled and not self.is_stopped_claiming
+                if not running:
+                    if can_claim:
+                        # The last claim came back empty, and already counted as idle
+                        await self._poll_sleep(context)
+                    break
+                # Poll for more work while any slots are idle
+                timeout = get_poll_sleep_time(context) if free_slots and not pending and can_claim else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    free_slots.append(running.pop(future))
+                    try:
+                        status = worst_level(status or 0, future.result())
+                    except Exception as e:
+                        log.exception("SCRIPTWORKER_UNEXPECTED_EXCEPTION slot {}".format(e))
+                        exception = exception or e
+                free_slots.sort()
+                if pending or not free_slots or exception is not None or self.is_cancelled or self.is_stopped_claiming:
+                    continue
+                try:
+                    pending = await self._claim_work_for_slots(context, len(free_slots))
+                except asyncio.CancelledError:
+                    if not self.is_cancelled:
+                        raise
+                    # The running slots handle their own shutdown
+                except Exception as e:
+                    log.exception("SCRIPTWORKER_UNEXPECTED_EXCEPTION claim_work {}".format(e))
+                    exception = e
+        finally:
+            # Don't orphan the slots if we're leaving early
+            for future in running:
+                future.cancel()
+            if running:
+                await asyncio.wait(running)
+        if exception is not None:
+            raise exception
+        return status
+
+    async def _claim_work_for_slots(self, context, num_tasks):
+        """Claim up to ``num_tasks`` tasks for the idle slots.
+
+        Like ``invoke``, this skips the claim if ``check_pending_tasks`` is set,
+        we're idle, and the queue has no pending tasks.
+
+        Returns:
+            list: the claimed task definitions.
+
+        """
+        task_defns = []
+        if not (context.config["check_pending_tasks"] and context.idle_poll_count) or await self._run_cancellable(get_pending_task_count(context)) != 0:
+            tasks = await self._run_cancellable(claim_work(context, num_tasks=num_tasks))
+            task_defns = (tasks or {}).get("tasks", [])
+        if task_defns:
+            context.idle_poll_count = 0
+        else:
+            context.idle_poll_count += 1
+        return task_defns
+
+    async def _run_task(self, context, task_defn, prefetch=False):
+        set_log_context(context)
+        # reclaim_task takes over from here
+        self._stop_prefetched_reclaim(task_defn)
+        prepare_to_run_task(context, task_defn)
+        reclaim_fut = context.event_loop.create_task(reclaim_task(context, context.task))
+        checkpoint_fut = context.event_loop.create_task(checkpoint_logs(context))
+        task_processes = []
+
+        async def to_cancellable_process(task_process):
+            task_processes.append(task_process)
+            return await self._to_cancellable_process(task_process)
+
+        async def stop_checkpoint():
+            # Make sure a checkpoint doesn't read or overwrite the logs
+            # while they're finalized and uploaded
+            checkpoint_fut.cancel()
+            await asyncio.wait([checkpoint_fut])
+
+        try:
+            try:
+                status = await do_run_task(context, self._run_cancellable, to_cancellable_process, stop_checkpoint=stop_checkpoint)
+                artifacts_paths = filepaths_in_dir(context.config["artifact_dir"])
+            except WorkerShutdownDuringTask:
+                shutdown_artifact_paths = [os.path.join("public", "logs", log_file) for log_file in ["chain_of_trust.log", "live_backing.log"]]
+                artifacts_paths = [path for path in shutdown_artifact_paths if os.path.isfile(os.path.join(context.config["artifact_dir"], path))]
+                status = STATUSES["worker-shutdown"]
+            finally:
+                # The task has exited, so there's nothing left to stop on shutdown
+                for task_process in task_processes:
+                    self.task_processes.remove(task_process)
+            # do_run_task doesn't get to stop the checkpoints if the task failed to run
+            await stop_checkpoint()
+            if prefetch:
+                self._prefetch_claim_work(context)
+            status = worst_level(status, await do_upload(context, artifacts_paths))
+            await complete_task(context, status)
+        finally:
+            # Don't leave these running if we hit an unexpected exception,
+            # e.g. while other slots are still running
+            checkpoint_fut.cancel()
+            reclaim_fut.cancel()
+        cleanup(context)
+        return status
+
+    def _prefetch_claim_work(self, context):
+        if context.config["prefetch_claim_work"] and not self.is_cancelled and not self.is_stopped_claiming:
+            log.debug("Prefetching the next claimWork")
+            self.prefetched_claim = asyncio.ensure_future(self._claim_prefetched_work(context))
+
+    async def _claim_prefetched_work(self, context):
+        tasks = await self._run_cancellable(claim_work(context))
+        # The current task may take a while to upload, so keep the claims
+        # alive until the tasks start running
+        for task_defn in (tasks or {}).get("tasks", []):
+            self.prefetched_reclaims.append((task_defn, asyncio.ensure_future(reclaim_claimed_task(context, task_defn))))
+        return tasks
+
+    def _stop_prefetched_reclaim(self, task_defn):
+        for item in self.prefetched_reclaims:
+            if item[0] is task_defn:
+                self.prefetched_reclaims.remove(item)
+                future = item[1]
+                if future.done() and not future.cancelled() and future.exception() is not None:
+                    log.warning("Failed to reclaim a prefetched task: {}".format(future.exception()))
+                future.cancel()
+                return
+
+    def stop_claiming(self):
+        """Stop claiming new tasks, but let the current tasks finish.
+
+        A prefetched ``claimWork`` call that's already in flight isn't
+        cancelled (see https://bugzilla.mozilla.org/show_bug.cgi?id=1524069);
+        we run any tasks it returns.
+
+        """
+        self.is_stopped_claiming = True
 
     async def _run_cancellable(self, coroutine: typing.Awaitable[Any]) -> Any:
-        self.future = asyncio.ensure_future(coroutine)
+        future = asyncio.ensure_future(coroutine)
+        self.futures.add(future)
         if self.is_cancelled:
-            self.future.cancel()
-        result = await self.future
-        self.future = None
-        return result
+            future.cancel()
+        try:
+            return await future
+        finally:
+            self.futures.discard(future)
 
     async def _to_cancellable_process(self, task_process: TaskProcess) -> TaskProcess:
-        self.task_process = task_process
+        self.task_processes.append(task_process)
 
         if self.is_cancelled:
             await task_process.worker_shutdown_stop()
@@ -169,11 +448,11 @@ class RunTasks:
     async def cancel(self):
         """Cancel current work."""
         self.is_cancelled = True
-        if self.future is not None:
-            self.future.cancel()
-        if self.task_process is not None:
+        for future in list(self.futures):
+            future.cancel()
+        if self.task_processes:
             log.warning("Worker is shutting down, but a task is running. Terminating task")
-            await self.task_process.worker_shutdown_stop()
+            await asyncio.gather(*[task_process.worker_shutdown_stop() for task_process in self.task_processes])
 
 
 # run_tasks {{{1
@@ -201,19 +480,64 @@ async def run_tasks(context):
     return status
 
 
+# create_session {{{1
+def create_session(context):
+    """Create the long-lived ``aiohttp.ClientSession`` for this worker.
+
+    The connection pool is tuned by ``aiohttp_connection_limit``,
+    ``aiohttp_dns_cache_ttl`` and ``aiohttp_keepalive_timeout``.  This needs
+    to be called from a coroutine.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    Returns:
+        aiohttp.ClientSession: the new session.
+
+    """
+    connector = aiohttp.TCPConnector(
+        limit=context.config["aiohttp_connection_limit"],
+        ttl_dns_cache=context.config["aiohttp_dns_cache_ttl"],
+        keepalive_timeout=context.config["aiohttp_keepalive_timeout"],
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
 # async_main {{{1
 async def async_main(context, credentials):
     """Set up and run tasks for this iteration.
 
+    The session and queue persist across iterations, so we keep our
+    connections alive between tasks.  We only create the session on the
+    first iteration, and only create a new queue if the session or
+    credentials changed.  The live log server, if enabled, also persists.
+    ``main`` closes them both on the way out.
+
     https://firefox-ci-tc.services.mozilla.com/docs/reference/platform/queue/worker-interaction
 
     Args:
         context (scriptworker.context.Context): the scriptworker context.
     """
-    async with aiohttp.ClientSession() as session:
-        context.session = session
+    new_session = context.session is None
+    if new_session:
+        context.session = create_session(context)
+    if new_session or context.queue is None or context.credentials != credentials:
         context.credentials = credentials
-        await run_tasks(context)
+    await start_livelog_server(context)
+    await run_tasks(context)
+
+
+# close_session {{{1
+async def close_session(context):
+    """Close ``context.session``, if any.
+
+    Args:
+        context (scriptworker.context.Context): the scriptworker context.
+
+    """
+    if context.session is not None:
+        await context.session.close()
+        context.session = None
 
 
 # main {{{1
@@ -229,6 +553,9 @@ def main(event_loop=None):
     log.info("Scriptworker starting up at {} UTC".format(arrow.utcnow().format()))
     log.info("Worker FQDN: {}".format(socket.getfqdn()))
     cleanup(context)
+    if context.config["verify_cot_signature"]:
+        # Parse the public keys once, and fail early on bad ones
+        load_ed25519_public_keys(context.config["ed25519_public_keys"])
     context.event_loop = event_loop or asyncio.get_event_loop()
 
     done = False
@@ -245,16 +572,21 @@ def main(event_loop=None):
         log.info("SIGUSR1 received; no more tasks will be taken")
         nonlocal done
         done = True
+        if context.running_tasks is not None:
+            context.running_tasks.stop_claiming()
 
     context.event_loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(_handle_sigterm()))
     context.event_loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(_handle_sigusr1()))
 
-    while not done:
-        try:
-            context.event_loop.run_until_complete(async_main(context, credentials))
-        except Exception:
-            log.critical("Fatal exception", exc_info=1)
-            raise
-    else:
-        log.info("Scriptworker stopped at {} UTC".format(arrow.utcnow().format()))
-        log.info("Worker FQDN: {}".format(socket.getfqdn()))
+    try:
+        while not done:
+            try:
+                context.event_loop.run_until_complete(async_main(context, credentials))
+            except Exception:
+                log.critical("Fatal exception", exc_info=1)
+                raise
+    finally:
+        context.event_loop.run_until_complete(stop_livelog_server(context))
+        context.event_loop.run_until_complete(close_session(context))
+    log.info("Scriptworker stopped at {} UTC".format(arrow.utcnow().format()))
+    log.info("Worker FQDN: {}".format(socket.getfqdn()))
@@ -82,6 +82,10 @@ class FakeResponse(aiohttp.client_reqrep.ClientResponse):
         if self.resp:
             return self.resp.pop(0)
 
+    async def iter_chunked(self, *args):
+        while self.resp:
+            yield self.resp.pop(0)
+
 
 def integration_create_task_payload(config, task_group_id, scopes=None, task_payload=None, task_extra=None):
     """For various integration tests, we need to call createTask for test tasks.
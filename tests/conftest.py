@@ -7,10 +7,10 @@ import aiohttp
 import pytest
 import taskcluster.exceptions
 
-from scriptworker.config import apply_product_config, get_unfrozen_copy
+from scriptworker.config import apply_product_config
 from scriptworker.constants import DEFAULT_CONFIG
 from scriptworker.context import Context
-from scriptworker.utils import makedirs
+from scriptworker.utils import get_unfrozen_copy, makedirs
 
 from . import VERBOSE, FakeResponse
 
@@ -174,6 +174,8 @@ def _craft_rw_context(tmp, event_loop, cot_product, session, private=False):
             makedirs(context.config[key])
         if key.endswith("key_path"):
             context.config[key] = os.path.join(tmp, key)
+    # Only use the artifact cache in tests that ask for it
+    context.config["artifact_cache_dir"] = ""
     if private:
         for rule in context.config["trusted_vcs_rules"]:
             rule["require_secret"] = True
@@ -1,9 +1,11 @@
 import asyncio
 import gzip
+import hashlib
 import itertools
 import json
 import os
 import tempfile
+import threading
 
 import arrow
 import mock
@@ -25,6 +27,7 @@ from scriptworker.artifacts import (
     upload_artifacts,
 )
 from scriptworker.exceptions import ScriptWorkerRetryException, ScriptWorkerTaskException
+from scriptworker.utils import makedirs
 
 from . import touch
 
@@ -84,6 +87,28 @@ async def test_upload_artifacts(context):
     assert create_artifact_paths == [os.path.join(context.config["artifact_dir"], "one"), os.path.join(context.config["artifact_dir"], "public/two")]
 
 
+@pytest.mark.asyncio
+async def test_upload_artifacts_largest_first(context):
+    context.config["max_concurrent_uploads"] = 1
+    create_artifact_paths = []
+    running = []
+
+    async def foo(_, path, **kwargs):
+        running.append(path)
+        assert len(running) == 1
+        create_artifact_paths.append(path)
+        await asyncio.sleep(0)
+        running.remove(path)
+
+    for name, size in (("small", 1), ("large", 100), ("medium", 10)):
+        with open(os.path.join(context.config["artifact_dir"], name), "wb") as fh:
+            fh.write(b"x" * size)
+    with mock.patch("scriptworker.artifacts.create_artifact", new=foo):
+        await upload_artifacts(context, ["small", "large", "medium"])
+
+    assert create_artifact_paths == [os.path.join(context.config["artifact_dir"], name) for name in ("large", "medium", "small")]
+
+
 @pytest.mark.asyncio
 async def test_upload_artifacts_throws(context, mocker):
     exceptions = [None, ArithmeticError]
@@ -128,6 +153,215 @@ def test_compress_artifact_if_supported(filename, original_content, expected_con
             assert f.read() == original_content
 
 
+@pytest.mark.parametrize("min_size, expected_encoding", ((0, "gzip"), (100, None)))
+def test_compress_artifact_if_supported_min_size(tmpdir, min_size, expected_encoding):
+    absolute_path = os.path.join(str(tmpdir), "foo.log")
+    with open(absolute_path, "w") as f:
+        f.write("foo\n" * 10)
+    assert compress_artifact_if_supported(absolute_path, compresslevel=1, min_size=min_size) == ("text/plain", expected_encoding)
+    assert os.listdir(str(tmpdir)) == ["foo.log"]
+    open_function = gzip.open if expected_encoding == "gzip" else open
+    with open_function(absolute_path, "rt") as f:
+        assert f.read() == "foo\n" * 10
+
+
+@pytest.mark.asyncio
+async def test_finalize_artifacts(context, mocker):
+    contents = {"public/foo.log": b"foo\n" * 10, "public/bar.bin": b"bar"}
+    for target_path, data in contents.items():
+        path = os.path.join(context.config["artifact_dir"], target_path)
+        makedirs(os.path.dirname(path))
+        with open(path, "wb") as fh:
+            fh.write(data)
+    await swartifacts.finalize_artifacts(context)
+    for target_path, data in contents.items():
+        entry = swartifacts.get_artifact_manifest_entry(context, target_path)
+        assert entry["hashes"] == {"sha256": hashlib.sha256(data).hexdigest()}
+    assert context.artifact_manifest["public/foo.log"]["content_encoding"] == "gzip"
+    assert context.artifact_manifest["public/bar.bin"]["content_encoding"] is None
+    with gzip.open(os.path.join(context.config["artifact_dir"], "public/foo.log"), "rb") as fh:
+        assert fh.read() == contents["public/foo.log"]
+
+    # upload_artifacts doesn't compress finalized artifacts again
+    uploads = []
+
+    async def fake_create_artifact(_, path, **kwargs):
+        uploads.append((path, kwargs["content_encoding"]))
+
+    def die(*args, **kwargs):
+        raise AssertionError("compressed twice")
+
+    mocker.patch.object(swartifacts, "compress_artifact_if_supported", new=die)
+    mocker.patch.object(swartifacts, "create_artifact", new=fake_create_artifact)
+    await upload_artifacts(context, sorted(contents))
+    assert sorted(uploads) == [
+        (os.path.join(context.config["artifact_dir"], "public/bar.bin"), None),
+        (os.path.join(context.config["artifact_dir"], "public/foo.log"), "gzip"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_finalize_artifacts_concurrent(context, mocker):
+    """Artifacts are hashed in parallel in the default executor, not one after another."""
+    for target_path in ("one.bin", "two.bin"):
+        touch(os.path.join(context.config["artifact_dir"], target_path))
+    barrier = threading.Barrier(2, timeout=5)
+    real_finalize_artifact = swartifacts.finalize_artifact
+
+    def finalize_artifact(*args, **kwargs):
+        # Raises BrokenBarrierError if the other artifact isn't being hashed at the same time
+        barrier.wait()
+        return real_finalize_artifact(*args, **kwargs)
+
+    mocker.patch.object(swartifacts, "finalize_artifact", new=finalize_artifact)
+    await swartifacts.finalize_artifacts(context)
+    assert sorted(context.artifact_manifest) == ["one.bin", "two.bin"]
+
+
+def _write_task_artifact_manifest(context, contents, shas=None):
+    manifest = {}
+    for target_path, data in contents.items():
+        path = os.path.join(context.config["artifact_dir"], target_path)
+        makedirs(os.path.dirname(path))
+        with open(path, "wb") as fh:
+            fh.write(data)
+        stat = os.stat(path)
+        sha = (shas or {}).get(target_path, hashlib.sha256(data).hexdigest())
+        manifest[target_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha}
+    manifest["../outside.bin"] = {"size": 0, "mtime_ns": 0, "sha256": "bad"}
+    with open(os.path.join(context.config["work_dir"], swartifacts.TASK_ARTIFACT_MANIFEST), "w") as fh:
+        json.dump(manifest, fh)
+
+
+def test_load_task_artifact_manifest(context):
+    context.config["artifact_manifest_check"] = "stat"
+    assert swartifacts.load_task_artifact_manifest(context) == {}
+    _write_task_artifact_manifest(context, {"public/foo.bin": b"foo", "public/bar.bin": b"bar"})
+    with open(os.path.join(context.config["artifact_dir"], "public/bar.bin"), "ab") as fh:
+        fh.write(b"changed")
+    assert swartifacts.load_task_artifact_manifest(context) == {"public/foo.bin": hashlib.sha256(b"foo").hexdigest()}
+
+
+def test_load_task_artifact_manifest_off(context):
+    """The manifest is ignored unless the worker opts in."""
+    assert context.config["artifact_manifest_check"] == "off"
+    _write_task_artifact_manifest(context, {"public/foo.bin": b"foo"})
+    assert swartifacts.load_task_artifact_manifest(context) == {}
+
+
+def test_load_task_artifact_manifest_bad_json(context):
+    context.config["artifact_manifest_check"] = "stat"
+    with open(os.path.join(context.config["work_dir"], swartifacts.TASK_ARTIFACT_MANIFEST), "w") as fh:
+        fh.write("{")
+    assert swartifacts.load_task_artifact_manifest(context) == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "mode, lie, expected_sha",
+    (
+        ("stat", False, "registered"),
+        ("stat", True, "registered"),
+        ("sample", False, "registered"),
+        ("sample", True, "real"),
+        ("off", False, "real"),
+        ("off", True, "real"),
+    ),
+)
+async def test_finalize_artifacts_task_manifest(context, mocker, mode, lie, expected_sha):
+    context.config["artifact_manifest_check"] = mode
+    context.config["artifact_manifest_sample_size"] = 10
+    real_sha = hashlib.sha256(b"foo").hexdigest()
+    registered_sha = "liar" if lie else real_sha
+    _write_task_artifact_manifest(context, {"public/foo.bin": b"foo"}, shas={"public/foo.bin": registered_sha})
+    await swartifacts.finalize_artifacts(context)
+    sha = context.artifact_manifest["public/foo.bin"]["hashes"]["sha256"]
+    assert sha == {"registered": registered_sha, "real": real_sha}[expected_sha]
+
+
+def test_get_artifact_manifest_entry_changed(context):
+    path = os.path.join(context.config["artifact_dir"], "foo.bin")
+    with open(path, "wb") as fh:
+        fh.write(b"foo")
+    context.artifact_manifest = {"foo.bin": swartifacts.finalize_artifact(path, ["sha256"])}
+    assert swartifacts.get_artifact_manifest_entry(context, "foo.bin") is not None
+    with open(path, "ab") as fh:
+        fh.write(b"bar")
+    assert swartifacts.get_artifact_manifest_entry(context, "foo.bin") is None
+    assert swartifacts.get_artifact_manifest_entry(context, "missing.bin") is None
+
+
+# checkpoint_logs {{{1
+def _write_log(context, contents, name="live_backing.log"):
+    context.config["task_log_dir"] = os.path.join(context.config["artifact_dir"], "public", "logs")
+    makedirs(context.config["task_log_dir"])
+    with open(os.path.join(context.config["task_log_dir"], name), "ab") as fh:
+        fh.write(contents)
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_log(context, mocker):
+    uploads = []
+
+    async def fake_create_artifact(_, path, **kwargs):
+        with gzip.open(path, "rb") as fh:
+            uploads.append((fh.read(), kwargs))
+
+    mocker.patch.object(swartifacts, "create_artifact", new=fake_create_artifact)
+    _write_log(context, b"foo\n")
+    size = await swartifacts.checkpoint_log(context, "public/logs/live_backing.log")
+    assert size > 0
+    assert uploads == [
+        (b"foo\n", {"target_path": "public/logs/live_backing.log", "content_type": "text/plain", "content_encoding": "gzip", "storage_type": "s3"})
+    ]
+    assert context.log_checkpoints == {"public/logs/live_backing.log"}
+    assert not os.path.exists(os.path.join(context.config["work_dir"], "log_checkpoint"))
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_log_failure(context, mocker):
+    async def fail(*args, **kwargs):
+        raise ScriptWorkerRetryException("bad status")
+
+    mocker.patch.object(swartifacts, "retry_create_artifact", new=fail)
+    _write_log(context, b"foo\n")
+    assert await swartifacts.checkpoint_log(context, "public/logs/live_backing.log") == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("interval, size", ((0.001, 0), (0, 3)))
+async def test_checkpoint_logs(context, mocker, interval, size):
+    checkpoints = []
+
+    async def fake_checkpoint_log(_, target_path):
+        checkpoints.append(target_path)
+        return 4
+
+    context.config["log_checkpoint_interval"] = interval
+    context.config["log_checkpoint_size"] = size
+    context.config["log_checkpoint_max_rate"] = 4000
+    mocker.patch.object(swartifacts, "LOG_CHECKPOINT_POLL_INTERVAL", new=0.001)
+    mocker.patch.object(swartifacts, "checkpoint_log", new=fake_checkpoint_log)
+    _write_log(context, b"foo\n")
+    future = asyncio.ensure_future(swartifacts.checkpoint_logs(context))
+    while not checkpoints:
+        await asyncio.sleep(0.001)
+    # Unchanged logs aren't uploaded again
+    await asyncio.sleep(0.01)
+    assert checkpoints == ["public/logs/live_backing.log"]
+    _write_log(context, b"bar\n")
+    while len(checkpoints) < 2:
+        await asyncio.sleep(0.001)
+    future.cancel()
+    await asyncio.wait([future])
+    assert checkpoints == ["public/logs/live_backing.log"] * 2
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_logs_disabled(context):
+    await asyncio.wait_for(swartifacts.checkpoint_logs(context), timeout=1)
+
+
 def _get_number_of_children_in_directory(directory):
     return len([name for name in os.listdir(directory)])
 
@@ -37,38 +37,6 @@ def t_env():
     return env
 
 
-# get_frozen_copy {{{1
-@pytest.mark.parametrize(
-    "input_dict,expected_dict",
-    (
-        ({1: 2}, immutabledict({1: 2})),
-        ({"a": [1.0, 2.5]}, immutabledict({"a": (1.0, 2.5)})),
-        (immutabledict({1: {"a": True}}), immutabledict({1: immutabledict({"a": True})})),
-        ({1: [{"a": None}, ["A", "B", "C"]]}, immutabledict({1: (immutabledict({"a": None}), ("A", "B", "C"))})),
-        ({1: [1, [2, 3], {}]}, immutabledict({1: (1, (2, 3), immutabledict({}))})),
-        ([1, []], (1, ())),
-    ),
-)
-def test_get_frozen_copy(input_dict, expected_dict):
-    assert config.get_frozen_copy(input_dict) == expected_dict
-
-
-# get_unfrozen_copy {{{1
-@pytest.mark.parametrize(
-    "input_dict,expected_dict",
-    (
-        ({1: 2}, {1: 2}),
-        ({"a": (1.0, 2.5)}, {"a": [1.0, 2.5]}),
-        (immutabledict({1: immutabledict({"a": True})}), {1: {"a": True}}),
-        ({1: (immutabledict({"a": None}), ("A", "B", "C"))}, {1: [{"a": None}, ["A", "B", "C"]]}),
-        ({1: (1, [2, 3], immutabledict({}))}, {1: [1, [2, 3], {}]}),
-        ((1, ()), [1, []]),
-    ),
-)
-def test_get_unfrozen_copy(input_dict, expected_dict):
-    assert config.get_unfrozen_copy(input_dict) == expected_dict
-
-
 # check_config {{{1
 def test_check_config_invalid_key(t_config):
     t_config["invalid_key_for_testing"] = 1
@@ -111,6 +79,12 @@ def test_check_config_invalid_ids(params, t_config):
     assert '{} doesn\'t match "^[a-zA-Z0-9-_]{{1,38}}$" (required by Taskcluster)'.format(params) in messages
 
 
+def test_check_config_invalid_artifact_manifest_check(t_config):
+    t_config["artifact_manifest_check"] = "full"
+    messages = config.check_config(t_config, "test_path")
+    assert "artifact_manifest_check: full isn't one of" in "\n".join(messages)
+
+
 def test_check_config_good(t_config):
     t_config = _fill_missing_values(t_config)
     messages = config.check_config(t_config, "test_path")
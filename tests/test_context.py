@@ -10,6 +10,7 @@ from copy import deepcopy
 import mock
 import pytest
 import taskcluster
+from immutabledict import immutabledict
 
 import scriptworker.context as swcontext
 from scriptworker.exceptions import CoTError
@@ -116,6 +117,25 @@ def test_get_credentials(rw_context):
     assert rw_context.credentials == expected
 
 
+def test_frozen_credentials_and_projects(rw_context):
+    credentials = {"clientId": "id", "accessToken": "token"}
+    rw_context.credentials = credentials
+    rw_context.temp_credentials = credentials
+    projects = {"mozilla-central": {"repo": "https://hg.mozilla.org/mozilla-central", "features": ["a"]}, "no-repo": {}}
+    rw_context.projects = projects
+    credentials["clientId"] = "changed"
+    projects["mozilla-central"]["features"].append("b")
+    for value in (rw_context.credentials, rw_context.temp_credentials):
+        assert value == {"clientId": "id", "accessToken": "token"}
+        assert isinstance(value, immutabledict)
+    assert rw_context.credentials is rw_context.credentials
+    assert rw_context.projects is rw_context.projects
+    assert rw_context.projects["mozilla-central"]["features"] == ("a",)
+    with pytest.raises(TypeError):
+        rw_context.projects["mozilla-central"]["repo"] = "https://example.com"
+    assert rw_context.projects_by_repo == {"https://hg.mozilla.org/mozilla-central": "mozilla-central"}
+
+
 def test_new_event_loop(mocker):
     """The default rw_context.event_loop is from `asyncio.get_event_loop`"""
     fake_loop = mock.MagicMock()
@@ -158,3 +178,40 @@ async def test_download_semaphore():
     assert type(sem) == asyncio.BoundedSemaphore
     assert sem._value == swcontext.DEFAULT_MAX_CONCURRENT_DOWNLOADS
     assert sem is context.download_semaphore
+
+
+@pytest.mark.asyncio
+async def test_upload_semaphore():
+    context = swcontext.Context()
+    sem = context.upload_semaphore
+    assert type(sem) == asyncio.BoundedSemaphore
+    assert sem._value == swcontext.DEFAULT_MAX_CONCURRENT_UPLOADS
+    assert sem is context.upload_semaphore
+
+
+@pytest.mark.asyncio
+async def test_create_slot_context(rw_context, claim_task):
+    rw_context.credentials = {"worker_credentials": True}
+    rw_context.projects = {"projects": True}
+    rw_context.config["task_log_dir"] = os.path.join(rw_context.config["artifact_dir"], "public", "logs")
+    slot_context = rw_context.create_slot_context(2)
+    assert slot_context.config["work_dir"] == os.path.join(rw_context.config["work_dir"], "slot2")
+    assert slot_context.config["artifact_dir"] == os.path.join(rw_context.config["artifact_dir"], "slot2")
+    assert slot_context.config["task_log_dir"] == os.path.join(rw_context.config["artifact_dir"], "slot2", "public", "logs")
+    assert slot_context.session is rw_context.session
+    assert slot_context.queue is rw_context.queue
+    assert slot_context.credentials == rw_context.credentials
+    assert slot_context.projects == rw_context.projects
+    assert slot_context.projects_by_repo is rw_context.projects_by_repo
+    assert slot_context.download_semaphore is rw_context.download_semaphore
+    assert slot_context.upload_semaphore is rw_context.upload_semaphore
+    slot_context.claim_task = claim_task
+    assert rw_context.claim_task is None
+    assert get_json(get_task_file(slot_context)) == claim_task["task"]
+    assert not os.path.exists(get_task_file(rw_context))
+
+
+def test_create_slot_context_task_log_dir(rw_context):
+    rw_context.config["task_log_dir"] = os.path.join(rw_context.config["work_dir"], "logs")
+    slot_context = rw_context.create_slot_context(0)
+    assert slot_context.config["task_log_dir"] == os.path.join(rw_context.config["work_dir"], "logs", "slot0")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Test scriptworker.cot.cache
+"""
+import os
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+import scriptworker.cot.cache as cache
+from scriptworker.context import Context
+from scriptworker.exceptions import CoTError
+from scriptworker.utils import get_hash
+
+
+# constants helpers and fixtures {{{1
+@pytest.fixture(scope="function")
+def context(rw_context, tmpdir):
+    rw_context.config["artifact_cache_dir"] = os.path.join(str(tmpdir), "cache")
+    yield rw_context
+
+
+def write_artifact(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fh:
+        fh.write(contents)
+    return path
+
+
+# get_cache_path {{{1
+def test_get_cache_path(context):
+    cache_dir = context.config["artifact_cache_dir"]
+    assert cache.get_cache_path(context, "task_id") == os.path.join(cache_dir, "tasks", "task_id.json")
+    assert cache.get_cache_path(context, "task_id", "public/foo.json") == os.path.join(cache_dir, "artifacts", "task_id", "public", "foo.json")
+    assert cache.get_cache_path(context, "task_id", "../other_task_id/public/foo.json") is None
+
+
+def test_get_cache_path_disabled(rw_context):
+    assert cache.get_cache_path(rw_context, "task_id") is None
+    assert cache.get_cache_path(rw_context, "task_id", "public/foo.json") is None
+
+
+# task definitions {{{1
+def test_task_definition(context):
+    assert cache.get_cached_task_definition(context, "task_id") is None
+    cache.cache_task_definition(context, "task_id", {"payload": {"foo": "bar"}})
+    assert cache.get_cached_task_definition(context, "task_id") == {"payload": {"foo": "bar"}}
+
+
+def test_task_definition_disabled(rw_context):
+    cache.cache_task_definition(rw_context, "task_id", {"payload": {}})
+    assert cache.get_cached_task_definition(rw_context, "task_id") is None
+
+
+@pytest.mark.parametrize(
+    "signed_task, expected, raises", (({"payload": {"foo": "bar"}}, True, False), ({"payload": {"foo": "baz"}}, None, True), (None, False, False))
+)
+def test_verify_cached_task_definition(context, signed_task, expected, raises):
+    cache.cache_task_definition(context, "task_id", {"payload": {"foo": "bar"}})
+    link = MagicMock()
+    link.task_id = "task_id"
+    link.task = cache.get_cached_task_definition(context, "task_id")
+    link.cot = {"taskId": "task_id"} if signed_task is None else {"taskId": "task_id", "task": signed_task}
+    if raises:
+        with pytest.raises(CoTError, match="cached task definition"):
+            cache.verify_cached_task_definition(context, link)
+        assert cache.get_cached_task_definition(context, "task_id") is None
+    else:
+        assert cache.verify_cached_task_definition(context, link) is expected
+        assert cache.get_cached_task_definition(context, "task_id") == link.task
+
+
+# artifacts {{{1
+@pytest.mark.asyncio
+async def test_restore_cached_artifact(context):
+    src = write_artifact(os.path.join(context.config["work_dir"], "src", "public", "foo.json"), "foo")
+    dest = os.path.join(context.config["work_dir"], "dest", "public", "foo.json")
+    expected_shas = {"sha256": get_hash(src)}
+    assert not await cache.restore_cached_artifact(context, "task_id", "public/foo.json", dest, expected_shas)
+    await cache.cache_artifact(context, "task_id", "public/foo.json", src)
+    assert await cache.restore_cached_artifact(context, "task_id", "public/foo.json", dest, expected_shas)
+    with open(dest) as fh:
+        assert fh.read() == "foo"
+    # Copied in and out of the cache, so a task modifying its copies can't change the cached one
+    cache_path = cache.get_cache_path(context, "task_id", "public/foo.json")
+    assert not os.path.samefile(src, cache_path)
+    assert not os.path.samefile(dest, cache_path)
+    write_artifact(src, "bar")
+    write_artifact(dest, "bar")
+    assert get_hash(cache_path) == expected_shas["sha256"]
+
+
+@pytest.mark.asyncio
+async def test_remove_cached_artifact(context):
+    src = write_artifact(os.path.join(context.config["work_dir"], "public", "foo.json"), "foo")
+    await cache.cache_artifact(context, "task_id", "public/foo.json", src)
+    cache.remove_cached_artifact(context, "task_id", "public/foo.json")
+    assert not os.path.exists(cache.get_cache_path(context, "task_id", "public/foo.json"))
+    # Missing entries are fine
+    cache.remove_cached_artifact(context, "task_id", "public/foo.json")
+
+
+@pytest.mark.asyncio
+async def test_restore_cached_artifact_bad_sha(context):
+    src = write_artifact(os.path.join(context.config["work_dir"], "public", "foo.json"), "foo")
+    dest = os.path.join(context.config["work_dir"], "dest", "public", "foo.json")
+    await cache.cache_artifact(context, "task_id", "public/foo.json", src)
+    assert not await cache.restore_cached_artifact(context, "task_id", "public/foo.json", dest, {"sha256": "bad_sha"})
+    assert not os.path.exists(dest)
+    assert not os.path.exists(cache.get_cache_path(context, "task_id", "public/foo.json"))
+
+
+@pytest.mark.asyncio
+async def test_cache_artifact_too_large(context):
+    context.config["artifact_cache_max_size"] = 2
+    src = write_artifact(os.path.join(context.config["work_dir"], "public", "foo.json"), "foo")
+    await cache.cache_artifact(context, "task_id", "public/foo.json", src)
+    assert not os.path.exists(cache.get_cache_path(context, "task_id", "public/foo.json"))
+
+
+# prune_cache {{{1
+@pytest.mark.asyncio
+async def test_prune_cache(context, mocker):
+    context.config["artifact_cache_max_size"] = 10
+    src = write_artifact(os.path.join(context.config["work_dir"], "public", "foo.json"), "1234")
+    # Each artifact is its own copy, so they count separately
+    now = time.time()
+    for count, task_id in enumerate(("old", "used", "new")):
+        await cache.cache_artifact(context, task_id, "public/foo.json", src)
+        path = cache.get_cache_path(context, task_id, "public/foo.json")
+        os.utime(path, (now + count, now + count))
+    # "used" is now the most recently used, so "old" and "new" are older
+    os.utime(cache.get_cache_path(context, "used", "public/foo.json"), (now + 10, now + 10))
+    # Adding to the cache doesn't prune it
+    assert os.path.exists(cache.get_cache_path(context, "old", "public/foo.json"))
+    cache.prune_cache(context)
+    assert not os.path.exists(cache.get_cache_path(context, "old", "public/foo.json"))
+    assert os.path.exists(cache.get_cache_path(context, "new", "public/foo.json"))
+    assert os.path.exists(cache.get_cache_path(context, "used", "public/foo.json"))
+
+
+# verified links {{{1
+def _craft_verified_link(context, task_id, cot_contents="{}"):
+    link = MagicMock()
+    link.task_id = task_id
+    link.task = {"payload": {"env": {}}}
+    link.get_artifact_full_path = lambda path: write_artifact(os.path.join(context.config["work_dir"], "cot", task_id, path), cot_contents)
+    return link
+
+
+def test_verified_link(context):
+    context.config["cache_verified_links"] = True
+    decision_link = _craft_verified_link(context, "decision_task_id")
+    action_link = _craft_verified_link(context, "action_task_id")
+    key = cache.get_verified_link_key(context, action_link, decision_link)
+    assert not cache.is_link_verified(context, key)
+    cache.cache_verified_link(context, key)
+    assert cache.is_link_verified(context, key)
+    assert cache.get_verified_link_key(context, action_link, decision_link) == key
+    # A different cot, task definition or config gives a different key
+    other_link = _craft_verified_link(context, "action_task_id", cot_contents='{"foo": "bar"}')
+    assert cache.get_verified_link_key(context, other_link, decision_link) != key
+    action_link.task = {"payload": {"env": {"foo": "bar"}}}
+    assert cache.get_verified_link_key(context, action_link, decision_link) != key
+    action_link.task = {"payload": {"env": {}}}
+    assert cache.get_verified_link_key(context, action_link, decision_link, level="3") != key
+    context.projects = {"mozilla-central": {"access": "scm_level_3"}}
+    assert cache.get_verified_link_key(context, action_link, decision_link) != key
+    context.projects = None
+    context.config["cot_product"] = "thunderbird"
+    assert cache.get_verified_link_key(context, action_link, decision_link) != key
+
+
+def test_verified_link_expired(context):
+    context.config["cache_verified_links"] = True
+    decision_link = _craft_verified_link(context, "decision_task_id")
+    key = cache.get_verified_link_key(context, decision_link, decision_link)
+    cache.cache_verified_link(context, key)
+    assert cache.is_link_verified(context, key)
+    expired = time.time() - context.config["cache_verified_links_ttl"] - 1
+    context.verified_links[key] = expired
+    assert not cache.is_link_verified(context, key)
+    assert key not in context.verified_links
+    # Caching another link forgets expired ones too
+    context.verified_links[key] = expired
+    cache.cache_verified_link(context, "other_key")
+    assert list(context.verified_links) == ["other_key"]
+
+
+def test_verified_link_not_on_disk(context):
+    """Verified links are only kept in memory, so other processes can't forge them."""
+    context.config["cache_verified_links"] = True
+    decision_link = _craft_verified_link(context, "decision_task_id")
+    key = cache.get_verified_link_key(context, decision_link, decision_link)
+    cache.cache_verified_link(context, key)
+    assert not os.path.exists(os.path.join(context.config["artifact_cache_dir"], "verified"))
+    new_context = Context()
+    new_context.config = context.config
+    assert not cache.is_link_verified(new_context, key)
+    assert cache.is_link_verified(context.create_slot_context(1), key)
+
+
+def test_verified_link_disabled(context):
+    decision_link = _craft_verified_link(context, "decision_task_id")
+    assert cache.get_verified_link_key(context, decision_link, decision_link) is None
+    assert not cache.is_link_verified(context, None)
+    cache.cache_verified_link(context, None)
@@ -62,6 +62,15 @@ def artifacts():
 def test_get_cot_artifacts(artifacts, context):
     value = cot.get_cot_artifacts(context)
     assert value == artifacts
+    assert list(value) == sorted(artifacts)
+
+
+def test_get_cot_artifacts_manifest(artifacts, context, mocker):
+    filepath = sorted(artifacts)[0]
+    stat = os.stat(os.path.join(ARTIFACT_DIR, filepath))
+    context.artifact_manifest = {filepath: {"hashes": {"sha256": "manifest_sha"}, "stat": (stat.st_size, stat.st_mtime_ns)}}
+    artifacts[filepath] = {"sha256": "manifest_sha"}
+    assert cot.get_cot_artifacts(context) == artifacts
 
 
 def test_generate_cot_body(artifacts, context):
@@ -2,6 +2,8 @@
 # coding=utf-8
 """Test scriptworker.cot.verify
 """
+import asyncio
+import hashlib
 import json
 import logging
 import os
@@ -17,10 +19,11 @@ from immutabledict import immutabledict
 import scriptworker.context as swcontext
 import scriptworker.cot.verify as cotverify
 from scriptworker.artifacts import get_single_upstream_artifact_full_path
+from scriptworker.cot.cache import get_cache_path
 from scriptworker.exceptions import CoTError, DownloadError
-from scriptworker.utils import load_json_or_yaml, makedirs, read_from_file
+from scriptworker.utils import load_json_or_yaml, makedirs, read_from_file, rm
 
-from . import create_async, noop_async, noop_sync, touch
+from . import create_async, create_sync, noop_async, noop_sync, touch
 
 log = logging.getLogger(__name__)
 
@@ -704,7 +707,7 @@ async def test_build_task_dependencies(chain, mocker):
     chain.context.queue = MagicMock()
     chain.context.queue.task = fake_task
 
-    mocker.patch.object(cotverify, "find_sorted_task_dependencies", new=fake_find)
+    mocker.patch.object(cotverify, "_find_sorted_task_dependencies", new=fake_find)
     mocker.patch.object(cotverify, "retry_get_task_definition", new=fake_task_defn)
     with pytest.raises(CoTError):
         length = chain.context.config["max_chain_length"]
@@ -721,6 +724,53 @@ async def test_build_task_dependencies(chain, mocker):
         await cotverify.build_task_dependencies(chain, {}, "build", "task_id")
 
 
+@pytest.mark.asyncio
+async def test_build_task_dependencies_concurrent_fetch(chain, mocker):
+    def task_defn(payload=None, extra=None):
+        return {
+            "taskGroupId": "decision_task_id",
+            "provisionerId": "",
+            "schedulerId": "",
+            "workerType": "",
+            "scopes": [],
+            "payload": payload or {"image": "x"},
+            "metadata": {},
+            "extra": extra or {},
+        }
+
+    task_defns = {
+        "decision_task_id": task_defn(),
+        "build_task_id": task_defn(extra={"chainOfTrust": {"inputs": {"docker-image": "image_task_id"}}}),
+        "l10n_task_id": task_defn(payload={"image": "x", "upstreamArtifacts": [{"taskType": "build", "taskId": "build_task_id"}]}),
+        "image_task_id": task_defn(),
+    }
+    chain.task["extra"] = {}
+    chain.task["payload"]["upstreamArtifacts"] = [{"taskType": "l10n", "taskId": "l10n_task_id"}, {"taskType": "build", "taskId": "build_task_id"}]
+    fetched = []
+    in_flight = []
+    max_in_flight = 0
+
+    async def fake_task_defn(queue, task_id, **kwargs):
+        nonlocal max_in_flight
+        fetched.append(task_id)
+        in_flight.append(task_id)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        await asyncio.sleep(0)
+        in_flight.remove(task_id)
+        return deepcopy(task_defns[task_id])
+
+    mocker.patch.object(cotverify, "retry_get_task_definition", new=fake_task_defn)
+    await cotverify.build_task_dependencies(chain, chain.task, chain.name, chain.task_id)
+    assert [(link.name, link.task_id) for link in chain.links] == [
+        ("signing:parent", "decision_task_id"),
+        ("signing:build", "build_task_id"),
+        ("signing:build:docker-image", "image_task_id"),
+        ("signing:l10n", "l10n_task_id"),
+    ]
+    assert sorted(fetched) == sorted(task_defns.keys())
+    assert max_in_flight == 3
+
+
 # download_cot {{{1
 @pytest.mark.parametrize(
     "upstream_artifacts, raises, download_artifacts_mock, verify_sig",
@@ -762,6 +812,73 @@ async def test_download_cot(chain, mocker, upstream_artifacts, raises, download_
         await cotverify.download_cot(chain)
 
 
+@pytest.mark.asyncio
+async def test_download_cot_cached(chain, mocker, build_link, tmpdir):
+    """Signed chain of trust artifacts are cached once verified, and downloaded again if the cached ones don't verify."""
+    chain.context.config["artifact_cache_dir"] = os.path.join(str(tmpdir), "cache")
+    chain.context.config["verify_cot_signature"] = True
+    downloads = []
+
+    async def fake_download_artifacts(context, urls, parent_dir=None, **kwargs):
+        downloads.append(urls)
+        paths = []
+        for url in urls:
+            path = os.path.join(parent_dir, url)
+            makedirs(os.path.dirname(path))
+            with open(path, "w") as fh:
+                fh.write("good")
+            paths.append(path)
+        return paths
+
+    def fake_verify(chain, link, unsigned_path, signature_path):
+        for path in (unsigned_path, signature_path):
+            if read_from_file(path) != "good":
+                raise CoTError("bad signature")
+        link.cot = {"taskId": link.task_id}
+
+    async def download_and_verify():
+        link = cotverify.LinkOfTrust(chain.context, "build", build_link.task_id)
+        rm(os.path.normpath(link.cot_dir))
+        chain.links = [link]
+        chain.cached_cot_task_ids = set()
+        downloads.clear()
+        await cotverify.download_cot(chain)
+        await cotverify.verify_cot_signatures(chain)
+        assert link.cot == {"taskId": link.task_id}
+        return downloads
+
+    mocker.patch.object(cotverify, "get_artifact_url", new=lambda _x, _y, path: path)
+    mocker.patch.object(cotverify, "download_artifacts", new=fake_download_artifacts)
+    mocker.patch.object(cotverify, "verify_link_ed25519_cot_signature", new=fake_verify)
+    urls = [["public/chain-of-trust.json", "public/chain-of-trust.json.sig"]]
+    assert await download_and_verify() == urls
+    # Cached once verified
+    assert await download_and_verify() == []
+    # A tampered cache entry doesn't verify, so it's replaced
+    with open(get_cache_path(chain.context, build_link.task_id, "public/chain-of-trust.json"), "w") as fh:
+        fh.write("tampered")
+    assert await download_and_verify() == urls
+    assert await download_and_verify() == []
+
+
+@pytest.mark.asyncio
+async def test_download_cot_unsigned_not_cached(chain, mocker, build_link, tmpdir):
+    """Unsigned chain of trust artifacts can't be verified, so they're never cached."""
+    chain.context.config["artifact_cache_dir"] = os.path.join(str(tmpdir), "cache")
+    chain.context.config["verify_cot_signature"] = False
+    link = cotverify.LinkOfTrust(chain.context, "build", build_link.task_id)
+    chain.links = [link]
+    cache_path = get_cache_path(chain.context, link.task_id, "public/chain-of-trust.json")
+    makedirs(os.path.dirname(cache_path))
+    touch(cache_path)
+    mocker.patch.object(cotverify, "download_artifacts", new=create_async(["x"]))
+    mocker.patch.object(cotverify, "get_artifact_url", new=lambda _x, _y, path: path)
+    mocker.patch.object(cotverify, "get_hash", new=create_sync("sha"))
+    await cotverify.download_cot(chain)
+    assert chain.cached_cot_task_ids == set()
+    assert not os.path.exists(link.get_artifact_full_path("public/chain-of-trust.json"))
+
+
 # download_cot_artifact {{{1
 @pytest.mark.parametrize("path,sha,raises", (("one", "sha", False), ("one", "bad_sha", True), ("bad", "bad_sha", True), ("missing", "bad_sha", True)))
 @pytest.mark.asyncio
@@ -785,6 +902,51 @@ async def test_download_cot_artifact(chain, path, sha, raises, mocker):
         await cotverify.download_cot_artifact(chain, "task_id", path)
 
 
+@pytest.mark.asyncio
+async def test_download_cot_artifact_cache(chain, mocker, tmpdir):
+    chain.context.config["artifact_cache_dir"] = os.path.join(str(tmpdir), "cache")
+    contents = b"task graph"
+    downloads = []
+
+    async def fake_download(context, urls, parent_dir, **kwargs):
+        downloads.append(urls)
+        path = os.path.join(parent_dir, "public", "task-graph.json")
+        makedirs(os.path.dirname(path))
+        with open(path, "wb") as fh:
+            fh.write(contents)
+
+    link = cotverify.LinkOfTrust(chain.context, "decision", "task_id")
+    link.cot = {"taskId": "task_id", "artifacts": {"public/task-graph.json": {"sha256": hashlib.sha256(contents).hexdigest()}}}
+    chain.links = [link]
+    mocker.patch.object(cotverify, "get_artifact_url", new=noop_sync)
+    mocker.patch.object(cotverify, "download_artifacts", new=fake_download)
+    full_path = await cotverify.download_cot_artifact(chain, "task_id", "public/task-graph.json")
+    assert len(downloads) == 1
+    os.remove(full_path)
+    assert await cotverify.download_cot_artifact(chain, "task_id", "public/task-graph.json") == full_path
+    assert len(downloads) == 1
+    with open(full_path, "rb") as fh:
+        assert fh.read() == contents
+
+
+@pytest.mark.asyncio
+async def test_download_cot_artifact_streaming_hash(chain, mocker):
+    async def fake_download_artifacts(context, urls, parent_dir, download_func, **kwargs):
+        await download_func(context, urls[0], os.path.join(parent_dir, "foo"))
+
+    async def fake_download_file(*args, hash_algs=None, **kwargs):
+        return {alg: "streamed_sha" for alg in hash_algs}
+
+    link = cotverify.LinkOfTrust(chain.context, "build", "task_id")
+    link.cot = {"taskId": "task_id", "artifacts": {"foo": {"sha256": "streamed_sha"}}}
+    chain.links = [link]
+    mocker.patch.object(cotverify, "get_artifact_url", new=noop_sync)
+    mocker.patch.object(cotverify, "download_artifacts", new=fake_download_artifacts)
+    mocker.patch.object(cotverify, "download_file", new=fake_download_file)
+    mocker.patch.object(cotverify, "get_hash", new=die_sync)
+    assert await cotverify.download_cot_artifact(chain, "task_id", "foo") == link.get_artifact_full_path("foo")
+
+
 @pytest.mark.asyncio
 async def test_download_cot_artifact_no_downloaded_cot(chain, mocker):
     link = MagicMock()
@@ -931,15 +1093,89 @@ def test_verify_link_ed25519_cot_signature(chain, build_link, mocker, unsigned_p
 
 
 # verify_cot_signatures {{{1
+@pytest.mark.asyncio
 @pytest.mark.parametrize("ed25519_mock, raises", ((noop_sync, False), (die_sync, True)))
-def test_verify_link_cot_signature_bad_sig(chain, mocker, build_link, ed25519_mock, raises):
+async def test_verify_link_cot_signature_bad_sig(chain, mocker, build_link, ed25519_mock, raises):
     mocker.patch.object(cotverify, "verify_link_ed25519_cot_signature", new=ed25519_mock)
     chain.links = [build_link]
     if raises:
         with pytest.raises(CoTError):
-            cotverify.verify_cot_signatures(chain)
+            await cotverify.verify_cot_signatures(chain)
+    else:
+        await cotverify.verify_cot_signatures(chain)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached, raises", ((False, False), (True, True)))
+async def test_verify_cot_signatures_cached_task_definition(chain, mocker, build_link, cached, raises):
+    def fake_verify(chain, link, unsigned_path, signature_path):
+        link.cot = {"taskId": link.task_id, "task": {"payload": {"tampered": True}}}
+
+    mocker.patch.object(cotverify, "verify_link_ed25519_cot_signature", new=fake_verify)
+    link = cotverify.LinkOfTrust(chain.context, "build", build_link.task_id)
+    link.task = build_link.task
+    chain.links = [link]
+    if cached:
+        chain.cached_task_ids.add(link.task_id)
+    if raises:
+        with pytest.raises(CoTError, match="cached task definition"):
+            await cotverify.verify_cot_signatures(chain)
+    else:
+        await cotverify.verify_cot_signatures(chain)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tampered", (False, True))
+async def test_verify_cot_signatures_refetch_task_definition(chain, mocker, build_link, tampered):
+    """Cached task definitions are fetched again if the chain of trust artifact doesn't contain one."""
+
+    def fake_verify(chain, link, unsigned_path, signature_path):
+        link.cot = {"taskId": link.task_id}
+
+    fetched = []
+
+    async def fake_get_task_definition(queue, task_id, **kwargs):
+        fetched.append(task_id)
+        task_defn = deepcopy(build_link.task)
+        if tampered:
+            task_defn["payload"]["tampered"] = True
+        return task_defn
+
+    mocker.patch.object(cotverify, "verify_link_ed25519_cot_signature", new=fake_verify)
+    mocker.patch.object(cotverify, "retry_get_task_definition", new=fake_get_task_definition)
+    cached = cotverify.LinkOfTrust(chain.context, "build", build_link.task_id)
+    cached.task = deepcopy(build_link.task)
+    not_cached = cotverify.LinkOfTrust(chain.context, "build", "not_cached_task_id")
+    not_cached.task = deepcopy(build_link.task)
+    chain.links = [cached, not_cached]
+    chain.cached_task_ids.add(cached.task_id)
+    if tampered:
+        with pytest.raises(CoTError, match="doesn't match the queue"):
+            await cotverify.verify_cot_signatures(chain)
     else:
-        cotverify.verify_cot_signatures(chain)
+        await cotverify.verify_cot_signatures(chain)
+    assert fetched == [cached.task_id]
+    assert cached.task_id not in chain.cached_task_ids
+
+
+@pytest.mark.asyncio
+async def test_verify_cot_signatures_concurrently(chain, mocker, build_link, decision_link):
+    verified = []
+
+    def fake_verify(chain, link, unsigned_path, signature_path):
+        verified.append((link.task_id, unsigned_path, signature_path))
+
+    mocker.patch.object(cotverify, "verify_link_ed25519_cot_signature", new=fake_verify)
+    chain.links = [build_link, decision_link]
+    await cotverify.verify_cot_signatures(chain)
+    assert sorted(verified) == sorted(
+        (
+            link.task_id,
+            link.get_artifact_full_path("public/chain-of-trust.json"),
+            link.get_artifact_full_path("public/chain-of-trust.json.sig"),
+        )
+        for link in chain.links
+    )
 
 
 # _take_expires_out_from_artifacts_in_payload {{{1
@@ -1723,6 +1959,55 @@ async def test_verify_parent_task_definition_failed_tasks_for(chain, mocker):
         await cotverify.verify_parent_task_definition(chain, link)
 
 
+# compare_jsone_task_definition {{{1
+@pytest.mark.parametrize(
+    "first,second",
+    (
+        ({"a": 1, "b": None}, {"a": 1}),
+        ({"a": 1, "b": {}}, {"a": 1, "c": [], "d": "null"}),
+        ({"a": 1}, {"a": 2}),
+        ({"a": 1}, {"a": 1, "b": ""}),
+        ({"a": 1, "b": 0}, {"a": 1}),
+        ({"a": {"b": None}}, {"a": {}}),
+        ({"a": {"b": None}}, {}),
+        ({"a": [{}, 1, None, [2, []]]}, {"a": [1, [2]]}),
+        ({"a": [1, 2]}, {"a": [2, 1]}),
+        ({"a": [1]}, {"a": {"0": 1}}),
+        ({"a": "1"}, {"a": 1}),
+        ({"a": [1]}, {"a": 1}),
+        ({"a": 1}, {"a": [1]}),
+        ([{"a": None}, None], [{}]),
+        ("null", "null"),
+    ),
+)
+def test_definitions_match(first, second):
+    expected = cotverify.remove_empty_keys(first) == cotverify.remove_empty_keys(second)
+    assert cotverify._definitions_match(first, second) is expected
+    assert cotverify._definitions_match(second, first) is expected
+
+
+@pytest.mark.parametrize(
+    "tasks,raises",
+    (
+        ([{"taskId": "x", "a": 1, "b": None}], False),
+        ([{"a": 2}, {"a": 1, "b": []}], False),
+        ([{"a": 2}, {"a": 3}], True),
+        ([{"a": 1.0000000000000002}], False),
+    ),
+)
+def test_compare_jsone_task_definition(tasks, raises):
+    link = MagicMock()
+    link.name = "decision"
+    link.task_id = "task_id"
+    link.task = {"a": 1, "c": {}}
+    if raises:
+        with pytest.raises(CoTError, match="match any rebuilt definition"):
+            cotverify.compare_jsone_task_definition(link, {"tasks": tasks})
+    else:
+        cotverify.compare_jsone_task_definition(link, {"tasks": tasks})
+    assert all("taskId" not in task for task in tasks)
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "push_comment,task_comment,raises",
@@ -1834,6 +2119,45 @@ async def test_verify_parent_task(chain, action_link, cron_link, decision_link,
             chain.task = orig_chain_task
 
 
+@pytest.mark.asyncio
+async def test_verify_parent_task_verified_link_cache(chain, build_link, mocker, tmpdir):
+    chain.context.config["artifact_cache_dir"] = os.path.join(str(tmpdir), "cache")
+    chain.context.config["cache_verified_links"] = True
+    calls = []
+
+    async def fake_verify(*args):
+        calls.append(args)
+
+    def task_graph(*args, **kwargs):
+        return {build_link.task_id: {"task": deepcopy(build_link.task)}, chain.task_id: {"task": deepcopy(chain.task)}}
+
+    def new_decision_link():
+        # Each task builds its own links
+        link = _craft_decision_link(chain, tasks_for="hg-push")
+        link.task["provisionerId"], link.task["workerType"] = chain.context.config["valid_decision_worker_pools"][0].split("/")
+        for path in ("public/task-graph.json", "public/chain-of-trust.json"):
+            makedirs(os.path.dirname(link.get_artifact_full_path(path)))
+            touch(link.get_artifact_full_path(path))
+        chain.links = [link, build_link]
+        return link
+
+    levels = ["3", "3", "1"]
+
+    async def get_scm_level(*args):
+        return levels.pop(0)
+
+    mocker.patch.object(cotverify, "load_json_or_yaml", new=task_graph)
+    mocker.patch.object(cotverify, "verify_parent_task_definition", new=fake_verify)
+    mocker.patch.object(cotverify, "get_project", new=create_async("mozilla-central"))
+    mocker.patch.object(cotverify, "get_scm_level", new=get_scm_level)
+    await cotverify.verify_parent_task(chain, new_decision_link())
+    await cotverify.verify_parent_task(chain, new_decision_link())
+    assert len(calls) == 1
+    # A different scm level is a different key
+    await cotverify.verify_parent_task(chain, new_decision_link())
+    assert len(calls) == 2
+
+
 @pytest.mark.asyncio
 async def test_verify_parent_task_worker_type(chain, decision_link, build_link, mocker):
     def task_graph(*args, **kwargs):
@@ -1924,6 +2248,52 @@ async def test_verify_task_types(chain, decision_link, build_link, docker_image_
     assert expected == await cotverify.verify_task_types(chain)
 
 
+# verify_links {{{1
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_concurrent", (1, 2, 10))
+async def test_verify_links(chain, decision_link, build_link, docker_image_link, max_concurrent):
+    chain.links = [decision_link, build_link, docker_image_link]
+    chain.context.config["max_concurrent_link_verifications"] = max_concurrent
+    links = chain.get_all_links_in_chain()
+    running = []
+    max_running = []
+    messages = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            messages.append(record.getMessage())
+
+    async def verify_link(link):
+        running.append(link)
+        max_running.append(len(running))
+        cotverify.log.info("start {}".format(link.name))
+        # Later links finish first
+        await asyncio.sleep(0.001 * (len(links) - links.index(link)))
+        cotverify.log.info("end {}".format(link.name))
+        running.remove(link)
+        if link in (build_link, docker_image_link):
+            raise CoTError(link.name)
+
+    handler = ListHandler()
+    scriptworker_log = logging.getLogger("scriptworker")
+    level = scriptworker_log.level
+    scriptworker_log.setLevel(logging.INFO)
+    scriptworker_log.addHandler(handler)
+    try:
+        with pytest.raises(CoTError) as excinfo:
+            await cotverify.verify_links(chain, verify_link)
+    finally:
+        scriptworker_log.removeHandler(handler)
+        scriptworker_log.setLevel(level)
+    assert excinfo.value.args[0] == build_link.name
+    assert max(max_running) == min(max_concurrent, len(links))
+    expected = []
+    # One at a time, verify_links stops at the first failure
+    for link in links if max_concurrent > 1 else links[: links.index(build_link) + 1]:
+        expected.extend(["start {}".format(link.name), "end {}".format(link.name)])
+    assert messages == expected
+
+
 # verify_docker_worker_task {{{1
 @pytest.mark.asyncio
 async def test_verify_docker_worker_task(mocker):
@@ -2092,7 +2462,7 @@ async def test_verify_chain_of_trust(chain, exc, check_task, mocker):
 
     for func in ("build_task_dependencies", "build_link", "download_cot", "download_cot_artifacts", "verify_task_types", "verify_worker_impls"):
         mocker.patch.object(cotverify, func, new=noop_async)
-    mocker.patch.object(cotverify, "verify_cot_signatures", new=noop_sync)
+    mocker.patch.object(cotverify, "verify_cot_signatures", new=noop_async)
     mocker.patch.object(cotverify, "trace_back_to_tree", new=maybe_die)
     if exc:
         with pytest.raises(CoTError):
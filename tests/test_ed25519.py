@@ -71,6 +71,23 @@ def test_bad_ed25519_public_key_from_string():
         swed25519.ed25519_public_key_from_string("bad_base64_string")
 
 
+def test_get_ed25519_public_key(mocker):
+    seed = read_from_file(os.path.join(ED25519_DIR, "scriptworker_public_key"))
+    with pytest.raises(ScriptWorkerEd25519Error):
+        swed25519.load_ed25519_public_keys({"test-parse-once": ["bad_base64_string"]})
+    swed25519.load_ed25519_public_keys({"test-parse-once": [seed]})
+    mocker.patch.object(swed25519, "ed25519_public_key_from_string", side_effect=AssertionError("parsed twice"))
+    pubkey = swed25519.get_ed25519_public_key("test-parse-once", seed)
+    assert swed25519.ed25519_public_key_to_string(pubkey) == seed
+
+
+def test_get_ed25519_verify_seeds():
+    assert swed25519.get_ed25519_verify_seeds("test-seed-order", ("one", "two", "three")) == ["one", "two", "three"]
+    swed25519.set_ed25519_verified_seed("test-seed-order", "two")
+    assert swed25519.get_ed25519_verify_seeds("test-seed-order", ("one", "two", "three")) == ["two", "one", "three"]
+    assert swed25519.get_ed25519_verify_seeds("test-seed-order", ("one", "three")) == ["one", "three"]
+
+
 @pytest.mark.parametrize(
     "pubkey_path, file_path, sig_path, exception",
     (
@@ -18,7 +18,7 @@ import scriptworker.artifacts as artifacts
 import scriptworker.log as swlog
 import scriptworker.utils as utils
 import scriptworker.worker as worker
-from scriptworker.config import CREDS_FILES, apply_product_config, get_unfrozen_copy, read_worker_creds
+from scriptworker.config import CREDS_FILES, apply_product_config, read_worker_creds
 from scriptworker.constants import DEFAULT_CONFIG
 from scriptworker.context import Context
 from scriptworker.exceptions import Download404
@@ -64,7 +64,7 @@ To skip integration tests, set the environment variable NO_CREDENTIALS_TESTS""".
 
 def build_config(override, basedir):
     randstring = slugid.nice().lower().replace("_", "").replace("-", "")[:6]
-    config = get_unfrozen_copy(DEFAULT_CONFIG)
+    config = utils.get_unfrozen_copy(DEFAULT_CONFIG)
     ED25519_DIR = os.path.join(os.path.dirname(__file__), "data", "ed25519")
     config.update(
         {
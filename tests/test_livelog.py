@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Test scriptworker.livelog
+"""
+import asyncio
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer, unused_port
+
+from scriptworker.livelog import LiveLogServer, TaskLiveLog, follow_file, start_livelog_server, stop_livelog_server
+
+
+# constants helpers and fixtures {{{1
+@pytest.fixture(scope="function")
+def context(rw_context):
+    rw_context.claim_task = {"credentials": {"a": "b"}, "status": {"taskId": "taskId"}, "task": {"payload": {}}, "runId": 0}
+    yield rw_context
+
+
+@pytest.fixture(scope="function")
+def log_path(tmpdir):
+    path = os.path.join(str(tmpdir), "live_backing.log")
+    open(path, "wb").close()
+    return path
+
+
+async def write_log(path, lines, livelog=None):
+    for line in lines:
+        with open(path, "ab") as fh:
+            fh.write(line)
+        await asyncio.sleep(0.01)
+    if livelog is not None:
+        await livelog.stop()
+
+
+# follow_file {{{1
+@pytest.mark.asyncio
+async def test_follow_file(log_path):
+    done = False
+    chunks = []
+
+    async def write():
+        nonlocal done
+        await write_log(log_path, (b"one\n", b"two\n", b"three\n"))
+        done = True
+
+    writer = asyncio.ensure_future(write())
+    async for chunk in follow_file(log_path, lambda: done, chunk_size=4, poll_interval=0.001):
+        chunks.append(chunk)
+    await writer
+    assert b"".join(chunks) == b"one\ntwo\nthree\n"
+    assert max(len(chunk) for chunk in chunks) <= 4
+
+
+# LiveLogServer {{{1
+@pytest.mark.asyncio
+async def test_livelog_server(context, log_path):
+    port = unused_port()
+    context.config["livelog_port"] = port
+    await start_livelog_server(context)
+    server = context.livelog_server
+    await start_livelog_server(context)
+    assert context.livelog_server is server
+    url = "http://127.0.0.1:{}/log/taskId".format(port)
+    livelog = TaskLiveLog(context, log_path)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                assert resp.status == 404
+            livelog.start()
+            async with session.get(url) as resp:
+                assert resp.status == 200
+                writer = asyncio.ensure_future(write_log(log_path, (b"one\n", b"two\n"), livelog=livelog))
+                assert resp.headers["Content-Type"] == "text/plain; charset=utf-8"
+                assert "Access-Control-Allow-Origin" not in resp.headers
+                assert await resp.read() == b"one\ntwo\n"
+            await writer
+            async with session.get(url) as resp:
+                assert resp.status == 404
+    finally:
+        await stop_livelog_server(context)
+    assert context.livelog_server is None
+
+
+@pytest.mark.asyncio
+async def test_livelog_server_allowed_origin(context, log_path):
+    port = unused_port()
+    context.config["livelog_port"] = port
+    context.config["livelog_allowed_origin"] = "https://tc.example.com"
+    await start_livelog_server(context)
+    livelog = TaskLiveLog(context, log_path)
+    livelog.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get("http://127.0.0.1:{}/log/taskId".format(port)) as resp:
+                await livelog.stop()
+                assert resp.headers["Access-Control-Allow-Origin"] == "https://tc.example.com"
+                assert await resp.read() == b""
+    finally:
+        await stop_livelog_server(context)
+
+
+@pytest.mark.asyncio
+async def test_start_livelog_server_disabled(context):
+    await start_livelog_server(context)
+    assert context.livelog_server is None
+    await stop_livelog_server(context)
+
+
+def test_livelog_server_remove():
+    server = LiveLogServer("127.0.0.1", 0)
+    server.add("taskId", "new")
+    server.remove("taskId", "old")
+    assert server.livelogs == {"taskId": "new"}
+    server.remove("taskId", "new")
+    assert server.livelogs == {}
+
+
+# TaskLiveLog {{{1
+@pytest.mark.asyncio
+async def test_task_livelog_put(context, log_path):
+    received = {}
+
+    async def put_log(request):
+        received[request.match_info["name"]] = await request.read()
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_put("/log/{name}", put_log)
+    server = TestServer(app)
+    await server.start_server()
+    context.config["livelog_put_url"] = str(server.make_url("/log/")) + "{task_id}-{run_id}"
+    livelog = TaskLiveLog(context, log_path)
+    livelog.start()
+    await write_log(log_path, (b"one\n", b"two\n"), livelog=livelog)
+    await server.close()
+    assert received == {"taskId-0": b"one\ntwo\n"}
+
+
+@pytest.mark.asyncio
+async def test_task_livelog_put_error(context, log_path):
+    context.config["livelog_put_url"] = "http://127.0.0.1:{}/log".format(unused_port())
+    livelog = TaskLiveLog(context, log_path)
+    livelog.start()
+    await livelog.stop()
+    assert livelog.put_future.done()
+    assert livelog.put_future.exception() is None
@@ -3,6 +3,7 @@
 """Test scriptworker.log
 """
 import asyncio
+import io
 import logging
 import os
 from asyncio.subprocess import PIPE
@@ -10,6 +11,7 @@ from asyncio.subprocess import PIPE
 import pytest
 
 import scriptworker.log as swlog
+from scriptworker.utils import run_in_executor
 
 from . import read
 
@@ -62,6 +64,44 @@ async def test_pipe_to_log(rw_context):
     assert read(log_file) in ("foo\nbar\n", "bar\nfoo\n")
 
 
+def _fed_stream(*chunks):
+    stream = asyncio.StreamReader()
+    for chunk in chunks:
+        stream.feed_data(chunk)
+    stream.feed_eof()
+    return stream
+
+
+@pytest.mark.asyncio
+async def test_pipe_to_log_chunks():
+    fh = io.StringIO()
+    # A line and a multi-byte character split across reads, and no trailing newline
+    stream = _fed_stream("foo\nba".encode("utf-8"), "r 💩".encode("utf-8")[:-1], "💩".encode("utf-8")[-1:] + b"\nbaz")
+    await swlog.pipe_to_log(stream, filehandles=[fh], chunk_size=3)
+    assert fh.getvalue() == "foo\nbar 💩\nbaz"
+
+
+@pytest.mark.asyncio
+async def test_pipe_to_log_long_lines():
+    fh = io.StringIO()
+    stream = _fed_stream(b"abcdefghij\n12")
+    await swlog.pipe_to_log(stream, filehandles=[fh], chunk_size=4, max_line_length=4)
+    assert fh.getvalue() == "abcd\nefgh\nij\n12"
+
+
+@pytest.mark.asyncio
+async def test_pipe_to_log_rate_limit(caplog):
+    fh = io.StringIO()
+    caplog.set_level(logging.INFO, logger="scriptworker.log")
+    stream = _fed_stream("".join("line {}\n".format(i) for i in range(10)).encode("utf-8"))
+    await swlog.pipe_to_log(stream, filehandles=[fh], max_log_lines_per_second=3)
+    assert fh.getvalue().count("\n") == 10
+    messages = [record.getMessage() for record in caplog.records if record.name == "scriptworker.log"]
+    assert messages[:3] == ["line 0", "line 1", "line 2"]
+    assert "line 9" not in messages
+    assert "(skipped logging 7 lines; see the task log)" in messages
+
+
 def test_update_logging_config_verbose(rw_context):
     rw_context.config["verbose"] = True
     swlog.update_logging_config(rw_context, log_name=rw_context.config["log_dir"])
@@ -103,6 +143,41 @@ def test_contextual_log_handler(rw_context, mocker):
     assert contents[0].endswith("foo")
 
 
+@pytest.mark.asyncio
+async def test_contextual_log_handler_concurrent_tasks(rw_context):
+    """Concurrent tasks only log to their own contextual log."""
+    rw_context.config["max_concurrent_tasks"] = 2
+    swlog.log.setLevel(logging.DEBUG)
+    both_logging = asyncio.Event()
+    slots_logging = []
+
+    def log_in_thread(slot):
+        swlog.log.info("{} thread".format(slot))
+
+    async def log_in_child(slot):
+        swlog.log.info("{} child".format(slot))
+
+    async def run_slot(slot):
+        slot_context = rw_context.create_slot_context(slot)
+        swlog.set_log_context(slot_context)
+        path = os.path.join(slot_context.config["artifact_dir"], "test.log")
+        with swlog.contextual_log_handler(slot_context, path=path):
+            slots_logging.append(slot)
+            if len(slots_logging) == 2:
+                both_logging.set()
+            await both_logging.wait()
+            swlog.log.info("{} task".format(slot))
+            await asyncio.ensure_future(log_in_child(slot))
+            await run_in_executor(log_in_thread, slot)
+            await asyncio.sleep(0)
+        with open(path) as fh:
+            return [line.split(" ")[-2:] for line in fh.read().splitlines()]
+
+    results = await asyncio.gather(run_slot(0), run_slot(1))
+    for slot, lines in enumerate(results):
+        assert lines == [[str(slot), "task"], [str(slot), "child"], [str(slot), "thread"]]
+
+
 def test_watched_log_file(rw_context):
     rw_context.config["watch_log_file"] = True
     rw_context.config["log_fmt"] = "%(levelname)s - %(message)s"
@@ -15,7 +15,7 @@ from taskcluster.aio import Index, Queue, Secrets
 
 import scriptworker.log as swlog
 import scriptworker.utils as utils
-from scriptworker.config import apply_product_config, get_unfrozen_copy, read_worker_creds
+from scriptworker.config import apply_product_config, read_worker_creds
 from scriptworker.constants import DEFAULT_CONFIG
 from scriptworker.context import Context
 from scriptworker.cot.verify import ChainOfTrust, verify_chain_of_trust
@@ -31,7 +31,7 @@ def read_integration_creds():
 
 
 async def build_config(override, basedir):
-    config = get_unfrozen_copy(DEFAULT_CONFIG)
+    config = utils.get_unfrozen_copy(DEFAULT_CONFIG)
     config.update(
         {
             "log_dir": os.path.join(basedir, "log"),
@@ -18,7 +18,7 @@ from taskcluster.exceptions import TaskclusterFailure
 
 import scriptworker.log as log
 import scriptworker.task as swtask
-from scriptworker.exceptions import ScriptWorkerTaskException, WorkerShutdownDuringTask
+from scriptworker.exceptions import ScriptWorkerException, ScriptWorkerTaskException, WorkerShutdownDuringTask
 from scriptworker.task_process import TaskProcess
 
 from . import TIMEOUT_SCRIPT, noop_async, read
@@ -198,6 +198,34 @@ async def test_get_project(context, mobile_context, source_url, expected, raises
         assert expected == await swtask.get_project(context_, source_url)
 
 
+@pytest.mark.parametrize(
+    "source_url, expected",
+    (
+        ("https://hg.mozilla.org/try", "try"),
+        ("https://hg.mozilla.org/try/", "try"),
+        ("https://hg.mozilla.org/try/rev/abcdef", "try"),
+        ("https://hg.mozilla.org/releases/mozilla-beta", "mozilla-beta"),
+        ("https://hg.mozilla.org/releases/mozilla-beta-foo", None),
+        ("https://hg.mozilla.org/releases", None),
+        ("https://github.com/mozilla-mobile/fenix", "fenix"),
+    ),
+)
+@pytest.mark.asyncio
+async def test_get_project_local(rw_context, source_url, expected):
+    rw_context.projects = {
+        "try": {"repo": "https://hg.mozilla.org/try"},
+        "mozilla-beta": {"repo": "https://hg.mozilla.org/releases/mozilla-beta"},
+        "fenix": {"repo": "https://github.com/mozilla-mobile/fenix"},
+        "fenix-copy": {"repo": "https://github.com/mozilla-mobile/fenix"},
+        "no-repo": {"access": "scm_level_1"},
+    }
+    if expected is None:
+        with pytest.raises(ValueError):
+            await swtask.get_project(rw_context, source_url)
+    else:
+        assert await swtask.get_project(rw_context, source_url) == expected
+
+
 # get_and_check_tasks_for {{{1
 @pytest.mark.parametrize(
     "context_type, tasks_for, raises",
@@ -429,8 +457,59 @@ def test_prepare_to_run_task(context):
 async def test_run_task(context):
     status = await swtask.run_task(context, noop_to_cancellable_process)
     log_file = log.get_log_filename(context)
-    assert read(log_file) in ("bar\nfoo\nexit code: 1\n", "foo\nbar\nexit code: 1\n")
+    lines = read(log_file).splitlines()
+    assert lines in (["bar", "foo", "exit code: 1"], ["foo", "bar", "exit code: 1"])
+    assert status == 1
+    # Task metrics are opt-in
+    assert not os.path.exists(os.path.join(context.config["task_log_dir"], "task_metrics.json"))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_concurrent_tasks", (1, 2))
+async def test_run_task_metrics(context, max_concurrent_tasks):
+    context.config["report_task_metrics"] = True
+    context.config["max_concurrent_tasks"] = max_concurrent_tasks
+    status = await swtask.run_task(context, noop_to_cancellable_process)
+    log_file = log.get_log_filename(context)
+    lines = read(log_file).splitlines()
+    assert lines[:3] in (["bar", "foo", "exit code: 1"], ["foo", "bar", "exit code: 1"])
+    assert lines[3].startswith("resource usage: wall ")
+    assert len(lines) == 4
     assert status == 1
+    with open(os.path.join(context.config["task_log_dir"], "task_metrics.json")) as fh:
+        metrics = json.load(fh)
+    assert metrics["taskId"] == "taskId"
+    assert metrics["exitCode"] == 1
+    assert metrics["resourceUsage"]["wall_time"] > 0
+    if max_concurrent_tasks > 1:
+        # Without samples, we can't tell this task's cpu time from the others'
+        assert metrics["resourceUsage"]["cpu_user"] is None
+        assert "cpu user n/a" in lines[3]
+
+
+@pytest.mark.asyncio
+async def test_run_task_monitor_cancelled(context, mocker):
+    """The resource usage monitor stops if we can't open the task log."""
+    context.config["report_task_metrics"] = True
+    context.config["task_metrics_interval"] = 0.01
+    monitors = []
+    real_ensure_future = asyncio.ensure_future
+
+    def ensure_future(coro):
+        future = real_ensure_future(coro)
+        monitors.append(future)
+        return future
+
+    def die(*args, **kwargs):
+        raise OSError("no log for you")
+
+    mocker.patch.object(swtask, "get_log_filehandle", new=die)
+    mocker.patch.object(swtask.asyncio, "ensure_future", new=ensure_future)
+    with pytest.raises(OSError):
+        await swtask.run_task(context, noop_to_cancellable_process)
+    await asyncio.sleep(0)
+    assert len(monitors) == 1
+    assert monitors[0].cancelled()
 
 
 @pytest.mark.asyncio
@@ -455,11 +534,12 @@ async def test_run_task_negative_11(context, mocker):
         return fake_proc
 
     mocker.patch.object(asyncio, "create_subprocess_exec", new=fake_exec)
+    context.config["report_task_metrics"] = True
 
     await swtask.run_task(context, noop_to_cancellable_process)
     log_file = log.get_log_filename(context)
     contents = read(log_file)
-    assert contents == "Automation Error: python exited with signal -11\n"
+    assert contents.startswith("Automation Error: python exited with signal -11\nresource usage: ")
 
 
 @pytest.mark.asyncio
@@ -535,6 +615,44 @@ async def test_complete_task_non_409(context, unsuccessful_queue):
         await swtask.complete_task(context, 0)
 
 
+# format_resource_usage {{{1
+def test_format_resource_usage():
+    resource_usage = {"wall_time": 12.34, "cpu_user": 1, "cpu_system": 0.25, "peak_rss": 3 * 1024 * 1024, "read_bytes": 0, "write_bytes": 1024 * 1024}
+    assert swtask.format_resource_usage(resource_usage) == (
+        "resource usage: wall 12.3s, cpu user 1.0s sys 0.2s, peak rss 3.0 MiB, read 0.0 MiB, written 1.0 MiB"
+    )
+    resource_usage.update({"cpu_user": None, "cpu_system": None, "peak_rss": None})
+    assert swtask.format_resource_usage(resource_usage) == (
+        "resource usage: wall 12.3s, cpu user n/a sys n/a, peak rss n/a, read 0.0 MiB, written 1.0 MiB"
+    )
+
+
+# report_task_metrics {{{1
+@pytest.mark.asyncio
+@pytest.mark.parametrize("url, raises", (("", False), ("https://metrics.example.com/", False), ("https://metrics.example.com/", True)))
+async def test_report_task_metrics(context, mocker, url, raises):
+    posted = []
+
+    async def fake_request(_, url, **kwargs):
+        if raises:
+            raise ScriptWorkerException("Bad status 500")
+        posted.append((url, kwargs["json"], kwargs["timeout"]))
+
+    mocker.patch.object(swtask, "request", new=fake_request)
+    context.config["task_metrics_url"] = url
+    await swtask.report_task_metrics(context, 0, {"wall_time": 1.0})
+    with open(os.path.join(context.config["task_log_dir"], "task_metrics.json")) as fh:
+        metrics = json.load(fh)
+    assert metrics["taskId"] == "taskId"
+    assert metrics["runId"] == "runId"
+    assert metrics["exitCode"] == 0
+    assert metrics["resourceUsage"] == {"wall_time": 1.0}
+    if url and not raises:
+        assert posted == [(url, metrics, context.config["task_metrics_timeout"])]
+    else:
+        assert posted == []
+
+
 # reclaim_task {{{1
 @pytest.mark.asyncio
 async def test_reclaim_task(context, successful_queue):
@@ -602,6 +720,55 @@ async def test_reclaim_task_mock(context, mocker, no_proc):
         assert kill_count == 1
 
 
+# reclaim_claimed_task {{{1
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status_code", (409, 500))
+async def test_reclaim_claimed_task(context, status_code):
+    """The waiting task's credentials and takenUntil are updated until the queue returns an error."""
+    claim_task = {"status": {"taskId": "waitingTaskId"}, "runId": 0, "credentials": {"clientId": "old"}, "takenUntil": "old"}
+    queue_credentials = []
+    temp_queue = mock.MagicMock()
+
+    async def fake_reclaim(task_id, run_id):
+        assert (task_id, run_id) == ("waitingTaskId", 0)
+        if len(queue_credentials) == 4:
+            raise taskcluster.exceptions.TaskclusterRestFailure("foo", None, status_code=status_code)
+        return {"credentials": {"clientId": "new{}".format(len(queue_credentials))}, "takenUntil": "new{}".format(len(queue_credentials))}
+
+    def fake_create_queue(credentials):
+        queue_credentials.append(credentials["clientId"])
+        return temp_queue
+
+    context.create_queue = fake_create_queue
+    temp_queue.reclaimTask = fake_reclaim
+    if status_code == 409:
+        await swtask.reclaim_claimed_task(context, claim_task)
+    else:
+        with pytest.raises(taskcluster.exceptions.TaskclusterRestFailure):
+            await swtask.reclaim_claimed_task(context, claim_task)
+    # Each reclaim uses the credentials from the last one
+    assert queue_credentials == ["old", "new1", "new2", "new3"]
+    assert claim_task["credentials"] == {"clientId": "new3"}
+    assert claim_task["takenUntil"] == "new3"
+
+
+# get_pending_task_count {{{1
+@pytest.mark.asyncio
+@pytest.mark.parametrize("raises", (True, False))
+async def test_get_pending_task_count(raises, context):
+    context.queue = mock.MagicMock()
+
+    async def pending_tasks(provisioner_id, worker_type):
+        if raises:
+            raise taskcluster.exceptions.TaskclusterRestFailure("foo", None, status_code=4)
+        assert (provisioner_id, worker_type) == (context.config["provisioner_id"], context.config["worker_type"])
+        return {"provisionerId": provisioner_id, "workerType": worker_type, "pendingTasks": 7}
+
+    context.queue.pendingTasks = pending_tasks
+    expected = None if raises else 7
+    assert await swtask.get_pending_task_count(context) == expected
+
+
 # claim_work {{{1
 @pytest.mark.asyncio
 @pytest.mark.parametrize("raises", (True, False))
@@ -616,3 +783,19 @@ async def test_claim_work(raises, context):
     else:
         context.queue.claimWork = noop_async
     assert await swtask.claim_work(context) is None
+
+
+@pytest.mark.asyncio
+async def test_claim_work_max_concurrent_tasks(context):
+    context.config["max_concurrent_tasks"] = 3
+    context.queue = mock.MagicMock()
+    payloads = []
+
+    async def claim_work(provisioner_id, worker_type, payload):
+        payloads.append(payload)
+        return {"tasks": []}
+
+    context.queue.claimWork = claim_work
+    assert await swtask.claim_work(context) == {"tasks": []}
+    assert await swtask.claim_work(context, num_tasks=2) == {"tasks": []}
+    assert [payload["tasks"] for payload in payloads] == [3, 2]
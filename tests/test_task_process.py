@@ -1,10 +1,13 @@
+import asyncio
 import os
+import resource
 import signal
+import sys
 
 import pytest
 from mock import MagicMock, call
 
-from scriptworker.task_process import TaskProcess
+from scriptworker.task_process import TaskProcess, read_process_group_usage
 
 
 @pytest.mark.asyncio
@@ -43,3 +46,70 @@ async def test_set_killed_due_to_worker_shutdown():
     assert task_process.stopped_due_to_worker_shutdown is False
     await task_process.worker_shutdown_stop()
     assert task_process.stopped_due_to_worker_shutdown is True
+
+
+def _write_proc_entry(proc_dir, pid, pgrp, utime, stime, cutime, cstime, rss, io=None):
+    os.makedirs(os.path.join(proc_dir, pid))
+    fields = ["S", "1", str(pgrp)] + ["0"] * 8 + [str(utime), str(stime), str(cutime), str(cstime)] + ["0"] * 6 + [str(rss)]
+    with open(os.path.join(proc_dir, pid, "stat"), "w") as fh:
+        fh.write("{} (a (weird) name) {}\n".format(pid, " ".join(fields)))
+    if io is not None:
+        with open(os.path.join(proc_dir, pid, "io"), "w") as fh:
+            fh.write(io)
+
+
+def test_read_process_group_usage(tmpdir):
+    proc_dir = str(tmpdir)
+    ticks = os.sysconf("SC_CLK_TCK")
+    _write_proc_entry(proc_dir, "100", 100, ticks, ticks, ticks, 0, 10, io="rchar: 5\nread_bytes: 1024\nwrite_bytes: 2048\n")
+    _write_proc_entry(proc_dir, "101", 100, ticks, 0, 0, ticks, 5)
+    _write_proc_entry(proc_dir, "200", 200, ticks, ticks, ticks, ticks, 1000)
+    os.makedirs(os.path.join(proc_dir, "self"))
+    usage = read_process_group_usage(100, proc_dir=proc_dir)
+    assert usage == {
+        "cpu_user": 3.0,
+        "cpu_system": 2.0,
+        "rss": 15 * resource.getpagesize(),
+        "read_bytes": 1024,
+        "write_bytes": 2048,
+        "processes": 2,
+    }
+    assert read_process_group_usage(100, proc_dir=os.path.join(proc_dir, "missing")) is None
+
+
+@pytest.mark.asyncio
+async def test_get_resource_usage():
+    children_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "sum(range(10 ** 6))", preexec_fn=os.setsid)
+    task_process = TaskProcess(process, children_rusage=children_rusage)
+    await process.wait()
+    usage = task_process.get_resource_usage()
+    assert usage["wall_time"] > 0
+    assert usage["cpu_user"] + usage["cpu_system"] > 0
+    assert usage["read_bytes"] is not None
+    # Process counts need samples
+    assert usage["max_processes"] is None
+    assert set(usage) == {"wall_time", "cpu_user", "cpu_system", "peak_rss", "read_bytes", "write_bytes", "max_processes"}
+
+
+@pytest.mark.asyncio
+async def test_get_resource_usage_unmeasured():
+    """Without rusage or samples, only the wall time is known."""
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "pass", preexec_fn=os.setsid)
+    task_process = TaskProcess(process)
+    await process.wait()
+    usage = task_process.get_resource_usage()
+    assert usage.pop("wall_time") > 0
+    assert set(usage.values()) == {None}
+
+
+@pytest.mark.asyncio
+async def test_monitor_resource_usage():
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "import time; time.sleep(1)", preexec_fn=os.setsid)
+    task_process = TaskProcess(process)
+    monitor_future = asyncio.ensure_future(task_process.monitor_resource_usage(0.01))
+    await asyncio.sleep(0.1)
+    monitor_future.cancel()
+    await process.wait()
+    assert task_process.peak_usage["processes"] == 1
+    assert task_process.peak_usage["rss"] > 0
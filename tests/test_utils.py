@@ -8,14 +8,17 @@ import re
 import shutil
 import tempfile
 import time
+from copy import deepcopy
 
+import aiohttp
 import mock
 import pytest
+from immutabledict import immutabledict
 
 import scriptworker.utils as utils
 from scriptworker.exceptions import Download404, DownloadError, ScriptWorkerException, ScriptWorkerRetryException
 
-from . import FakeResponse, touch
+from . import FakeResponse, noop_async, touch
 
 # constants helpers and fixtures {{{1
 TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
@@ -439,6 +442,170 @@ async def test_download_file_no_auth(rw_context, fake_session, tmpdir):
     assert contents == "asdfasdf"
 
 
+@pytest.mark.asyncio
+async def test_download_file_hash_algs(rw_context, fake_session, tmpdir):
+    path = os.path.join(tmpdir, "foo")
+    digests = await utils.download_file(rw_context, "url", path, session=fake_session, chunk_size=3, hash_algs=["sha256", "sha512"])
+    assert digests == {"sha256": utils.get_hash(path, hash_alg="sha256"), "sha512": utils.get_hash(path, hash_alg="sha512")}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("headers", ({"Content-Length": "100"}, {"Content-Length": "100", "Content-Encoding": "gzip"}, {}))
+async def test_download_file_preallocate(rw_context, fake_session, tmpdir, headers):
+    async def fake_request(method, url, *args, **kwargs):
+        resp = FakeResponse(method, url)
+        resp._headers = headers
+        return resp
+
+    fake_session._request = fake_request
+    path = os.path.join(tmpdir, "foo")
+    await utils.download_file(rw_context, "url", path, session=fake_session)
+    with open(path, "r") as fh:
+        contents = fh.read()
+    assert contents == "asdfasdf"
+
+
+def _fake_range_request(body, requests, status=206, accept_ranges=True, etag='"etag"'):
+    async def fake_request(method, url, *args, headers=None, **kwargs):
+        requests.append(headers)
+        resp = FakeResponse(method, url)
+        headers = headers or {}
+        range_header = headers.get("Range")
+        if range_header is None or status == 200 or not accept_ranges or headers.get("If-Range", etag) != etag:
+            resp._headers = {"Content-Length": str(len(body)), "ETag": etag}
+            if accept_ranges:
+                resp._headers["Accept-Ranges"] = "bytes"
+            resp.resp = [body]
+            return resp
+        start, end = range_header.replace("bytes=", "").split("-")
+        end = min(int(end), len(body) - 1) if end else len(body) - 1
+        resp.status = status
+        resp._headers = {"Content-Range": "bytes {}-{}/{}".format(start, end, len(body)), "ETag": etag}
+        resp.resp = [body[int(start) : end + 1]]
+        return resp
+
+    return fake_request
+
+
+def _write_partial_download(path, contents, etag='"etag"'):
+    part_filename = "{}.part".format(path)
+    with open(part_filename, "wb") as fh:
+        fh.write(contents)
+    if etag:
+        utils._PARTIAL_DOWNLOAD_ETAGS[part_filename] = etag
+
+
+@pytest.mark.asyncio
+async def test_download_file_resume(rw_context, fake_session, tmpdir):
+    requests = []
+    fake_session._request = _fake_range_request(b"asdfqwer", requests)
+    path = os.path.join(tmpdir, "foo")
+    _write_partial_download(path, b"asdf")
+    digests = await utils.download_file(rw_context, "url", path, session=fake_session, hash_algs=["sha256"])
+    assert requests == [{"Range": "bytes=4-", "If-Range": '"etag"'}]
+    with open(path, "rb") as fh:
+        assert fh.read() == b"asdfqwer"
+    assert not os.path.exists("{}.part".format(path))
+    assert digests == {"sha256": utils.get_hash(path)}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status, partial_etag", ((200, '"etag"'), (206, '"old_etag"'), (206, None)))
+async def test_download_file_resume_ignored(rw_context, fake_session, tmpdir, status, partial_etag):
+    """A partial download is ignored if the server doesn't resume it, the file changed, or we don't know its ETag."""
+    requests = []
+    fake_session._request = _fake_range_request(b"asdfqwer", requests, status=status)
+    path = os.path.join(tmpdir, "foo")
+    _write_partial_download(path, b"zzzz", etag=partial_etag)
+    await utils.download_file(rw_context, "url", path, session=fake_session)
+    with open(path, "rb") as fh:
+        assert fh.read() == b"asdfqwer"
+    if partial_etag is None:
+        assert requests == [None]
+
+
+@pytest.mark.asyncio
+async def test_download_file_resume_after_error(rw_context, fake_session, tmpdir):
+    """A download that fails part way through is resumed with If-Range on the next attempt."""
+    requests = []
+    fake_range_request = _fake_range_request(b"asdfqwer", requests)
+
+    async def failing_request(method, url, *args, **kwargs):
+        resp = await fake_range_request(method, url, *args, **kwargs)
+
+        async def iter_chunked(*args):
+            yield b"asdf"
+            raise aiohttp.ClientPayloadError("dropped")
+
+        resp.iter_chunked = iter_chunked
+        return resp
+
+    fake_session._request = failing_request
+    path = os.path.join(tmpdir, "foo")
+    with pytest.raises(aiohttp.ClientPayloadError):
+        await utils.download_file(rw_context, "url", path, session=fake_session)
+    fake_session._request = fake_range_request
+    await utils.download_file(rw_context, "url", path, session=fake_session)
+    assert requests == [None, {"Range": "bytes=4-", "If-Range": '"etag"'}]
+    with open(path, "rb") as fh:
+        assert fh.read() == b"asdfqwer"
+
+
+@pytest.mark.asyncio
+async def test_download_file_resume_416(rw_context, fake_session, tmpdir):
+    fake_session._request = _fake_range_request(b"asdf", [], status=416)
+    path = os.path.join(tmpdir, "foo")
+    _write_partial_download(path, b"asdfasdf")
+    with pytest.raises(DownloadError):
+        await utils.download_file(rw_context, "url", path, session=fake_session)
+    assert not os.path.exists("{}.part".format(path))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "body, accept_ranges, expected_requests",
+    (
+        # The first request is for bytes 0-4; the other 5 bytes are split in two
+        (b"asdfqwerzx", True, [{"Range": "bytes=0-4"}, {"Range": "bytes=5-7", "If-Range": '"etag"'}, {"Range": "bytes=8-9", "If-Range": '"etag"'}]),
+        # The first request gets the whole file
+        (b"asdf", True, [{"Range": "bytes=0-4"}]),
+        (b"asdfqwerzx", False, [{"Range": "bytes=0-4"}]),
+    ),
+)
+async def test_download_file_segments(rw_context, fake_session, tmpdir, body, accept_ranges, expected_requests):
+    rw_context.config["download_segments"] = 3
+    rw_context.config["download_segment_threshold"] = 5
+    requests = []
+    fake_session._request = _fake_range_request(body, requests, accept_ranges=accept_ranges)
+    path = os.path.join(tmpdir, "foo")
+    digests = await utils.download_file(rw_context, "url", path, session=fake_session, hash_algs=["sha256"])
+    assert sorted(requests, key=lambda headers: headers["Range"]) == expected_requests
+    with open(path, "rb") as fh:
+        assert fh.read() == body
+    assert digests == {"sha256": utils.get_hash(path)}
+
+
+@pytest.mark.asyncio
+async def test_download_file_segments_changed(rw_context, fake_session, tmpdir, mocker):
+    """If the file changes mid-download, the segments fail rather than mixing versions."""
+    rw_context.config["download_segments"] = 2
+    rw_context.config["download_segment_threshold"] = 5
+    fake_range_request = _fake_range_request(b"asdfqwerzx", [])
+    changed_request = _fake_range_request(b"ASDFQWERZX", [], etag='"changed"')
+
+    async def fake_request(method, url, *args, headers=None, **kwargs):
+        if headers["Range"] == "bytes=0-4":
+            return await fake_range_request(method, url, *args, headers=headers, **kwargs)
+        return await changed_request(method, url, *args, headers=headers, **kwargs)
+
+    fake_session._request = fake_request
+    mocker.patch.object(asyncio, "sleep", new=noop_async)
+    path = os.path.join(tmpdir, "foo")
+    with pytest.raises(DownloadError):
+        await utils.download_file(rw_context, "url", path, session=fake_session)
+    assert not os.path.exists("{}.part".format(path))
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("auth", (None, "someAuth"))
 async def test_download_file_exception(rw_context, fake_session_500, tmpdir, auth):
@@ -596,13 +763,60 @@ def test_add_enumerable_item_to_dict(dict_, key, item, expected):
     assert dict_ == expected
 
 
+# get_frozen_copy {{{1
+@pytest.mark.parametrize(
+    "input_dict,expected_dict",
+    (
+        ({1: 2}, immutabledict({1: 2})),
+        ({"a": [1.0, 2.5]}, immutabledict({"a": (1.0, 2.5)})),
+        (immutabledict({1: {"a": True}}), immutabledict({1: immutabledict({"a": True})})),
+        ({1: [{"a": None}, ["A", "B", "C"]]}, immutabledict({1: (immutabledict({"a": None}), ("A", "B", "C"))})),
+        ({1: [1, [2, 3], {}]}, immutabledict({1: (1, (2, 3), immutabledict({}))})),
+        ([1, []], (1, ())),
+    ),
+)
+def test_get_frozen_copy(input_dict, expected_dict):
+    assert utils.get_frozen_copy(input_dict) == expected_dict
+
+
+def test_get_frozen_copy_reuses_frozen():
+    frozen = immutabledict({"a": immutabledict({"b": (1, 2)}), "c": (immutabledict({}),)})
+    assert utils.get_frozen_copy(frozen) is frozen
+    partly_frozen = immutabledict({"a": frozen["a"], "c": [1]})
+    result = utils.get_frozen_copy(partly_frozen)
+    assert result == immutabledict({"a": frozen["a"], "c": (1,)})
+    assert result is not partly_frozen
+    assert result["a"] is frozen["a"]
+
+
+# get_unfrozen_copy {{{1
+@pytest.mark.parametrize(
+    "input_dict,expected_dict",
+    (
+        ({1: 2}, {1: 2}),
+        ({"a": (1.0, 2.5)}, {"a": [1.0, 2.5]}),
+        (immutabledict({1: immutabledict({"a": True})}), {1: {"a": True}}),
+        ({1: (immutabledict({"a": None}), ("A", "B", "C"))}, {1: [{"a": None}, ["A", "B", "C"]]}),
+        ({1: (1, [2, 3], immutabledict({}))}, {1: [1, [2, 3], {}]}),
+        ((1, ()), [1, []]),
+    ),
+)
+def test_get_unfrozen_copy(input_dict, expected_dict):
+    assert utils.get_unfrozen_copy(input_dict) == expected_dict
+
+
 # remove_empty_keys {{{1
 @pytest.mark.parametrize(
     "orig,expected",
     (({"a": None, "b": "", "c": {}, "d": [], "e": "null"}, {"b": ""}), ({"a": {"b": None, "c": ""}, "d": [{}, ""]}, {"a": {"c": ""}, "d": [""]})),
 )
 def test_remove_empty_keys(orig, expected):
-    assert utils.remove_empty_keys(orig) == expected
+    orig_copy = deepcopy(orig)
+    result = utils.remove_empty_keys(orig)
+    assert result == expected
+    assert orig == orig_copy
+    result["new"] = "value"
+    assert "new" not in orig
 
 
 @pytest.mark.parametrize(
@@ -37,9 +37,13 @@ def test_main(mocker, context, event_loop):
     creds = {"fake_creds": True}
     config["credentials"] = deepcopy(creds)
 
+    sessions = []
+
     async def foo(arg, credentials):
         # arg.credentials will be a dict copy of a immutabledict.
         assert credentials == dict(creds)
+        arg.session = aiohttp.ClientSession()
+        sessions.append(arg.session)
         raise ScriptWorkerException("foo")
 
     try:
@@ -53,6 +57,8 @@ def test_main(mocker, context, event_loop):
             worker.main(event_loop=event_loop)
     finally:
         os.remove(tmp)
+    # The fatal exception ends the loop, and main closes the session
+    assert [session.closed for session in sessions] == [True]
 
 
 @pytest.mark.parametrize("running", (True, False))
@@ -95,11 +101,17 @@ def test_main_running_sigusr1(mocker, context, event_loop, running):
     call to async_main without cancelling the task."""
     run_tasks_cancelled = event_loop.create_future()
 
+    run_tasks_stopped_claiming = event_loop.create_future()
+
     class MockRunTasks:
         @staticmethod
         def cancel():
             run_tasks_cancelled.set_result(True)
 
+        @staticmethod
+        def stop_claiming():
+            run_tasks_stopped_claiming.set_result(True)
+
     async def async_main(internal_context, _):
         # scriptworker reads context from a file, so we have to modify the
         # context given here instead of the variable from the fixture
@@ -119,6 +131,9 @@ def test_main_running_sigusr1(mocker, context, event_loop, running):
         os.remove(tmp)
 
     assert not run_tasks_cancelled.done()
+    if running:
+        event_loop.run_until_complete(run_tasks_stopped_claiming)
+        assert run_tasks_stopped_claiming.result()
 
 
 # async_main {{{1
@@ -126,6 +141,45 @@ def test_main_running_sigusr1(mocker, context, event_loop, running):
 async def test_async_main(context, mocker, tmpdir):
     mocker.patch.object(worker, "run_tasks", new=noop_async)
     await worker.async_main(context, {})
+    await worker.close_session(context)
+    assert context.session is None
+
+
+@pytest.mark.asyncio
+async def test_async_main_persistent_session(context, mocker):
+    credentials = {"clientId": "foo", "accessToken": "bar"}
+    mocker.patch.object(worker, "run_tasks", new=noop_async)
+    try:
+        await worker.async_main(context, credentials)
+        session = context.session
+        queue = context.queue
+        assert isinstance(session.connector, aiohttp.TCPConnector)
+        assert session.connector.limit == context.config["aiohttp_connection_limit"]
+        await worker.async_main(context, credentials)
+        assert context.session is session
+        assert context.queue is queue
+        # new credentials mean a new queue, but the same session
+        await worker.async_main(context, {"clientId": "foo", "accessToken": "baz"})
+        assert context.session is session
+        assert context.queue is not queue
+    finally:
+        await worker.close_session(context)
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_async_main_exception(context, mocker):
+    async def fail(*args):
+        raise ScriptWorkerException("foo")
+
+    mocker.patch.object(worker, "run_tasks", new=fail)
+    try:
+        with pytest.raises(ScriptWorkerException):
+            await worker.async_main(context, {})
+        # main closes the session on the way out
+        assert not context.session.closed
+    finally:
+        await worker.close_session(context)
 
 
 # run_tasks {{{1
@@ -323,6 +377,580 @@ async def test_run_tasks_no_cancel(context, mocker):
     mock_complete_task.assert_called_once_with(mock.ANY, 0)
 
 
+@pytest.mark.asyncio
+async def test_run_tasks_concurrent(context, mocker):
+    context.config["max_concurrent_tasks"] = 3
+    claim_work_returns = [{"tasks": [{"status": 0}, {"status": 4}, {"status": 1}]}, {"tasks": []}]
+    all_running = asyncio.Event()
+    running = []
+    artifact_dirs = {}
+
+    def prepare_to_run_task(slot_context, task_defn):
+        slot_context.task = task_defn
+
+    async def do_run_task(slot_context, *args, **kwargs):
+        running.append(slot_context)
+        if len(running) == 3:
+            all_running.set()
+        await all_running.wait()
+        return slot_context.task["status"]
+
+    async def fake_upload(slot_context, files):
+        artifact_dirs[slot_context.task["status"]] = slot_context.config["artifact_dir"]
+        return 0
+
+    async def claim_work(*args, **kwargs):
+        return claim_work_returns.pop(0)
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", new=fake_upload)
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+    mocker.patch("scriptworker.worker.RunTasks._poll_sleep", noop_async)
+
+    run_tasks = RunTasks()
+    status = await run_tasks.invoke(context)
+    assert status == 4
+    assert sorted(artifact_dirs.values()) == [os.path.join(context.config["artifact_dir"], "slot{}".format(slot)) for slot in range(3)]
+    assert claim_work_returns == []
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_concurrent_claim_free_slots(context, mocker):
+    """A slot claims more work as soon as it's free, while the others keep running."""
+    context.config["max_concurrent_tasks"] = 2
+    claim_work_returns = [{"tasks": [{"name": "fast"}, {"name": "slow"}]}, {"tasks": [{"name": "next"}]}, {"tasks": []}, {"tasks": []}]
+    claims = []
+    events = []
+    slow_task_done = asyncio.Event()
+
+    async def claim_work(context, num_tasks=None):
+        claims.append(num_tasks)
+        if len(claims) == 3:
+            slow_task_done.set()
+        return claim_work_returns.pop(0)
+
+    def prepare_to_run_task(slot_context, task_defn):
+        slot_context.task = task_defn
+
+    async def do_run_task(slot_context, *args, **kwargs):
+        if slot_context.task["name"] == "slow":
+            await slow_task_done.wait()
+        events.append("{} {}".format(slot_context.task["name"], os.path.basename(slot_context.config["work_dir"])))
+        return 0
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+    mocker.patch("scriptworker.worker.RunTasks._poll_sleep", noop_async)
+
+    assert await RunTasks().invoke(context) == 0
+    # The next task runs in the fast task's slot before the slow task finishes
+    assert events == ["fast slot0", "next slot0", "slow slot1"]
+    assert claims == [None, 1, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_concurrent_exception(context, mocker):
+    """An unexpected exception in one slot lets the other slots finish, then is raised."""
+    context.config["max_concurrent_tasks"] = 2
+    claims = []
+    completed = []
+    bad_task_done = asyncio.Event()
+
+    async def claim_work(*args, **kwargs):
+        claims.append(args)
+        return {"tasks": [{"name": "bad"}, {"name": "good"}]}
+
+    def prepare_to_run_task(slot_context, task_defn):
+        slot_context.task = task_defn
+
+    async def do_run_task(slot_context, *args, **kwargs):
+        if slot_context.task["name"] == "bad":
+            bad_task_done.set()
+            raise OSError("unexpected")
+        await bad_task_done.wait()
+        await asyncio.sleep(0)
+        return 0
+
+    async def complete_task(slot_context, status):
+        completed.append(slot_context.task["name"])
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", complete_task)
+
+    with pytest.raises(OSError):
+        await RunTasks().invoke(context)
+    assert completed == ["good"]
+    # No more work is claimed after the exception
+    assert len(claims) == 1
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_concurrent_extra_tasks(context, mocker):
+    """Tasks beyond the free slots wait for a slot, rather than being dropped."""
+    context.config["max_concurrent_tasks"] = 2
+    claim_work_returns = [{"tasks": [{"name": "one"}, {"name": "two"}, {"name": "three"}]}, {"tasks": []}]
+    claims = []
+    events = []
+
+    async def claim_work(context, num_tasks=None):
+        claims.append(num_tasks)
+        return claim_work_returns.pop(0)
+
+    def prepare_to_run_task(slot_context, task_defn):
+        slot_context.task = task_defn
+
+    async def do_run_task(slot_context, *args, **kwargs):
+        events.append("{} {}".format(slot_context.task["name"], os.path.basename(slot_context.config["work_dir"])))
+        return 0
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+    mocker.patch("scriptworker.worker.RunTasks._poll_sleep", noop_async)
+
+    assert await RunTasks().invoke(context) == 0
+    assert sorted(events) == ["one slot0", "three slot0", "two slot1"]
+    # We don't claim more work until the extra task has run
+    assert claims == [None, 2]
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_concurrent_claim_exception(context, mocker):
+    """An unexpected exception claiming work lets the running slots finish, then is raised."""
+    context.config["max_concurrent_tasks"] = 2
+    claim_work_returns = [{"tasks": [{"name": "fast"}, {"name": "slow"}]}, OSError("claim")]
+    completed = []
+    claim_failed = asyncio.Event()
+
+    async def claim_work(*args, **kwargs):
+        value = claim_work_returns.pop(0)
+        if isinstance(value, Exception):
+            claim_failed.set()
+            raise value
+        return value
+
+    def prepare_to_run_task(slot_context, task_defn):
+        slot_context.task = task_defn
+
+    async def do_run_task(slot_context, *args, **kwargs):
+        if slot_context.task["name"] == "slow":
+            await claim_failed.wait()
+        return 0
+
+    async def complete_task(slot_context, status):
+        completed.append(slot_context.task["name"])
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", complete_task)
+
+    with pytest.raises(OSError):
+        await RunTasks().invoke(context)
+    assert completed == ["fast", "slow"]
+    assert claim_work_returns == []
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_concurrent_idle_backoff(context, mocker):
+    """Idle slots back off, and skip claiming while the queue has no pending tasks."""
+    context.config["max_concurrent_tasks"] = 2
+    context.config["check_pending_tasks"] = True
+    context.config["max_poll_interval"] = 600
+    claims = []
+    pending_counts = []
+    timeouts = []
+    finish = asyncio.Event()
+
+    async def claim_work(context, num_tasks=None):
+        claims.append(num_tasks)
+        return {"tasks": [{"name": "slow"}]} if len(claims) == 1 else {"tasks": []}
+
+    async def get_pending_task_count(context):
+        pending_counts.append(context.idle_poll_count)
+        if len(pending_counts) == 3:
+            finish.set()
+        return 0
+
+    def prepare_to_run_task(slot_context, task_defn):
+        slot_context.task = task_defn
+
+    async def do_run_task(slot_context, *args, **kwargs):
+        await finish.wait()
+        return 0
+
+    original_wait = asyncio.wait
+
+    async def fake_wait(futures, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        return await original_wait(futures, timeout=0 if timeout else None, **kwargs)
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.get_pending_task_count", get_pending_task_count)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+    mocker.patch("scriptworker.worker.RunTasks._poll_sleep", noop_async)
+    mocker.patch.object(worker.asyncio, "wait", new=fake_wait)
+
+    assert await RunTasks().invoke(context) == 0
+    assert claims == [None, 1]
+    assert pending_counts == list(range(1, len(pending_counts) + 1))
+    # The poll interval grows while the queue stays empty
+    assert timeouts[1] < timeouts[2] < timeouts[3]
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_forget_finished_processes(context, mocker):
+    run_tasks = RunTasks()
+    task_process = mock.MagicMock()
+
+    async def do_run_task(context, run_cancellable, to_cancellable_process, **kwargs):
+        await to_cancellable_process(task_process)
+        assert run_tasks.task_processes == [task_process]
+        return 0
+
+    mocker.patch("scriptworker.worker.claim_work", create_async(_MOCK_CLAIM_WORK_RETURN))
+    mocker.patch("scriptworker.worker.prepare_to_run_task", noop_sync)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+
+    assert await run_tasks.invoke(context) == 0
+    assert run_tasks.task_processes == []
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_stop_checkpoint_before_finalize(context, mocker):
+    """The log checkpoints stop once the task exits, before the logs are finalized."""
+    context.config["verify_chain_of_trust"] = False
+    events = []
+
+    async def checkpoint_logs(context):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            events.append("checkpoint stopped")
+            raise
+
+    async def run_task(*args):
+        # Let the checkpoints start
+        await asyncio.sleep(0)
+        events.append("run_task")
+        return 0
+
+    async def finalize_artifacts(context):
+        events.append("finalize_artifacts")
+
+    mocker.patch("scriptworker.worker.claim_work", create_async(_MOCK_CLAIM_WORK_RETURN))
+    mocker.patch("scriptworker.worker.prepare_to_run_task", noop_sync)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.checkpoint_logs", checkpoint_logs)
+    mocker.patch("scriptworker.worker.run_task", run_task)
+    mocker.patch("scriptworker.worker.finalize_artifacts", finalize_artifacts)
+    mocker.patch("scriptworker.worker.generate_cot", noop_sync)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+
+    assert await RunTasks().invoke(context) == 0
+    assert events == ["run_task", "checkpoint stopped", "finalize_artifacts"]
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_prefetch_claim_work(context, mocker):
+    context.config["prefetch_claim_work"] = True
+    claim_work_returns = [{"tasks": [{"status": 2}]}, {"tasks": [{"status": 0}]}, {"tasks": []}]
+    events = []
+
+    async def claim_work(*args):
+        events.append("claim_work")
+        return claim_work_returns.pop(0)
+
+    def prepare_to_run_task(context, task_defn):
+        context.task = task_defn
+
+    async def do_run_task(context, *args, **kwargs):
+        return context.task["status"]
+
+    async def fake_upload(*args):
+        # Let the prefetched claim_work run before the upload finishes
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        events.append("upload")
+        return 0
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", new=fake_upload)
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+    poll_sleeps = []
+    original_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        if delay == context.config["poll_interval"]:
+            poll_sleeps.append(delay)
+        else:
+            await original_sleep(delay)
+
+    mocker.patch.object(asyncio, "sleep", new=fake_sleep)
+
+    run_tasks = RunTasks()
+    status = await run_tasks.invoke(context)
+    assert status == 0
+    assert events == ["claim_work", "claim_work", "upload", "claim_work", "upload"]
+    assert poll_sleeps == [context.config["poll_interval"]]
+    assert run_tasks.prefetched_claim is None
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_prefetch_claim_work_reclaim(context, mocker):
+    """A prefetched task is reclaimed while the current task uploads, and runs with the new credentials."""
+    context.config["prefetch_claim_work"] = True
+    context.config["reclaim_interval"] = 0.001
+    prefetched_task = {"name": "prefetched", "status": {"taskId": "prefetchedTaskId"}, "runId": 0, "credentials": {"clientId": "old"}, "takenUntil": "old"}
+    claim_work_returns = [{"tasks": [{"name": "current"}]}, {"tasks": [prefetched_task]}, {"tasks": []}]
+    reclaims = []
+    started = []
+    temp_queue = mock.MagicMock()
+
+    async def claim_work(*args):
+        return claim_work_returns.pop(0)
+
+    async def reclaim(task_id, run_id):
+        reclaims.append(task_id)
+        return {"credentials": {"clientId": "new"}, "takenUntil": "new{}".format(len(reclaims))}
+
+    def prepare_to_run_task(context, task_defn):
+        context.task = task_defn
+        started.append((task_defn["name"], dict(task_defn.get("credentials", {})), len(reclaims)))
+
+    async def fake_upload(context, *args):
+        if context.task["name"] == "current":
+            # Upload for longer than the prefetched task's claim lasts
+            while len(reclaims) < 3:
+                await asyncio.sleep(0.001)
+        return 0
+
+    temp_queue.reclaimTask = reclaim
+    mocker.patch.object(context, "create_queue", return_value=temp_queue)
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", create_async(0))
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", new=fake_upload)
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+    mocker.patch("scriptworker.worker.RunTasks._poll_sleep", noop_async)
+
+    run_tasks = RunTasks()
+    assert await run_tasks.invoke(context) == 0
+    assert started[0] == ("current", {}, 0)
+    name, credentials, reclaim_count = started[1]
+    assert (name, credentials) == ("prefetched", {"clientId": "new"})
+    assert reclaim_count >= 3
+    assert prefetched_task["takenUntil"] == "new{}".format(reclaim_count)
+    # We stop reclaiming once the task starts running; reclaim_task takes over
+    await asyncio.sleep(0.01)
+    assert len(reclaims) == reclaim_count
+    assert run_tasks.prefetched_reclaims == []
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_stop_claiming(context, mocker):
+    """Stopping claiming lets the in-flight prefetched claim finish, and runs its tasks."""
+    context.config["prefetch_claim_work"] = True
+    stopped_claiming = asyncio.Event()
+    claims = []
+    statuses = []
+    run_tasks = RunTasks()
+
+    async def claim_work(*args):
+        claims.append(args)
+        if len(claims) > 1:
+            await stopped_claiming.wait()
+        return {"tasks": [{"status": len(claims)}]}
+
+    def prepare_to_run_task(context, task_defn):
+        context.task = task_defn
+
+    async def do_run_task(context, *args, **kwargs):
+        return context.task["status"]
+
+    async def fake_upload(*args):
+        await asyncio.sleep(0)
+        run_tasks.stop_claiming()
+        stopped_claiming.set()
+        return 0
+
+    async def complete_task(context, status):
+        statuses.append(status)
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", prepare_to_run_task)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", do_run_task)
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", new=fake_upload)
+    mocker.patch("scriptworker.worker.complete_task", new=complete_task)
+
+    assert await run_tasks.invoke(context) == 2
+    assert run_tasks.is_stopped_claiming
+    assert run_tasks.prefetched_claim is None
+    assert statuses == [1, 2]
+    assert len(claims) == 2
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_resolve_prefetched_claim(context, mocker):
+    """Tasks from a prefetched claim we won't run are reported as worker-shutdown."""
+    context.config["prefetch_claim_work"] = True
+    claims = []
+    statuses = []
+
+    async def claim_work(*args):
+        claims.append(args)
+        return _MOCK_CLAIM_WORK_RETURN
+
+    async def fake_upload(*args):
+        # Let the prefetched claim return first
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        raise OSError("upload")
+
+    async def complete_task(context, status):
+        statuses.append(status)
+
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch("scriptworker.worker.prepare_to_run_task", noop_sync)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", create_async(0))
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", new=fake_upload)
+    mocker.patch("scriptworker.worker.complete_task", new=complete_task)
+
+    run_tasks = RunTasks()
+    with pytest.raises(OSError):
+        await run_tasks.invoke(context)
+    assert len(claims) == 2
+    assert statuses == [STATUSES["worker-shutdown"]]
+    assert run_tasks.prefetched_claim is None
+
+
+@pytest.mark.parametrize(
+    "poll_interval, max_poll_interval, idle_poll_count, min_expected, max_expected",
+    (
+        (10, 10, 5, 10, 10),
+        (10, 5, 1, 10, 10),
+        (10, 120, 1, 10, 15),
+        (10, 120, 3, 40, 60),
+        (10, 120, 10, 80, 120),
+        (10, 12, 10, 10, 12),
+        (10, 300, 5000, 200, 300),
+    ),
+)
+def test_get_poll_sleep_time(context, poll_interval, max_poll_interval, idle_poll_count, min_expected, max_expected):
+    context.config["poll_interval"] = poll_interval
+    context.config["max_poll_interval"] = max_poll_interval
+    context.idle_poll_count = idle_poll_count
+    assert min_expected <= worker.get_poll_sleep_time(context) <= max_expected
+
+
+def test_get_poll_sleep_time_jitter_at_max(context):
+    """Idle workers that have backed off all the way still don't poll in lockstep."""
+    context.config["poll_interval"] = 10
+    context.config["max_poll_interval"] = 300
+    context.idle_poll_count = 100000
+    assert len({worker.get_poll_sleep_time(context) for _ in range(5)}) == 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("pending_tasks, expected_claims", ((0, 0), (3, 1), (None, 1)))
+async def test_run_tasks_check_pending_tasks(context, mocker, pending_tasks, expected_claims):
+    context.config["check_pending_tasks"] = True
+    context.config["max_poll_interval"] = 60
+    context.idle_poll_count = 2
+    claims = []
+    sleeps = []
+
+    async def claim_work(*args):
+        claims.append(args)
+        return _MOCK_CLAIM_WORK_NONE_RETURN
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    mocker.patch("scriptworker.worker.get_pending_task_count", create_async(pending_tasks))
+    mocker.patch("scriptworker.worker.claim_work", claim_work)
+    mocker.patch.object(asyncio, "sleep", new=fake_sleep)
+
+    run_tasks = RunTasks()
+    assert await run_tasks.invoke(context) is None
+    assert len(claims) == expected_claims
+    assert context.idle_poll_count == 3
+    assert 40 <= sleeps[0] <= 60
+
+
+@pytest.mark.asyncio
+async def test_run_tasks_reset_idle_poll_count(context, mocker):
+    context.config["check_pending_tasks"] = True
+    context.idle_poll_count = 5
+    mocker.patch("scriptworker.worker.get_pending_task_count", create_async(1))
+    mocker.patch("scriptworker.worker.claim_work", create_async(_MOCK_CLAIM_WORK_RETURN))
+    mocker.patch("scriptworker.worker.prepare_to_run_task", noop_sync)
+    mocker.patch("scriptworker.worker.reclaim_task", noop_async)
+    mocker.patch("scriptworker.worker.do_run_task", create_async(0))
+    mocker.patch("scriptworker.worker.cleanup", noop_sync)
+    mocker.patch("scriptworker.worker.filepaths_in_dir", create_sync([]))
+    mocker.patch("scriptworker.worker.do_upload", create_async(0))
+    mocker.patch("scriptworker.worker.complete_task", noop_async)
+
+    run_tasks = RunTasks()
+    assert await run_tasks.invoke(context) == 0
+    assert context.idle_poll_count == 0
+
+
 @pytest.mark.asyncio
 async def test_run_tasks_cancel_claim_work(context, mocker):
     async def dont_call_me(*args, **kwargs):
@@ -506,7 +1134,7 @@ async def test_run_tasks_cancel_right_before_proc_created(context, mocker):
 
     run_tasks = RunTasks()
 
-    async def mock_do_run_task(_, __, to_cancellable_process):
+    async def mock_do_run_task(_, __, to_cancellable_process, **kwargs):
         await run_tasks.cancel()
         task_process = MockTaskProcess()
         await to_cancellable_process(task_process)